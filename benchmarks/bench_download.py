@@ -0,0 +1,54 @@
+"""下载吞吐对比：urlretrieve 单连接 vs SegmentedDownloader 分段下载
+
+在本地起一个 HTTP 桩服务器，按连接限速，模拟单条 TCP 流受限的免费镜像。
+
+    python benchmarks/bench_download.py --size-mb 16 --rate-kb 2048 --workers 4
+"""
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+from urllib.request import urlretrieve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+core = importlib.import_module("核音乐")
+
+from stub_server import StubServer  # noqa: E402
+
+
+def measure(label, fetch, url, size):
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, "track.flac")
+        begin = time.perf_counter()
+        fetch(url, target)
+        elapsed = time.perf_counter() - begin
+        assert os.path.getsize(target) == size, f"{label}: size mismatch"
+    print(f"{label:<28} {elapsed:7.2f} s  {size / elapsed / 1024 / 1024:7.2f} MB/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--rate-kb", type=int, default=2048, help="每连接限速 KB/s")
+    parser.add_argument("--workers", type=int, default=core.DOWNLOAD_WORKERS)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    downloader = core.SegmentedDownloader(workers=args.workers)
+
+    for ranges in (True, False):
+        server = StubServer({'track.flac': size}, ranges=ranges, rate=args.rate_kb * 1024).start()
+        url = server.url('track.flac')
+        print(f"--- Range {'supported' if ranges else 'unsupported'} ---")
+        baseline = measure("urlretrieve (baseline)", urlretrieve, url, size)
+        segmented = measure(f"segmented x{args.workers}", downloader.download, url, size)
+        print(f"speedup: {baseline / segmented:.2f}x")
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
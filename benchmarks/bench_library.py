@@ -0,0 +1,102 @@
+"""本地曲库索引基准：合成曲库的写入耗时、查询延迟与增量重扫耗时
+
+    python benchmarks/bench_library.py --tracks 100000 --queries 500 --files 2000
+"""
+import argparse
+import importlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+core = importlib.import_module("核音乐")
+
+WORDS = ("love night star rain city dream blue fire heart summer moon river road light song "
+         "晴天 夜曲 稻香 青花瓷 七里香 告白 气球 彩虹 简单 爱情 海 风 花 雪 月").split()
+
+
+def phrase(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def synthetic_records(count, rng):
+    artists = [f"Artist {i} {phrase(rng, 1)}" for i in range(2000)]
+    albums = [f"{phrase(rng, 2)} {i}" for i in range(10000)]
+    for i in range(count):
+        title = f"{phrase(rng, 3)} {i}"
+        artist = rng.choice(artists)
+        yield {
+            'path': f"/music/{artist}/{i:06d} {title}.flac",
+            'title': title,
+            'artist': artist,
+            'album': rng.choice(albums),
+            'size': rng.randint(3, 60) * 1024 * 1024,
+            'mtime_ns': i,
+            'inode': i,
+        }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_queries(index, rng, count):
+    cases = {
+        'single word': lambda: rng.choice(WORDS),
+        'two words': lambda: phrase(rng, 2),
+        'prefix': lambda: rng.choice(WORDS)[:2],
+        'deep page': lambda: rng.choice(WORDS),
+    }
+    for name, make in cases.items():
+        offset = 500 if name == 'deep page' else 0
+        samples = []
+        for _ in range(count):
+            query = make()
+            begin = time.perf_counter()
+            index.search(query, limit=50, offset=offset)
+            samples.append((time.perf_counter() - begin) * 1000)
+        print(f"{name:<12} p50 {percentile(samples, 50):7.2f} ms  p95 {percentile(samples, 95):7.2f} ms  "
+              f"p99 {percentile(samples, 99):7.2f} ms")
+
+
+def bench_rescan(index, files, rng):
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(files):
+            folder = os.path.join(tmp, f"album{i % 50}")
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"Artist {i % 97} - {phrase(rng, 2)} {i}.mp3"), 'wb') as f:
+                f.write(b'\0' * 16)
+        print(f"rescan {files} files (cold):        {index.rescan([tmp]) * 1000:8.1f} ms")
+        print(f"rescan {files} files (unchanged):   {index.rescan([tmp]) * 1000:8.1f} ms")
+        touched = os.path.join(tmp, "album0", os.listdir(os.path.join(tmp, "album0"))[0])
+        with open(touched, 'ab') as f:
+            f.write(b'\0')
+        print(f"rescan {files} files (1 changed):   {index.rescan([tmp]) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--files", type=int, default=2000, help="增量重扫测试的真实文件数，0 跳过")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = core.LibraryIndex(os.path.join(tmp, "library.db"))
+        begin = time.perf_counter()
+        index.index_records(synthetic_records(args.tracks, rng))
+        print(f"index {args.tracks} tracks: {time.perf_counter() - begin:.2f} s")
+        bench_queries(index, rng, args.queries)
+        if args.files:
+            bench_rescan(index, args.files, rng)
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""播放记录基准：追加式日志 vs 每次整体重写 JSON，以及快照 + 日志尾部的启动加载耗时
+
+追加耗时与历史长度无关；整体重写（config.json 的做法）随历史增长线性变慢。
+加载分别测量纯日志重放、压缩后的快照、快照 + 未压缩尾部三种情况。
+
+    python benchmarks/bench_playlog.py --entries 100000 --tail 5000 --json playlog.json
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+core = importlib.import_module("核音乐")
+
+
+def make_track(i, distinct):
+    n = i % distinct
+    return {'url': f"http://127.0.0.1:3000/song/{n}.mp3", 'title': f"曲目 {n}", 'artist': f"歌手 {n % 500}",
+            'album': f"专辑 {n % 1200}", 'duration': 180 + n % 120}
+
+
+def fill(directory, entries, distinct, compact_records):
+    """写入 entries 条播放记录，返回每条追加的耗时（微秒）"""
+    log = core.PlayLog(directory, compact_records=compact_records, history_limit=entries)
+    samples = []
+    for i in range(entries):
+        track = make_track(i, distinct)
+        begin = time.perf_counter()
+        log.record_play(track)
+        samples.append((time.perf_counter() - begin) * 1e6)
+    log.close()
+    return samples
+
+
+def measure_load(directory, entries, runs):
+    samples = []
+    for _ in range(runs):
+        begin = time.perf_counter()
+        log = core.PlayLog(directory, compact_records=sys.maxsize, history_limit=entries)
+        samples.append((time.perf_counter() - begin) * 1000)
+        assert len(log.history) == entries, "history size mismatch"
+        log.close()
+    return samples
+
+
+def rewrite_baseline(directory, entries, distinct, sizes):
+    """每次播放整体重写一个 JSON 文件，测量历史长度为 sizes 时单次写入的耗时（毫秒）"""
+    path = os.path.join(directory, 'history.json')
+    history = [{'t': time.time(), **make_track(i, distinct)} for i in range(max(sizes))]
+    result = {}
+    for size in sizes:
+        begin = time.perf_counter()
+        core.atomic_write_json(path, history[:size])
+        result[size] = (time.perf_counter() - begin) * 1000
+    return result
+
+
+def summary(samples):
+    ordered = sorted(samples)
+    return {'median': statistics.median(ordered), 'p99': ordered[int(len(ordered) * 0.99) - 1], 'max': ordered[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000, help="播放记录条数")
+    parser.add_argument("--distinct", type=int, default=5000, help="不同曲目数")
+    parser.add_argument("--tail", type=int, default=5000, help="快照之后未压缩的日志条数")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    result = {'entries': args.entries, 'distinct': args.distinct, 'tail': args.tail}
+    with tempfile.TemporaryDirectory() as tmp:
+        # 纯日志：从不压缩
+        log_only = os.path.join(tmp, 'log-only')
+        appends = fill(log_only, args.entries, args.distinct, sys.maxsize)
+        result['append_us'] = summary(appends)
+        result['load_log_only_ms'] = summary(measure_load(log_only, args.entries, args.runs))
+        result['log_bytes'] = sum(os.path.getsize(os.path.join(log_only, name)) for name in os.listdir(log_only))
+
+        # 快照 + 尾部：前 entries - tail 条压缩进快照
+        snapshot = os.path.join(tmp, 'snapshot')
+        log = core.PlayLog(snapshot, compact_records=sys.maxsize, history_limit=args.entries)
+        for i in range(args.entries - args.tail):
+            log.record_play(make_track(i, args.distinct))
+        begin = time.perf_counter()
+        log.compact()
+        result['compact_ms'] = (time.perf_counter() - begin) * 1000
+        result['snapshot_bytes'] = os.path.getsize(log.snapshot_path)
+        log.close()
+        result['load_snapshot_ms'] = summary(measure_load(snapshot, args.entries - args.tail, args.runs))
+        log = core.PlayLog(snapshot, compact_records=sys.maxsize, history_limit=args.entries)
+        for i in range(args.entries - args.tail, args.entries):
+            log.record_play(make_track(i, args.distinct))
+        log.close()
+        result['load_snapshot_tail_ms'] = summary(measure_load(snapshot, args.entries, args.runs))
+
+        sizes = sorted({1000, 10000, args.entries})
+        result['rewrite_ms'] = rewrite_baseline(tmp, args.entries, args.distinct, sizes)
+
+    print(f"append (log):                 median {result['append_us']['median']:7.1f} us  "
+          f"p99 {result['append_us']['p99']:7.1f} us")
+    for size, ms in result['rewrite_ms'].items():
+        print(f"rewrite JSON at {size:>7} plays: {ms:9.2f} ms per play")
+    print(f"compact {args.entries - args.tail} plays:        {result['compact_ms']:7.1f} ms  "
+          f"snapshot {result['snapshot_bytes'] / 1024:.0f} KB vs log {result['log_bytes'] / 1024:.0f} KB")
+    for key, label in (('load_log_only_ms', 'load log only'), ('load_snapshot_ms', 'load snapshot'),
+                       ('load_snapshot_tail_ms', f'load snapshot + {args.tail} tail')):
+        print(f"{label + ':':<30} median {result[key]['median']:7.1f} ms  max {result[key]['max']:7.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
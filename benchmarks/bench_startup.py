@@ -0,0 +1,104 @@
+"""冷启动基准：-X importtime 导入耗时明细与进程启动到 webview.start 的时间
+
+每轮在全新子进程中运行 核音乐.py 的 main()，把 webview.start 替换为记录时间后退出，
+因此不需要图形界面；使用临时 HOME，避免读写真实配置。
+
+    python benchmarks/bench_startup.py --runs 10 --top 15 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "核音乐.py")
+
+CHILD = r"""
+import json, runpy, sys, time
+t0 = time.perf_counter()
+import webview
+
+def fake_start(*args, **kwargs):
+    sys.stdout.write("STARTUP " + json.dumps({"to_webview_start": time.perf_counter() - t0}) + "\n")
+    sys.stdout.flush()
+    raise SystemExit(0)
+
+webview.start = fake_start
+sys.argv = [sys.argv[1]]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_child(home, importtime=False):
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", CHILD, SCRIPT]
+    begin = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - begin
+    marker = [line for line in proc.stdout.splitlines() if line.startswith("STARTUP ")]
+    if proc.returncode != 0 or not marker:
+        raise RuntimeError(f"startup run failed:\n{proc.stdout}\n{proc.stderr}")
+    result = json.loads(marker[0][len("STARTUP "):])
+    result["wall"] = wall
+    return result, proc.stderr
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 输出，返回 [(模块, 嵌套深度, 自身 us, 累计 us)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="显示累计耗时最多的前 N 个顶层导入")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        os.makedirs(os.path.join(home, "Desktop"), exist_ok=True)
+        run_child(home)   # 首次运行创建配置目录，不计入统计
+        samples = [run_child(home)[0] for _ in range(args.runs)]
+        _, stderr = run_child(home, importtime=True)
+
+    to_start = [s["to_webview_start"] * 1000 for s in samples]
+    wall = [s["wall"] * 1000 for s in samples]
+    imports = parse_importtime(stderr)
+    top_level = sorted((row for row in imports if row[1] == 0), key=lambda row: -row[3])[:args.top]
+
+    print(f"time to webview.start: median {statistics.median(to_start):7.1f} ms  "
+          f"min {min(to_start):7.1f} ms  max {max(to_start):7.1f} ms")
+    print(f"process wall time:     median {statistics.median(wall):7.1f} ms  "
+          f"min {min(wall):7.1f} ms  max {max(wall):7.1f} ms")
+    print(f"\ntop {len(top_level)} top-level imports by cumulative time:")
+    for name, _, self_us, cumulative in top_level:
+        print(f"  {cumulative / 1000:8.1f} ms  (self {self_us / 1000:6.1f} ms)  {name}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "runs": args.runs,
+                "to_webview_start_ms": {"median": statistics.median(to_start), "min": min(to_start),
+                                        "max": max(to_start), "samples": to_start},
+                "wall_ms": {"median": statistics.median(wall), "min": min(wall), "max": max(wall)},
+                "imports": [{"module": name, "self_us": self_us, "cumulative_us": cumulative}
+                            for name, _, self_us, cumulative in top_level],
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""下载/IO 基准套件：对本地桩服务器无界面地驱动后端各条下载路径，输出 JSON
+
+每个 (场景, 路径) 在独立子进程中运行，使用临时 HOME，峰值 RSS 互不干扰。
+桩服务器在父进程中运行，支持 Range 开关、延迟、限速与故障注入（连接重置、503）。
+
+    python benchmarks/bench_suite.py --output bench.json
+    python benchmarks/bench_suite.py --scenario faults --path api --quick
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import urlopen, urlretrieve
+
+from stub_server import StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+# 场景：文件集合与桩服务器参数
+SCENARIOS = {
+    'fast-range': {'files': {f'track{i}.flac': 8 * MB for i in range(3)}, 'ranges': True},
+    'capped-range': {'files': {'track.flac': 16 * MB}, 'ranges': True, 'rate': 2 * MB},
+    'capped-norange': {'files': {'track.flac': 16 * MB}, 'ranges': False, 'rate': 2 * MB},
+    'latency': {'files': {f'clip{i:02d}.mp3': MB // 4 for i in range(40)}, 'ranges': True, 'latency': 0.05},
+    'faults': {'files': {f'track{i}.flac': 8 * MB for i in range(3)}, 'ranges': True,
+               'reset_rate': 0.3, 'error_rate': 0.2, 'retry_after': 0, 'seed': 3},
+}
+
+# 路径：baseline 为改造前的 urlretrieve；segmented 直接用下载引擎；api 走 Api.download_file（含重试与缓存）；
+# queue 走批量下载队列；stream 通过本地播放代理读取
+PATHS = ('baseline', 'segmented', 'api', 'queue', 'stream')
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_path(path, urls, home):
+    """子进程内执行一条下载路径，返回指标字典"""
+    os.environ['HOME'] = os.environ['USERPROFILE'] = home
+    os.makedirs(os.path.join(home, 'Desktop'), exist_ok=True)
+    sys.path.insert(0, ROOT)
+    core = importlib.import_module("核音乐")
+    api = core.Api(None)
+    out_dir = os.path.join(home, 'Desktop')
+    ttfb = []
+    errors = []
+    total = 0
+    begin = time.perf_counter()
+
+    def target(url):
+        return os.path.join(out_dir, url.rsplit('/', 1)[-1])
+
+    if path == 'baseline':
+        for url in urls:
+            started = time.perf_counter()
+            first = []
+
+            def hook(blocks, block_size, size, started=started, first=first):
+                if blocks == 1 and not first:
+                    first.append(time.perf_counter() - started)
+            try:
+                urlretrieve(url, target(url), hook)
+                total += os.path.getsize(target(url))
+                ttfb.extend(first)
+            except Exception as e:
+                errors.append(str(e))
+    elif path == 'segmented':
+        for url in urls:
+            started = time.perf_counter()
+            first = []
+
+            def progress(delta, size, started=started, first=first):
+                if not first:
+                    first.append(time.perf_counter() - started)
+            try:
+                total += api.downloader.download_with_retry(url, target(url), progress)[0]
+                ttfb.extend(first)
+            except Exception as e:
+                errors.append(str(e))
+    elif path == 'api':
+        for url in urls:
+            result = api.download_file(url, url.rsplit('/', 1)[-1])
+            if result['status'] == 'success':
+                total += os.path.getsize(result['path'])
+            else:
+                errors.append(result['error'])
+    elif path == 'queue':
+        api.enqueue_downloads([{'url': url, 'filename': url.rsplit('/', 1)[-1]} for url in urls])
+        while any(job['status'] in ('queued', 'downloading') for job in api.list_downloads()['downloads']):
+            time.sleep(0.05)
+        for job in api.list_downloads()['downloads']:
+            if job['status'] == 'done':
+                total += os.path.getsize(job['path'])
+            else:
+                errors.append(job['error'])
+    elif path == 'stream':
+        for url in urls:
+            started = time.perf_counter()
+            try:
+                with urlopen(api.get_stream_url(url)['url']) as resp:
+                    chunk = resp.read(1)
+                    ttfb.append(time.perf_counter() - started)
+                    while chunk:
+                        total += len(chunk)
+                        chunk = resp.read(core.CHUNK_SIZE)
+            except Exception as e:
+                errors.append(str(e))
+
+    elapsed = time.perf_counter() - begin
+    http = core.get_http_client().stats
+    return {
+        'path': path,
+        'files': len(urls),
+        'bytes': total,
+        'seconds': elapsed,
+        'throughput_mbps': total / elapsed / MB if elapsed else 0.0,
+        'ttfb_ms': {'p50': statistics.median(ttfb) * 1000, 'max': max(ttfb) * 1000} if ttfb else None,
+        'http_requests': http['requests'],
+        'http_retries': http['retries'],
+        'download_retries': api.downloader.stats['retries'],
+        'resumed': api.downloader.stats['resumed'],
+        'peak_rss_kb': peak_rss_kb(),
+        'errors': errors,
+    }
+
+
+def run_child(path, urls):
+    with tempfile.TemporaryDirectory() as home:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', path, '--home', home, '--urls', json.dumps(urls)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('RESULT ')]
+    if proc.returncode != 0 or not lines:
+        return {'path': path, 'errors': [f"child failed: {proc.stderr.strip()[-500:]}"]}
+    return json.loads(lines[-1][len('RESULT '):])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="只运行指定场景，可重复")
+    parser.add_argument('--path', action='append', choices=PATHS, help="只运行指定路径，可重复")
+    parser.add_argument('--quick', action='store_true', help="文件大小缩小为 1/4")
+    parser.add_argument('--output', help="把 JSON 结果写入文件（默认输出到标准输出）")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--home', help=argparse.SUPPRESS)
+    parser.add_argument('--urls', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print('RESULT ' + json.dumps(run_path(args.child, json.loads(args.urls), args.home)))
+        return
+
+    report = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'time': time.time(),
+        'scenarios': [],
+    }
+    for name in args.scenario or sorted(SCENARIOS):
+        params = dict(SCENARIOS[name])
+        files = params.pop('files')
+        if args.quick:
+            files = {file: max(64 * 1024, size // 4) for file, size in files.items()}
+        entry = {'name': name, 'params': dict(params, files=len(files), bytes=sum(files.values())), 'results': []}
+        for path in args.path or PATHS:
+            if path == 'baseline' and (params.get('reset_rate') or params.get('error_rate')):
+                continue   # urlretrieve 没有重试，故障场景下没有可比性
+            server = StubServer(files, **params).start()
+            try:
+                result = run_child(path, server.urls())
+            finally:
+                server.stop()
+            result['server'] = dict(server.stats)
+            result['complete'] = result.get('bytes') == sum(files.values())
+            entry['results'].append(result)
+            print(f"{name:<15} {path:<10} {result.get('throughput_mbps', 0):8.2f} MB/s  "
+                  f"retries {result.get('download_retries', 0)}+{result.get('http_retries', 0)}  "
+                  f"errors {len(result.get('errors', []))}{'' if result['complete'] else '  INCOMPLETE'}",
+                  file=sys.stderr)
+        report['scenarios'].append(entry)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""本地 HTTP 桩服务器：提供合成音频文件，可配置 Range 支持、延迟、限速与故障注入
+
+    server = StubServer({'a.flac': 8 << 20}, ranges=True, latency=0.05, rate=2 << 20,
+                        reset_rate=0.1, error_rate=0.1)
+    server.start()
+    url = server.url('a.flac')
+    ...
+    server.stop()
+"""
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_payload(size, seed=0):
+    """生成可复现的伪随机内容"""
+    return random.Random(seed).randbytes(size)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_HEAD(self):
+        self.server.stub.serve(self, head_only=True)
+
+    def do_GET(self):
+        self.server.stub.serve(self, head_only=False)
+
+
+class StubServer:
+    """合成文件服务器
+
+    ranges       是否支持 Range 请求
+    latency      每个请求在发送响应头前的等待秒数
+    rate         每条连接的限速（字节/秒），0 表示不限速
+    reset_rate   响应体发送到一半时断开连接的概率
+    error_rate   直接返回 503 的概率
+    retry_after  503 响应携带的 Retry-After 秒数，None 表示不带
+    etag         True 时按文件大小生成 ETag，字符串时原样使用，False 表示不带
+    """
+
+    def __init__(self, files, ranges=True, latency=0.0, rate=0, reset_rate=0.0, error_rate=0.0,
+                 retry_after=None, seed=0, etag=True):
+        self.payloads = {name: make_payload(size, seed + i) for i, (name, size) in enumerate(sorted(files.items()))}
+        self.ranges = ranges
+        self.latency = latency
+        self.rate = rate
+        self.reset_rate = reset_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.etag = etag
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'bytes_sent': 0, 'resets': 0, 'errors': 0}
+        self.server = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.port}/{name}"
+
+    def urls(self):
+        return [self.url(name) for name in sorted(self.payloads)]
+
+    def _roll(self, probability):
+        with self.lock:
+            return probability > 0 and self.random.random() < probability
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def serve(self, handler, head_only):
+        self._count('requests')
+        payload = self.payloads.get(handler.path.lstrip('/').split('?', 1)[0])
+        if self.latency:
+            time.sleep(self.latency)
+        if payload is None:
+            handler.send_error(404)
+            return
+        if not head_only and self._roll(self.error_rate):
+            self._count('errors')
+            handler.send_response(503)
+            if self.retry_after is not None:
+                handler.send_header("Retry-After", str(self.retry_after))
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        size = len(payload)
+        start, end, status = 0, size - 1, 200
+        header = handler.headers.get("Range")
+        if self.ranges and header and header.startswith("bytes="):
+            first, _, last = header[6:].partition("-")
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(0, size - int(last))
+            status = 206
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", "audio/flac")
+        handler.send_header("Content-Length", str(end - start + 1))
+        if self.ranges:
+            handler.send_header("Accept-Ranges", "bytes")
+        if self.etag:
+            handler.send_header("ETag", self.etag if isinstance(self.etag, str) else f'"{size:x}"')
+        if status == 206:
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        handler.end_headers()
+        if head_only:
+            return
+
+        reset_at = None
+        if self._roll(self.reset_rate):
+            reset_at = start + (end - start + 1) // 2
+        step = 16 * 1024
+        begin = time.perf_counter()
+        sent = 0
+        for offset in range(start, end + 1, step):
+            chunk = payload[offset:min(offset + step, end + 1)]
+            if reset_at is not None and offset + len(chunk) > reset_at:
+                self._count('resets')
+                self._count('bytes_sent', sent + reset_at - offset)
+                handler.wfile.write(chunk[:reset_at - offset])
+                handler.close_connection = True
+                return
+            handler.wfile.write(chunk)
+            sent += len(chunk)
+            if self.rate:
+                delay = sent / self.rate - (time.perf_counter() - begin)
+                if delay > 0:
+                    time.sleep(delay)
+        self._count('bytes_sent', sent)
@@ -0,0 +1,23 @@
+"""单元测试：在仓库根目录运行 python -m unittest discover -s tests -t .
+
+导入被测模块前把 HOME 指向临时目录，测试不会读写真实的配置、缓存与日志；
+benchmarks/ 加入 sys.path 以复用其中的本地桩服务器。
+"""
+import importlib
+import logging
+import os
+import sys
+import tempfile
+
+HOME = tempfile.mkdtemp(prefix="coremusic-test-")
+os.environ['HOME'] = os.environ['USERPROFILE'] = HOME
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+core = importlib.import_module("核音乐")
+
+# 被测代码在故障路径上会打警告日志，测试输出只保留 unittest 自己的结果
+logging.getLogger().setLevel(logging.CRITICAL)
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from tests import core
+
+
+class AudioCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.cache = core.AudioCache(root=os.path.join(self.root, "cache"), budget=1 << 20)
+
+    def source(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_put_and_get(self):
+        src = self.source("a.flac", b'a' * 1000)
+        path = self.cache.put_file("https://music.example/a.flac", src)
+        self.assertEqual(self.cache.get("https://music.example/a.flac"), path)
+        self.assertEqual(self.read(path), b'a' * 1000)
+        self.assertTrue(os.path.exists(src))
+        self.assertEqual(os.listdir(os.path.join(self.cache.root, "tmp")), [])
+        self.assertIsNone(self.cache.get("https://music.example/b.flac"))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_move_and_shared_content(self):
+        first = self.cache.put_file("https://music.example/a.flac", self.source("a", b'x' * 100), move=True)
+        second = self.cache.put_file("https://mirror.example/a.flac", self.source("b", b'x' * 100), move=True)
+        self.assertEqual(first, second)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self.assertEqual(self.cache.stats()['bytes'], 100)
+        self.assertFalse(os.path.exists(os.path.join(self.root, "a")))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "b")))
+
+    def test_eviction(self):
+        for n in range(3):
+            self.cache.put_file(f"https://music.example/{n}.flac", self.source(str(n), bytes([n]) * 400_000))
+        self.assertIsNone(self.cache.get("https://music.example/0.flac"))
+        self.assertIsNotNone(self.cache.get("https://music.example/2.flac"))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_index_persists(self):
+        path = self.cache.put_file("https://music.example/a.flac", self.source("a", b'a' * 10))
+        reopened = core.AudioCache(root=self.cache.root)
+        self.assertEqual(reopened.get("https://music.example/a.flac"), path)
+
+    def test_copy_does_not_block_lookups(self):
+        cached = self.cache.put_file("https://music.example/a.flac", self.source("a", b'a' * 10))
+        copying = threading.Event()
+
+        def slow_copy(src, dst):
+            copying.set()
+            time.sleep(0.5)
+            shutil.copyfile(src, dst)
+            return 'copy'
+
+        with mock.patch.object(core, 'clone_or_copy', slow_copy):
+            writer = threading.Thread(target=self.cache.put_file,
+                                      args=("https://music.example/b.flac", self.source("b", b'b' * 10)))
+            writer.start()
+            self.assertTrue(copying.wait(5))
+            started = time.monotonic()
+            self.assertEqual(self.cache.get("https://music.example/a.flac"), cached)
+            self.assertLess(time.monotonic() - started, 0.2)
+            writer.join()
+        self.assertEqual(self.read(self.cache.get("https://music.example/b.flac")), b'b' * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from stub_server import StubServer, make_payload
+from tests import HOME, core
+
+SIZE = 200 * 1024
+
+
+class DownloadDedupTest(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.server = StubServer({'a.flac': SIZE}, etag='"v1"').start()
+        self.addCleanup(self.server.stop)
+        self.url = self.server.url('a.flac')
+        self.api = core.Api(None, config=core.ConfigStore(os.path.join(root, "config.json")))
+        self.api.__dict__['download_index'] = core.DownloadIndex(os.path.join(root, "downloaded.json"))
+        self.api.__dict__['cache'] = core.AudioCache(root=os.path.join(root, "cache"))
+        self.desktop = os.path.join(HOME, "Desktop")
+        os.makedirs(self.desktop, exist_ok=True)
+        self.stem = uuid.uuid4().hex
+        self.addCleanup(self.remove_downloads)
+
+    def remove_downloads(self):
+        for name in os.listdir(self.desktop):
+            if name.startswith(self.stem):
+                os.remove(os.path.join(self.desktop, name))
+
+    def download(self):
+        result = self.api.download_file(self.url, f"{self.stem}.flac")
+        self.assertEqual(result['status'], 'success', result.get('error'))
+        return result
+
+    def entry(self):
+        return self.api.download_index.urls[core.normalize_url(self.url)]
+
+    def expire(self):
+        """让下次下载前向上游确认版本"""
+        self.entry()['checked'] -= core.DOWNLOAD_REVALIDATE_AFTER
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_validators_are_recorded(self):
+        self.download()
+        self.assertEqual((self.entry()['etag'], self.entry()['size']), ('"v1"', SIZE))
+        reloaded = core.DownloadIndex(self.api.download_index.path)
+        self.assertEqual(reloaded.urls[core.normalize_url(self.url)]['etag'], '"v1"')
+
+    def test_unchanged_upstream_is_deduplicated(self):
+        first = self.download()
+        self.expire()
+        requests_before = self.server.stats['requests']
+        second = self.download()
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(second['path'], first['path'])
+        # 只发了一次 HEAD 探测
+        self.assertEqual(self.server.stats['requests'], requests_before + 1)
+
+    def test_changed_etag_with_same_size_downloads_again(self):
+        first = self.download()
+        self.server.payloads['a.flac'] = make_payload(SIZE, seed=99)
+        self.server.etag = '"v2"'
+        self.expire()
+        second = self.download()
+        self.assertFalse(second['deduplicated'])
+        self.assertNotEqual(second['path'], first['path'])
+        self.assertEqual(self.read(second['path']), self.server.payloads['a.flac'])
+        self.assertEqual(self.entry()['etag'], '"v2"')
+
+    def test_cache_hit_keeps_validators(self):
+        index = self.api.download_index
+        index.record(self.url, 'digest', SIZE, {'etag': '"v1"', 'last_modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+        index.record(self.url, 'digest', SIZE)
+        self.assertEqual((self.entry()['etag'], self.entry()['last_modified']),
+                         ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT'))
+        index.record(self.url, 'other', SIZE)
+        self.assertIsNone(self.entry()['etag'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import threading
+import unittest
+
+from tests import core
+
+
+class DownloadQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.release = threading.Event()
+        self.queue = core.DownloadQueue(self.download, notify=self.notify, workers=1, progress_interval=0)
+        self.addCleanup(self.queue.executor.shutdown)
+        self.addCleanup(self.release.set)
+
+    def notify(self, event, payload, key=None):
+        self.events.append((payload['id'], payload['status']))
+
+    def download(self, job, progress, cancel):
+        """等 release 或取消；文件名为 fail 时出错"""
+        progress(0, 10)
+        progress(10, 10)
+        while not self.release.wait(0.01):
+            if cancel.is_set():
+                raise core.DownloadCancelled()
+        if job['filename'] == 'fail':
+            raise IOError("boom")
+        return f"/tmp/{job['filename']}"
+
+    def statuses(self):
+        return {job['id']: job['status'] for job in self.queue.list()}
+
+    def wait_for(self, job_id, status):
+        future = self.queue.jobs[job_id]['future']
+        if not future.cancelled():
+            future.result(5)
+        self.assertEqual(self.statuses()[job_id], status)
+
+    def test_done_and_error(self):
+        first, second = self.queue.enqueue([{'url': 'u1', 'filename': 'a'}, {'url': 'u2', 'filename': 'fail'}])
+        self.release.set()
+        self.wait_for(first, 'done')
+        self.wait_for(second, 'error')
+        self.assertEqual(self.queue.jobs[second]['error'], "boom")
+        self.assertEqual(self.events[-1], (second, 'error'))
+
+    def test_cancel_running_and_queued(self):
+        running, queued = self.queue.enqueue([{'url': 'u1', 'filename': 'a'}, {'url': 'u2', 'filename': 'b'}])
+        self.assertTrue(self.queue.cancel(queued))
+        self.assertEqual(self.statuses()[queued], 'cancelled')
+        self.assertTrue(self.queue.cancel(running))
+        self.wait_for(running, 'cancelled')
+        self.assertIn((queued, 'cancelled'), self.events)
+        self.assertEqual(self.events[-1], (running, 'cancelled'))
+        self.assertFalse(self.queue.cancel(running))
+
+    def test_cancel_between_start_and_check(self):
+        # cancel() 到达时 future 已开始运行（取消不掉），但 _worker 还没检查取消标记
+        blocker, = self.queue.enqueue([{'url': 'u1', 'filename': 'a'}])
+        job = dict(self.queue.jobs[blocker], id='late', cancel=threading.Event(), status='queued')
+        self.queue.jobs['late'] = job
+        job['cancel'].set()
+        self.queue._worker(job)
+        self.assertEqual(self.statuses()['late'], 'cancelled')
+        self.assertEqual(self.events[-1], ('late', 'cancelled'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import re
+import threading
+import unittest
+
+from tests import core
+
+
+class FakeWindow:
+    """记录 evaluate_js 推送的批次"""
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+        self.delivered = threading.Event()
+
+    def evaluate_js(self, script):
+        detail = re.search(r'\}\)\((.*)\)$', script, re.S).group(1)
+        with self.lock:
+            self.batches.append(json.loads(detail))
+        self.delivered.set()
+
+    def events(self):
+        with self.lock:
+            return [event for batch in self.batches for event in batch]
+
+
+class EventBusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.window = FakeWindow()
+        # 先空推一次，派发线程在足够长的间隔内只积攒，测试里的 publish 都由显式 flush 推送
+        self.bus = core.EventBus(self.window, interval=60)
+        self.bus.flush()
+        self.addCleanup(self.bus.stop)
+
+    def test_keyed_events_coalesce(self):
+        for percent in range(100):
+            self.bus.publish('download-progress', {'id': 1, 'percent': percent}, key=1)
+        self.bus.publish('download-progress', {'id': 2, 'percent': 5}, key=2)
+        self.assertEqual(self.bus.flush(), 2)
+        self.assertEqual(self.window.events(), [['download-progress', {'id': 1, 'percent': 99}],
+                                                ['download-progress', {'id': 2, 'percent': 5}]])
+        stats = self.bus.stats()
+        self.assertEqual((stats['published'], stats['coalesced'], stats['delivered']), (101, 99, 2))
+
+    def test_unkeyed_events_keep_order(self):
+        for i in range(5):
+            self.bus.publish('log', i)
+        self.bus.flush()
+        self.assertEqual(len(self.window.batches), 1)
+        self.assertEqual([payload for _, payload in self.window.events()], [0, 1, 2, 3, 4])
+
+    def test_dispatch_thread_flushes(self):
+        bus = core.EventBus(self.window, interval=0.01)
+        self.addCleanup(bus.stop)
+        bus.publish('state', {'playing': True}, key='player')
+        self.assertTrue(self.window.delivered.wait(5))
+        self.assertEqual(self.window.events(), [['state', {'playing': True}]])
+
+    def test_stop_flushes_pending(self):
+        self.bus.publish('state', 'a', key='player')
+        self.bus.flush()
+        self.bus.publish('state', 'b', key='player')
+        self.bus.stop()
+        self.assertEqual(self.window.events(), [['state', 'a'], ['state', 'b']])
+        self.assertEqual(self.bus.stats()['pending'], 0)
+
+    def test_window_errors_are_counted(self):
+        self.window.evaluate_js = lambda script: 1 / 0
+        self.bus.publish('state', 'a')
+        self.assertEqual(self.bus.flush(), 1)
+        self.assertEqual(self.bus.stats()['errors'], 1)
+
+    def test_no_window(self):
+        bus = core.EventBus(None)
+        bus.publish('state', 'a')
+        self.assertEqual(bus.stats()['published'], 0)
+        self.assertIsNone(bus.thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from tests import ROOT, core
+
+# 第二次启动：拿不到锁时把参数转发给已运行的实例；退出码 0 转发成功，1 转发失败，2 意外拿到了锁
+SECOND_LAUNCH = """
+import sys
+from tests import core
+lock = core.InstanceLock(sys.argv[1], sys.argv[2])
+if lock.acquire():
+    sys.exit(2)
+sys.exit(0 if lock.forward(sys.argv[3:], timeout=5) else 1)
+"""
+
+
+class InstanceLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.lock_path = os.path.join(self.root, "instance.lock")
+        self.info_path = os.path.join(self.root, "instance.json")
+        self.first = core.InstanceLock(self.lock_path, self.info_path)
+        self.addCleanup(self.first.release)
+        self.assertTrue(self.first.acquire())
+        self.first.listen()
+        self.received = []
+        self.arrived = threading.Event()
+
+    def handler(self, argv):
+        self.received.append(argv)
+        self.arrived.set()
+
+    def second_launch(self, *argv):
+        return subprocess.run([sys.executable, '-c', SECOND_LAUNCH, self.lock_path, self.info_path, *argv],
+                              cwd=ROOT, capture_output=True, timeout=60).returncode
+
+    def test_second_launch_hands_off(self):
+        self.first.set_handler(self.handler)
+        self.assertEqual(self.second_launch('歌曲.flac', '--play'), 0)
+        self.assertTrue(self.arrived.wait(5))
+        self.assertEqual(self.received, [['歌曲.flac', '--play']])
+
+    def test_handoff_before_handler_is_queued(self):
+        self.assertTrue(core.InstanceLock(self.lock_path, self.info_path).forward(['a.mp3'], timeout=5))
+        self.first.set_handler(self.handler)
+        self.assertTrue(self.arrived.wait(5))
+        self.assertEqual(self.received, [['a.mp3']])
+
+    def test_bad_token_is_rejected(self):
+        with open(self.info_path, encoding='utf-8') as f:
+            info = json.load(f)
+        forged = os.path.join(self.root, "forged.json")
+        with open(forged, 'w', encoding='utf-8') as f:
+            json.dump(dict(info, token='0' * 32), f)
+        self.first.set_handler(self.handler)
+        self.assertFalse(core.InstanceLock(self.lock_path, forged).forward(['a.mp3'], timeout=0.2))
+        self.assertEqual(self.received, [])
+
+    @unittest.skipIf(sys.platform == 'win32', "POSIX 权限位")
+    def test_info_file_is_private(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.info_path).st_mode), 0o600)
+        self.first.publish(rpc_url="http://127.0.0.1:1/", rpc_token="t")
+        self.assertEqual(stat.S_IMODE(os.stat(self.info_path).st_mode), 0o600)
+        with open(self.info_path, encoding='utf-8') as f:
+            info = json.load(f)
+        self.assertEqual((info['pid'], info['rpc_token']), (os.getpid(), "t"))
+
+    def test_release_frees_lock(self):
+        self.first.release()
+        self.assertFalse(os.path.exists(self.info_path))
+        self.assertEqual(self.second_launch('a.mp3'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tests import core
+
+
+class Recorder:
+    """代替 EventBus，记录推送给页面的事件"""
+
+    def __init__(self):
+        self.events = []
+        self.arrived = threading.Event()
+
+    def publish(self, topic, payload, key=None):
+        self.events.append((topic, payload))
+        self.arrived.set()
+
+
+class SubmitJobTest(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.api = core.Api(None, config=core.ConfigStore(os.path.join(root, "config.json")))
+        self.events = self.api.__dict__['events'] = Recorder()
+        self.addCleanup(self.api.backend.stop)
+
+    def test_result_is_delivered_as_event(self):
+        release = threading.Event()
+        self.api.library_search = lambda query: release.wait(5) and {'status': 'success', 'query': query}
+        started = time.monotonic()
+        reply = self.api.submit_job('library_search', ["晴天"])
+        # 立即返回，不等任务完成
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(reply['status'], 'accepted')
+        release.set()
+        self.assertTrue(self.events.arrived.wait(5))
+        self.assertEqual(self.events.events, [('job', {'job_id': reply['job_id'], 'method': 'library_search',
+                                                      'result': {'status': 'success', 'query': "晴天"}})])
+
+    def test_failure_is_delivered_as_error(self):
+        self.api.get_album = lambda album_id: 1 / 0
+        self.api.submit_job('get_album', [1])
+        self.assertTrue(self.events.arrived.wait(5))
+        self.assertEqual(self.events.events[0][1]['result']['status'], 'error')
+
+    def test_unknown_method_rejected(self):
+        self.assertEqual(self.api.submit_job('close_app')['status'], 'error')
+
+    def test_call_later(self):
+        fired = threading.Event()
+        started = time.monotonic()
+        self.api.backend.call_later(0.1, fired.set)
+        self.assertTrue(fired.wait(5))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from tests import core
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        mirror = self.server.mirror
+        with mirror.lock:
+            mirror.requests += 1
+            status = mirror.statuses.pop(0) if mirror.statuses else mirror.status
+        if mirror.delay:
+            time.sleep(mirror.delay)
+        body = json.dumps({'mirror': mirror.name, 'path': self.path}).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class FakeMirror:
+    """返回 JSON 的本地镜像，可设置响应前的延迟与状态码；statuses 为最先几个请求依次使用的状态码"""
+
+    def __init__(self, name, delay=0.0, status=200, statuses=()):
+        self.name = name
+        self.delay = delay
+        self.status = status
+        self.statuses = list(statuses)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MirrorHandler)
+        self.server.daemon_threads = True
+        self.server.mirror = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MirrorPoolTest(unittest.TestCase):
+
+    def mirrors(self, *mirrors, retries=1):
+        for mirror in mirrors:
+            self.addCleanup(mirror.stop)
+        pool = core.MirrorPool([mirror.url for mirror in mirrors],
+                               http=core.HttpClient(retries=retries, backoff_base=0.01))
+        self.addCleanup(pool.executor.shutdown, wait=False)
+        return pool
+
+    def test_single_mirror(self):
+        pool = self.mirrors(FakeMirror('a'))
+        self.assertEqual(pool.get('/search', {'q': 'x'}), {'mirror': 'a', 'path': '/api/search?q=x'})
+        self.assertEqual(pool.stats()[0]['wins'], 1)
+        with self.assertRaises(ValueError):
+            core.MirrorPool([])
+
+    def test_single_mirror_retries_with_backoff(self):
+        mirror = FakeMirror('only', statuses=[503])
+        pool = self.mirrors(mirror, retries=3)
+        self.assertEqual(pool.get('/search')['mirror'], 'only')
+        self.assertEqual(mirror.requests, 2)
+        self.assertEqual(pool.http.stats, {'requests': 2, 'retries': 1})
+
+    def test_music_client_without_mirrors_retries(self):
+        mirror = FakeMirror('only', statuses=[503])
+        self.addCleanup(mirror.stop)
+        client = core.MusicApiClient(mirror.url, http=core.HttpClient(retries=3, backoff_base=0.01), disk_dir=None)
+        self.addCleanup(client.mirrors.executor.shutdown, wait=False)
+        self.assertEqual(client.search("晴天")['mirror'], 'only')
+
+    def test_retries_are_bounded(self):
+        mirror = FakeMirror('only', status=503)
+        pool = self.mirrors(mirror, retries=3)
+        with self.assertRaises(requests.HTTPError) as caught:
+            pool.get('/search')
+        self.assertEqual(caught.exception.response.status_code, 503)
+        self.assertEqual(mirror.requests, 3)
+
+    def test_slow_mirror_is_hedged(self):
+        slow, fast = FakeMirror('slow', delay=3), FakeMirror('fast')
+        pool = self.mirrors(slow, fast)
+        started = time.monotonic()
+        self.assertEqual(pool.get('/search')['mirror'], 'fast')
+        elapsed = time.monotonic() - started
+        # 没有延迟样本时在默认对冲延迟后向第二个镜像发请求，不等慢镜像返回
+        self.assertGreaterEqual(elapsed, core.HEDGE_DEFAULT_DELAY)
+        self.assertLess(elapsed, 2)
+        slow_stats, fast_stats = pool.stats()
+        self.assertEqual((fast_stats['hedged'], fast_stats['wins'], slow_stats['wins']), (1, 1, 0))
+
+        # 之后按延迟排序，直接选快的镜像，不再对冲
+        pool.get('/search')
+        self.assertEqual(slow.requests, 1)
+        self.assertEqual(pool.stats()[1]['hedged'], 1)
+
+    def test_failed_mirror_fails_over_without_waiting(self):
+        broken, healthy = FakeMirror('broken', status=503), FakeMirror('healthy', delay=0.05)
+        pool = self.mirrors(broken, healthy)
+        started = time.monotonic()
+        self.assertEqual(pool.get('/search')['mirror'], 'healthy')
+        self.assertLess(time.monotonic() - started, core.HEDGE_DEFAULT_DELAY)
+        self.assertEqual(pool.stats()[1]['hedged'], 0)
+
+    def test_breaker_ejects_failing_mirror(self):
+        # 健康镜像慢于默认对冲延迟；出错的镜像没有延迟样本，得分更低，熔断前一直排在前面
+        broken, healthy = FakeMirror('broken', status=503), FakeMirror('healthy', delay=core.HEDGE_DEFAULT_DELAY + 0.1)
+        pool = self.mirrors(broken, healthy)
+        for _ in range(core.BREAKER_FAILURES):
+            self.assertEqual(pool.get('/search')['mirror'], 'healthy')
+        stats = pool.stats()[0]
+        self.assertEqual((stats['healthy'], stats['trips'], stats['errors']), (False, 1, core.BREAKER_FAILURES))
+
+        # 熔断期间即使健康镜像超过对冲延迟仍未返回，也不向它发对冲请求
+        pool.get('/search')
+        self.assertEqual(broken.requests, core.BREAKER_FAILURES)
+
+        # 冷却到期后放行一个试探请求，失败立即再次熔断
+        pool.mirrors[0].open_until = time.monotonic()
+        self.assertEqual(pool.get('/search')['mirror'], 'healthy')
+        self.assertEqual(broken.requests, core.BREAKER_FAILURES + 1)
+        self.assertEqual(pool.stats()[0]['trips'], 2)
+
+        # 试探成功则恢复
+        broken.status = 200
+        pool.mirrors[0].open_until = time.monotonic()
+        self.assertEqual(pool.get('/search')['mirror'], 'broken')
+        self.assertTrue(pool.stats()[0]['healthy'])
+
+    def test_half_open_mirror_gets_a_single_probe(self):
+        broken, healthy = FakeMirror('broken', status=503), FakeMirror('healthy', delay=core.HEDGE_DEFAULT_DELAY + 0.1)
+        pool = self.mirrors(broken, healthy)
+        for _ in range(core.BREAKER_FAILURES):
+            pool.get('/search')
+
+        # 冷却到期时同时到来的请求里只有一个发往该镜像，试探在途期间其余请求走健康镜像
+        broken.status, broken.delay = 200, 0.3
+        pool.mirrors[0].open_until = time.monotonic()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.get('/search')['mirror'])) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(broken.requests, core.BREAKER_FAILURES + 1)
+        self.assertEqual(sorted(results), ['broken', 'healthy', 'healthy', 'healthy'])
+        self.assertTrue(pool.stats()[0]['healthy'])
+        self.assertFalse(pool.mirrors[0].probing)
+
+    def test_all_mirrors_ejected_still_tried(self):
+        pool = self.mirrors(FakeMirror('a', status=503), FakeMirror('b', status=503))
+        for _ in range(core.BREAKER_FAILURES):
+            with self.assertRaises(requests.HTTPError):
+                pool.get('/search')
+        self.assertEqual([stats['healthy'] for stats in pool.stats()], [False, False])
+        with self.assertRaises(requests.HTTPError):
+            pool.get('/search')
+        self.assertEqual(sum(stats['requests'] for stats in pool.stats()), 2 * core.BREAKER_FAILURES + 2)
+
+    def test_client_error_is_not_retried_elsewhere(self):
+        missing, other = FakeMirror('missing', status=404), FakeMirror('other')
+        pool = self.mirrors(missing, other)
+        with self.assertRaises(requests.HTTPError) as caught:
+            pool.get('/song/1')
+        self.assertEqual(caught.exception.response.status_code, 404)
+        self.assertEqual(other.requests, 0)
+        self.assertEqual(pool.stats()[0]['failures'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tests import core
+
+
+def track(n):
+    return {'url': f"https://music.example/{n}.flac", 'title': f"曲目 {n}", 'artist': "歌手"}
+
+
+class PlayLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def open(self, **kwargs):
+        log = core.PlayLog(self.directory, **kwargs)
+        self.addCleanup(log.close)
+        return log
+
+    def reopen(self, log, **kwargs):
+        log.close()
+        return self.open(**kwargs)
+
+    @staticmethod
+    def state(log):
+        return {
+            'recent': log.recent(limit=1000),
+            'favorites': log.list_favorites(),
+            'playlists': [log.get_playlist(playlist['id']) for playlist in log.list_playlists()],
+        }
+
+    def populate(self, log):
+        for n in range(5):
+            log.record_play(track(n))
+        log.set_favorite(track(1))
+        log.set_favorite(track(2))
+        log.set_favorite(track(1), favorite=False)
+        playlist_id = log.create_playlist("通勤")
+        log.add_to_playlist(playlist_id, [track(3), track(7), track(8)])
+        log.remove_from_playlist(playlist_id, 1)
+        log.rename_playlist(playlist_id, "通勤路上")
+        log.delete_playlist(log.create_playlist("临时"))
+        return playlist_id
+
+    def log_files(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith('playlog.'))
+
+    def test_replay(self):
+        log = self.open()
+        playlist_id = self.populate(log)
+        before = self.state(log)
+        log = self.reopen(log)
+        self.assertEqual(self.state(log), before)
+        self.assertEqual(log.stats()['tail'], 14)
+        self.assertEqual(before['playlists'][0]['name'], "通勤路上")
+        self.assertEqual([t['url'] for t in log.get_playlist(playlist_id)['tracks']],
+                         [track(3)['url'], track(8)['url']])
+        self.assertEqual([entry['track']['url'] for entry in before['favorites']], [track(2)['url']])
+
+    def test_compaction(self):
+        log = self.open()
+        self.populate(log)
+        log.compact()
+        self.assertEqual(self.log_files(), ['playlog.1.jsonl', core.PLAYLOG_SNAPSHOT])
+        log.record_play(track(9))
+        log.clear_history()
+        log.record_play(track(4))
+        before = self.state(log)
+        log = self.reopen(log)
+        self.assertEqual(self.state(log), before)
+        self.assertEqual(log.stats()['tail'], 3)
+
+        # 只被已清空的历史引用的曲目在下一次压缩时丢弃，歌单与收藏引用的保留
+        log.compact()
+        log = self.reopen(log)
+        self.assertEqual(self.state(log), before)
+        self.assertEqual(log.stats()['tracks'], 4)
+        self.assertEqual(log.stats()['generation'], 2)
+
+    def test_history_limit(self):
+        log = self.open(history_limit=3)
+        for n in range(10):
+            log.record_play(track(n))
+        log.compact()
+        log = self.reopen(log, history_limit=3)
+        self.assertEqual([entry['track']['url'] for entry in log.recent()], [track(n)['url'] for n in (9, 8, 7)])
+
+    def test_torn_last_line_is_skipped(self):
+        log = self.open()
+        log.record_play(track(1))
+        log.close()
+        with open(os.path.join(self.directory, 'playlog.0.jsonl'), 'ab') as f:
+            f.write(b'{"op":"play","t":1,"tr')
+        log = self.open()
+        self.assertEqual(log.stats()['skipped'], 1)
+        log.record_play(track(2))
+        log = self.reopen(log)
+        self.assertEqual(log.stats()['skipped'], 1)
+        self.assertEqual([entry['track']['url'] for entry in log.recent()], [track(2)['url'], track(1)['url']])
+
+    def test_logs_left_by_interrupted_compaction_are_dropped(self):
+        log = self.open()
+        log.record_play(track(1))
+        log.compact()
+        log.close()
+        # 压缩在删除旧日志之前中断：旧日志仍在，但其内容已在快照里
+        stale = os.path.join(self.directory, 'playlog.0.jsonl')
+        with open(stale, 'wb') as f:
+            f.write(b'{"op":"play","t":1,"track":{"url":"https://music.example/1.flac"}}\n')
+        log = self.open()
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(len(log.recent()), 1)
+
+    def test_automatic_compaction(self):
+        log = self.open(compact_records=5)
+        for n in range(6):
+            log.record_play(track(n))
+        deadline = time.monotonic() + 5
+        while log.stats()['compactions'] < 1:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        log = self.reopen(log)
+        self.assertEqual(len(log.recent()), 6)
+
+    def test_appends_during_compaction_are_kept(self):
+        log = self.open()
+        playlist_id = log.create_playlist("并发")
+        stop = threading.Event()
+
+        def compact_repeatedly():
+            while not stop.is_set():
+                log.compact()
+
+        compactor = threading.Thread(target=compact_repeatedly)
+        compactor.start()
+        try:
+            for n in range(300):
+                log.record_play(track(n % 40))
+                if n % 3 == 0:
+                    log.add_to_playlist(playlist_id, [track(1000 + n)])
+                if n % 50 == 0:
+                    log.clear_history()
+        finally:
+            stop.set()
+            compactor.join()
+        before = self.state(log)
+        log = self.reopen(log)
+        self.assertEqual(self.state(log), before)
+        self.assertEqual(len(before['playlists'][0]['tracks']), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
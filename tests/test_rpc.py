@@ -0,0 +1,88 @@
+import unittest
+
+import requests
+
+from tests import core
+
+TOKEN = "test-token"
+
+
+class FakeApi:
+    RPC_METHODS = ('add',)
+
+    def add(self, a, b):
+        return {'status': 'success', 'sum': a + b}
+
+
+class RpcServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rpc = core.RpcServer(FakeApi(), TOKEN, host='127.0.0.1', port=0)
+        self.url = f"http://127.0.0.1:{self.rpc.start()}/"
+        self.addCleanup(self.rpc.stop)
+        self.session = requests.Session()
+        self.addCleanup(self.session.close)
+
+    def post(self, payload, token=TOKEN, **headers):
+        if token is not None:
+            headers['Authorization'] = f'Bearer {token}'
+        return self.session.post(self.url, json=payload, headers=headers, timeout=10)
+
+    def test_token_required(self):
+        with self.assertRaises(ValueError):
+            core.RpcServer(FakeApi(), None)
+
+    def test_call(self):
+        resp = self.post({'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [2, 3]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {'jsonrpc': '2.0', 'id': 1, 'result': {'status': 'success', 'sum': 5}})
+
+    def test_batch_and_errors(self):
+        resp = self.post([
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': {'a': 1, 'b': 1}},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'missing'},
+            {'jsonrpc': '2.0', 'id': 3, 'method': 'add', 'params': [1]},
+            {'jsonrpc': '2.0', 'method': 'add', 'params': [1, 2]},
+        ])
+        replies = {reply['id']: reply for reply in resp.json()}
+        self.assertEqual(sorted(replies), [1, 2, 3])
+        self.assertEqual(replies[1]['result']['sum'], 2)
+        self.assertEqual(replies[2]['error']['code'], core.RpcServer.METHOD_NOT_FOUND)
+        self.assertEqual(replies[3]['error']['code'], core.RpcServer.INVALID_PARAMS)
+
+    def test_missing_or_wrong_token(self):
+        request = {'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [2, 3]}
+        for token in (None, 'wrong'):
+            resp = self.post(request, token=token)
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.headers['WWW-Authenticate'], 'Bearer')
+        resp = self.post(request, token=None, Authorization=f'Basic {TOKEN}')
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(self.session.get(self.url, timeout=10).status_code, 401)
+        self.assertEqual(self.rpc.stats()['rejected'], 4)
+
+    def test_foreign_host_rejected(self):
+        # 经 DNS 重绑定访问时 Host 是攻击者的域名
+        request = {'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [2, 3]}
+        resp = self.post(request, Host=f'evil.example:{self.rpc.port}')
+        self.assertEqual(resp.status_code, 403)
+        resp = self.post(request, Host=f'localhost:{self.rpc.port}')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_describe(self):
+        resp = self.session.get(self.url, headers={'Authorization': f'Bearer {TOKEN}'}, timeout=10)
+        self.assertEqual(resp.json()['methods'], ['add'])
+
+    def test_allowed_hosts(self):
+        self.assertIsNone(core.RpcServer(FakeApi(), TOKEN, host='0.0.0.0', port=1).allowed_hosts())
+        self.assertIn('[::1]:8765', core.RpcServer(FakeApi(), TOKEN, host='::1', port=8765).allowed_hosts())
+
+    def test_is_loopback(self):
+        for host in ('127.0.0.1', '::1', 'localhost', 'LOCALHOST'):
+            self.assertTrue(core.is_loopback(host), host)
+        for host in ('0.0.0.0', '192.168.1.2', 'example.com', ''):
+            self.assertFalse(core.is_loopback(host), host)
+
+
+if __name__ == '__main__':
+    unittest.main()
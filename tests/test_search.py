@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tests import core
+
+
+class FakeMusic:
+    """代替 MusicApiClient：关键词为 slow 的搜索等到 release 才返回"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def search(self, keywords, limit, offset):
+        if keywords == 'slow':
+            self.started.set()
+            self.release.wait(5)
+        return {'keywords': keywords}
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.api = core.Api(None, config=core.ConfigStore(os.path.join(root, "config.json")))
+        self.music = self.api.__dict__['music'] = FakeMusic()
+        self.addCleanup(self.music.release.set)
+
+    def search_in_background(self, keywords):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.api.search(keywords)))
+        thread.start()
+        self.assertTrue(self.music.started.wait(5))
+        return thread, results
+
+    def test_search_returns_without_waiting(self):
+        started = time.monotonic()
+        self.assertEqual(self.api.search("晴天"), {'status': 'success', 'data': {'keywords': "晴天"}})
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    def test_superseded_search_is_cancelled(self):
+        thread, results = self.search_in_background('slow')
+        self.assertEqual(self.api.search("newer")['status'], 'success')
+        self.music.release.set()
+        thread.join()
+        self.assertEqual(results, [{'status': 'cancelled'}])
+
+    def test_cancel_search(self):
+        thread, results = self.search_in_background('slow')
+        self.assertEqual(self.api.cancel_search(), {'status': 'success'})
+        self.music.release.set()
+        thread.join()
+        self.assertEqual(results, [{'status': 'cancelled'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
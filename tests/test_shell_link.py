@@ -0,0 +1,131 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import uuid
+
+from tests import core
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# 参考文件 data/core_music.lnk 的参数；目标不存在，大小与时间戳为 0，内容与平台无关
+REFERENCE = dict(target="C:\\CoreMusic\\核音乐.exe", working_dir="C:\\CoreMusic", description="核音乐播放器",
+                 arguments="--minimized", icon="C:\\CoreMusic\\核音乐.exe", icon_index=1, ansi_encoding='gbk')
+
+SHELL_LINK_CLSID = uuid.UUID('00021401-0000-0000-C000-000000000046')
+
+
+def cstring(data, offset, width=1):
+    """读取 offset 处以 NUL 结尾的字符串（width=2 为 UTF-16LE）"""
+    end = offset
+    while data[end:end + width] != b'\0' * width:
+        end += width
+    return data[offset:end]
+
+
+def parse_shell_link(data):
+    """按 MS-SHLLINK 独立解析被测函数生成的结构：ShellLinkHeader、LinkInfo、StringData"""
+    (header_size, clsid, flags, attributes, created, accessed, written, size, icon_index,
+     show_command, hotkey) = struct.unpack_from('<I16sIIQQQIiIH', data)
+    link = {'header_size': header_size, 'clsid': uuid.UUID(bytes_le=clsid), 'flags': flags,
+            'attributes': attributes, 'times': (created, accessed, written), 'size': size,
+            'icon_index': icon_index, 'show_command': show_command, 'hotkey': hotkey}
+    offset = header_size
+    if flags & 0x01:                                            # HasLinkTargetIDList
+        offset += 2 + struct.unpack_from('<H', data, offset)[0]
+    if flags & 0x02:                                            # HasLinkInfo
+        info = data[offset:offset + struct.unpack_from('<I', data, offset)[0]]
+        (_, info_header, info_flags, volume_offset, base_offset, _, suffix_offset,
+         base_unicode_offset, suffix_unicode_offset) = struct.unpack_from('<9I', info)
+        volume_size, drive_type = struct.unpack_from('<II', info, volume_offset)
+        link['link_info'] = {
+            'header_size': info_header, 'flags': info_flags, 'drive_type': drive_type,
+            'volume_id_size': volume_size,
+            'base_ansi': cstring(info, base_offset),
+            'suffix_ansi': cstring(info, suffix_offset),
+            'base_unicode': cstring(info, base_unicode_offset, 2).decode('utf-16-le'),
+            'suffix_unicode': cstring(info, suffix_unicode_offset, 2).decode('utf-16-le'),
+        }
+        offset += len(info)
+    for flag, name in ((0x04, 'description'), (0x08, 'relative_path'), (0x10, 'working_dir'),
+                       (0x20, 'arguments'), (0x40, 'icon')):
+        if flags & flag:
+            count = struct.unpack_from('<H', data, offset)[0]
+            link[name] = data[offset + 2:offset + 2 + count * 2].decode('utf-16-le')
+            offset += 2 + count * 2
+    link['terminal'] = data[offset:]
+    return link
+
+
+class ShellLinkTest(unittest.TestCase):
+
+    def test_matches_reference(self):
+        with open(os.path.join(DATA, "core_music.lnk"), 'rb') as f:
+            reference = f.read()
+        self.assertEqual(core.build_shell_link(**REFERENCE), reference)
+
+    def test_structure(self):
+        link = parse_shell_link(core.build_shell_link(**REFERENCE))
+        self.assertEqual(link['header_size'], 0x4C)
+        self.assertEqual(link['clsid'], SHELL_LINK_CLSID)
+        # HasLinkInfo | HasName | HasWorkingDir | HasArguments | HasIconLocation | IsUnicode
+        self.assertEqual(link['flags'], 0x02 | 0x04 | 0x10 | 0x20 | 0x40 | 0x80)
+        self.assertEqual(link['attributes'], 0x80)              # FILE_ATTRIBUTE_NORMAL
+        self.assertEqual((link['times'], link['size']), ((0, 0, 0), 0))
+        self.assertEqual((link['icon_index'], link['show_command'], link['hotkey']), (1, 1, 0))
+        self.assertEqual(link['link_info'], {
+            'header_size': 0x24, 'flags': 0x01, 'drive_type': 3, 'volume_id_size': 0x11,
+            'base_ansi': REFERENCE['target'].encode('gbk'), 'suffix_ansi': b'',
+            'base_unicode': REFERENCE['target'], 'suffix_unicode': '',
+        })
+        for name in ('description', 'working_dir', 'arguments', 'icon'):
+            self.assertEqual(link[name], REFERENCE[name])
+        self.assertEqual(link['terminal'], b'\0\0\0\0')
+
+    def test_optional_strings_omitted(self):
+        link = parse_shell_link(core.build_shell_link("C:\\a.exe", ansi_encoding='ascii'))
+        self.assertEqual(link['flags'], 0x02 | 0x80)
+        self.assertNotIn('description', link)
+        self.assertEqual(link['link_info']['base_unicode'], "C:\\a.exe")
+        self.assertEqual(link['terminal'], b'\0\0\0\0')
+
+    def test_unencodable_ansi_path_keeps_unicode(self):
+        link = parse_shell_link(core.build_shell_link("C:\\核音乐.exe", ansi_encoding='ascii'))
+        self.assertEqual(link['link_info']['base_ansi'], b'C:\\???.exe')
+        self.assertEqual(link['link_info']['base_unicode'], "C:\\核音乐.exe")
+
+    def test_existing_target(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        target = os.path.join(directory, "app.exe")
+        with open(target, 'wb') as f:
+            f.write(b'x' * 1234)
+        os.utime(target, (1_700_000_000, 1_700_000_000))
+        link = parse_shell_link(core.build_shell_link(target))
+        self.assertEqual((link['attributes'], link['size']), (0x20, 1234))
+        self.assertEqual(link['times'][2], core.filetime(1_700_000_000))
+        self.assertEqual(parse_shell_link(core.build_shell_link(directory))['attributes'], 0x10)
+
+    def test_filetime(self):
+        self.assertEqual(core.filetime(0), 0)
+        self.assertEqual(core.filetime(1), 116444736010000000)
+
+    def test_string_too_long(self):
+        with self.assertRaises(ValueError):
+            core.build_shell_link("C:\\a.exe", arguments='x' * 0x10000)
+
+    def test_write_shell_link(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        path = os.path.join(directory, "核音乐.lnk")
+        options = dict(REFERENCE)
+        target = options.pop('target')
+        self.assertEqual(core.write_shell_link(path, target, **options), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), core.build_shell_link(**REFERENCE))
+        self.assertEqual(os.listdir(directory), ["核音乐.lnk"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import time
+import unittest
+
+import requests
+
+from stub_server import StubServer
+from tests import core
+
+SIZE = 300 * 1024
+
+
+class StreamProxyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.upstream = StubServer({'a.flac': SIZE, 'b.flac': SIZE}).start()
+        self.addCleanup(self.upstream.stop)
+        self.cache = core.AudioCache(root=self.root)
+        self.proxy = core.StreamProxy(self.cache, http=core.HttpClient(retries=2, backoff_base=0.01))
+        self.addCleanup(self.proxy.stop)
+        self.session = requests.Session()
+        self.addCleanup(self.session.close)
+
+    def payload(self, name):
+        return self.upstream.payloads[name]
+
+    def fetch(self, url, **headers):
+        return self.session.get(url, headers=headers, timeout=10)
+
+    def wait_cached(self, url, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.cache.get(url) is None:
+            if time.monotonic() > deadline:
+                self.fail(f"{url} was not cached")
+            time.sleep(0.02)
+
+    def test_full_response_fills_cache(self):
+        upstream = self.upstream.url('a.flac')
+        resp = self.fetch(self.proxy.url_for(upstream))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, self.payload('a.flac'))
+        self.wait_cached(upstream)
+
+        requests_before = self.upstream.stats['requests']
+        resp = self.fetch(self.proxy.url_for(upstream))
+        self.assertEqual(resp.content, self.payload('a.flac'))
+        self.assertEqual(self.upstream.stats['requests'], requests_before)
+        self.assertEqual(self.proxy.stats()['network'], 1)
+        self.assertEqual(self.proxy.stats()['cache'], 1)
+
+    def test_range_from_upstream(self):
+        resp = self.fetch(self.proxy.url_for(self.upstream.url('a.flac')), Range='bytes=1000-1999')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.headers['Content-Range'], f'bytes 1000-1999/{SIZE}')
+        self.assertEqual(resp.content, self.payload('a.flac')[1000:2000])
+        # 中途拖动不算起播，也不写缓存
+        self.assertEqual(self.proxy.stats()['network'], 0)
+        self.assertIsNone(self.cache.get(self.upstream.url('a.flac')))
+
+    def test_range_from_cache(self):
+        upstream = self.upstream.url('b.flac')
+        local = self.proxy.url_for(upstream)
+        self.fetch(local)
+        self.wait_cached(upstream)
+
+        resp = self.fetch(local, Range='bytes=-100')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.headers['Content-Range'], f'bytes {SIZE - 100}-{SIZE - 1}/{SIZE}')
+        self.assertEqual(resp.content, self.payload('b.flac')[-100:])
+
+        resp = self.fetch(local, Range=f'bytes={SIZE}-')
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp.headers['Content-Range'], f'bytes */{SIZE}')
+
+    def test_head(self):
+        resp = self.session.head(self.proxy.url_for(self.upstream.url('a.flac')), timeout=10)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Length'], str(SIZE))
+        self.assertEqual(self.proxy.stats()['network'], 0)
+
+    def test_unknown_stream(self):
+        self.proxy.start()
+        resp = self.fetch(f"http://127.0.0.1:{self.proxy.port}/stream/unknown")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_upstream_client_error_is_forwarded(self):
+        resp = self.fetch(self.proxy.url_for(self.upstream.url('missing.flac')))
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(self.proxy.stats()['network'], 0)
+
+    def test_upstream_server_error_is_bad_gateway(self):
+        self.upstream.error_rate = 1.0
+        resp = self.fetch(self.proxy.url_for(self.upstream.url('a.flac')))
+        self.assertEqual(resp.status_code, 502)
+        self.assertEqual(self.upstream.stats['errors'], 2)
+        self.assertEqual(self.proxy.stats()['network'], 0)
+        self.assertIsNone(self.proxy.stats()['local_hit_rate'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,21 @@
-import webview
 import os
 import sys
 import shutil
 import time
 import threading
-from urllib.request import urlretrieve
-from urllib.error import URLError
 import logging
 import re
-import asyncio
 import json
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import atexit
+import bisect
+import collections
+import functools
+import itertools
+import hashlib
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, as_completed, wait
+# webview、requests、sqlite3 等较重的模块在首次使用时再导入，缩短冷启动时间
 
 # ================= 配置与常量 =================
 APP_NAME = "Core Music"
@@ -20,48 +24,419 @@ SHORTCUT_NAME = "Core Music.lnk"
 VERSION = "1.0.3"
 CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".CoreMusic", "config.json")
 
-# 日志配置
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(os.path.expanduser("~"), "CoreMusic.log"), encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+# 下载引擎参数
+DOWNLOAD_WORKERS = 4                  # 单个文件的最大并发连接数
+SEGMENT_MIN_SIZE = 1024 * 1024        # 每段最小字节数
+SEGMENT_THRESHOLD = 2 * 1024 * 1024   # 不超过此大小的文件用一个请求下完，不分段
+CHUNK_SIZE = 64 * 1024                # 每次从网络读取的块大小
+WRITE_BUFFER_SIZE = 1024 * 1024       # 下载写盘缓冲区，攒满后一次写入
+PART_SUFFIX = ".part"                 # 未完成下载的临时文件后缀
+JOURNAL_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "downloads.json")
+JOURNAL_SAVE_INTERVAL = 1.0           # 下载进度写盘的最小间隔（秒）
+DOWNLOAD_INDEX_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "downloaded.json")
+DOWNLOAD_REVALIDATE_AFTER = 24 * 3600  # 已下载的 URL 超过此时长（秒）未确认时，先探测上游是否有新版本
+QUEUE_WORKERS = 3                     # 批量下载队列同时进行的任务数
+PROGRESS_INTERVAL = 0.25              # 每个任务推送进度事件的最小间隔（秒）
+
+# 网络参数
+HTTP_POOL_SIZE = DOWNLOAD_WORKERS + QUEUE_WORKERS + 4   # 分段连接 + 队列单连接 + API 请求
+HTTP_CONNECT_TIMEOUT = 5              # 建立连接超时（秒）
+HTTP_READ_TIMEOUT = 30                # 两次读取之间的超时（秒）
+HTTP_RETRIES = 3                      # 每个请求的最大尝试次数
+HTTP_BACKOFF_BASE = 0.5               # 指数退避的基数（秒）
+HTTP_BACKOFF_MAX = 30                 # 单次退避的上限（秒）
+
+# 传输调度：播放 > 预取 > 批量下载
+PRIORITY_INTERACTIVE = 0              # 正在播放的流
+PRIORITY_PREFETCH = 1                 # 预取即将播放的曲目
+PRIORITY_BULK = 2                     # 用户发起的下载与批量队列
+PRIORITY_NAMES = ('interactive', 'prefetch', 'bulk')
+BANDWIDTH_LIMIT_KBPS = 0              # 全局带宽上限（KB/s），0 表示不限，可用配置 bandwidth_limit_kbps 覆盖
+BACKGROUND_LIMIT_KBPS = 1024          # 播放期间预取与下载合计的带宽上限（KB/s），0 表示不限
+BUCKET_BURST = 0.25                   # 令牌桶容量（按速率折算的秒数）
+BANDWIDTH_WINDOW = 60                 # 带宽估计的滑动窗口（秒）
+BANDWIDTH_SAMPLES = 32                # 窗口内最多保留的吞吐或首字节时间样本数
+BANDWIDTH_SAMPLE_BYTES = 256 * 1024   # 单条传输每读满这么多字节提交一个吞吐样本
+BANDWIDTH_MAX_STALL = 0.25            # 样本中被限速或等待读取端的时间超过此比例时丢弃，它反映的不是链路
+
+# 音质自适应（NeteaseCloudMusicApi 风格的 level 参数）
+QUALITY_LEVELS = (                    # (level, 标称码率 kbps)，从低到高
+    ('standard', 128), ('higher', 192), ('exhigh', 320), ('lossless', 1000), ('hires', 2400),
 )
+QUALITY_FLOOR = "standard"            # 自动选择的最低音质，可用配置 quality_floor 覆盖
+QUALITY_CEILING = "lossless"          # 自动选择的最高音质，可用配置 quality_ceiling 覆盖
+QUALITY_DEFAULT = "exhigh"            # 还没有带宽样本时使用的音质
+QUALITY_START_TARGET = 1.5            # 起播时间目标（秒）：首字节时间 + 下载起播缓冲所需的时间
+QUALITY_START_BUFFER = 2.0            # 播放器开始出声前需要缓冲的音频时长（秒）
+QUALITY_HEADROOM = 0.7                # 码率最多占估计吞吐的比例，余量用于抵御波动
+QUALITY_UPSWITCH_MARGIN = 1.25        # 升档时额外要求的吞吐倍数，避免在边界上来回切换
+
+# 缓存目录
+CACHE_DIR = os.path.join(os.path.dirname(CONFIG_FILE), "cache")
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "audio")
+CACHE_BUDGET = 2 * 1024 * 1024 * 1024  # 音频缓存默认上限（字节），可用配置 cache_budget_mb 覆盖
+API_CACHE_DIR = os.path.join(CACHE_DIR, "api")
+PREFETCH_DIR = os.path.join(CACHE_DIR, "prefetch")
+ARTWORK_DIR = os.path.join(CACHE_DIR, "artwork")
+
+# 封面
+ARTWORK_BUDGET = 256 * 1024 * 1024    # 封面缓存默认上限（字节），可用配置 artwork_budget_mb 覆盖
+ARTWORK_SIZES = (64, 256)             # 后台生成的缩略图边长（像素）
+ARTWORK_WORKERS = 2                   # 缩略图生成线程数
+ARTWORK_MAX_BYTES = 20 * 1024 * 1024  # 单张原图大小上限
+
+# 预取
+PREFETCH_COUNT = 3                    # 预热播放队列中接下来的曲目数，可用配置 prefetch_count 覆盖
+PREFETCH_BUDGET = 64 * 1024 * 1024    # 预取开头片段的总字节上限，可用配置 prefetch_budget_mb 覆盖
+PREFETCH_HEAD_SIZE = 384 * 1024       # 长曲目只预取开头的字节数
+PREFETCH_FULL_SIZE = 4 * 1024 * 1024  # 不超过此大小的曲目整首预取进音频缓存
+
+# 音乐 API（NeteaseCloudMusicApi 风格接口，可用配置 music_api_base 指向其他镜像）
+MUSIC_API_BASE = "http://localhost:3000"
+MUSIC_API_ENDPOINTS = {
+    'search': '/search',
+    'track': '/song/detail',
+    'album': '/album',
+    'url': '/song/url/v1',
+}
+API_CACHE_SIZE = 512                  # 内存缓存条目上限
+API_CACHE_TTL = 300                   # 内存缓存有效期（秒）
+API_DISK_CACHE_TTL = 24 * 3600        # 磁盘缓存有效期（秒）
+
+# API 镜像（配置 music_api_mirrors 列出与 music_api_base 等价的其他地址）
+MIRROR_WORKERS = 8                    # 镜像请求线程数
+MIRROR_EWMA_ALPHA = 0.2               # 延迟 EWMA 的平滑系数
+MIRROR_SAMPLES = 50                   # 计算 p90 保留的最近样本数
+MIRROR_MIN_SAMPLES = 5                # 样本少于此数时使用默认对冲延迟
+HEDGE_DEFAULT_DELAY = 0.5             # 没有足够样本时，等待多久（秒）后发出对冲请求
+HEDGE_MIN_DELAY = 0.02                # 对冲等待的下限（秒）
+BREAKER_FAILURES = 3                  # 连续失败多少次后熔断镜像
+BREAKER_COOLDOWN = 30                 # 熔断时长（秒），到期后放行一个试探请求
+
+# 本地曲库
+LIBRARY_DB = os.path.join(os.path.dirname(CONFIG_FILE), "library.db")
+AUDIO_EXTENSIONS = {'.mp3', '.flac', '.m4a', '.aac', '.ogg', '.opus', '.wav', '.wma', '.ape'}
+
+# 播放历史与歌单
+PLAYLOG_SNAPSHOT = "playlog.snapshot.json"   # 快照文件名，日志为同目录下的 playlog.<代>.jsonl
+PLAYLOG_COMPACT_RECORDS = 10000       # 快照之后的日志超过此条数时在后台压缩
+HISTORY_LIMIT = 100000                # 保留的播放历史条数
+
+# 后台任务
+BACKEND_WORKERS = 8                   # 后台任务线程池大小，即同时执行的耗时调用数
+EVENT_FLUSH_INTERVAL = 0.033          # 事件合并后推送到页面的间隔（秒），约每帧一次
+
+# 无界面模式
+RPC_HOST = "127.0.0.1"                # --headless 时 JSON-RPC 服务监听的地址
+RPC_PORT = 17380                      # --headless 时 JSON-RPC 服务监听的端口
+RPC_MAX_BODY = 1024 * 1024            # 单个请求体的上限（字节）
+RPC_TOKEN_ENV = "COREMUSIC_RPC_TOKEN"  # 提供 JSON-RPC 访问令牌的环境变量，未设置时每次启动随机生成
+
+# 单实例
+INSTANCE_LOCK_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "instance.lock")
+INSTANCE_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "instance.json")
+INSTANCE_TIMEOUT = 3.0                # 后续启动等待已运行实例接收参数的最长时间（秒）
+
+# 日志与指标
+LOG_FILE = os.path.join(os.path.expanduser("~"), "CoreMusic.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024       # 单个日志文件上限，超出后轮转
+LOG_BACKUP_COUNT = 3                  # 保留的历史日志份数
+METRICS_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "metrics.json")
+
+# 日志配置：调用线程只把记录放入队列，由后台线程写文件与控制台
+def setup_logging():
+    import logging.handlers
+    import queue
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # ================= 配置管理 =================
-def load_config():
-    """加载配置文件"""
-    config_dir = os.path.dirname(CONFIG_FILE)
-    if not os.path.exists(config_dir):
-        os.makedirs(config_dir, exist_ok=True)
-    
-    if os.path.exists(CONFIG_FILE):
+CONFIG_SCHEMA_VERSION = 2
+CONFIG_SAVE_DELAY = 0.5               # 配置写盘防抖间隔（秒），期间的多次修改合并为一次写入
+
+# 默认配置
+CONFIG_DEFAULTS = {
+    "version": VERSION,
+    "schema_version": CONFIG_SCHEMA_VERSION,
+    "shortcut_created": False,
+    "shortcut_path": None,
+    "skip_install": False,
+    "download_workers": QUEUE_WORKERS,
+    "cache_budget_mb": CACHE_BUDGET // (1024 * 1024),
+    "music_api_base": MUSIC_API_BASE,
+    "music_api_mirrors": [],
+    "api_disk_cache": True,
+    "library_dirs": [],
+    "bandwidth_limit_kbps": BANDWIDTH_LIMIT_KBPS,
+    "background_limit_kbps": BACKGROUND_LIMIT_KBPS,
+    "prefetch_count": PREFETCH_COUNT,
+    "prefetch_budget_mb": PREFETCH_BUDGET // (1024 * 1024),
+    "artwork_budget_mb": ARTWORK_BUDGET // (1024 * 1024),
+    "quality_floor": QUALITY_FLOOR,
+    "quality_ceiling": QUALITY_CEILING
+}
+
+
+def migrate_config_v1(data):
+    """v1 → v2：旧版配置没有 schema_version，补齐新增项即可"""
+    return data
+
+
+# 各版本到下一版本的迁移函数
+CONFIG_MIGRATIONS = {
+    1: migrate_config_v1,
+}
+
+
+def atomic_write_json(path, data, indent=None, mode=None):
+    """原子写入 JSON：先写同目录临时文件再替换，避免崩溃时截断
+
+    mode 为文件权限（如 0o600），临时文件创建时即为该权限，内容任何时刻都不会以更宽的权限出现在磁盘上。
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    if mode is None:
+        f = open(tmp_path, 'w', encoding='utf-8')
+    else:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        if hasattr(os, 'fchmod'):
+            os.fchmod(fd, mode)           # 上次残留的临时文件保留着旧权限
+        f = os.fdopen(fd, 'w', encoding='utf-8')
+    with f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class ConfigStore:
+    """常驻内存的配置与状态存储：类型化读写，修改经防抖合并后原子写盘"""
+
+    def __init__(self, path=CONFIG_FILE, delay=CONFIG_SAVE_DELAY):
+        self.path = path
+        self.delay = delay
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()    # 写盘串行化，多个写入方不会共用同一个临时文件
+        self.timer = None
+        self.writes = 0                       # 已取的快照数，即快照的代号
+        self.written = 0                      # 已落盘的最新快照代号
+        self.data = self._load()
+
+    def _load(self):
+        """读取配置文件并迁移到当前版本，缺失项使用默认值"""
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load config: {e}")
+        version = data.get('schema_version', 1)
+        while version < CONFIG_SCHEMA_VERSION:
+            data = CONFIG_MIGRATIONS[version](data)
+            version += 1
+            logger.info(f"Migrated config to schema v{version}")
+        merged = dict(CONFIG_DEFAULTS)
+        merged.update(data)
+        merged['schema_version'] = CONFIG_SCHEMA_VERSION
+        merged['version'] = VERSION
+        return merged
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def get_bool(self, key, default=False):
+        return bool(self.get(key, default))
+
+    def get_int(self, key, default=0):
         try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return int(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_str(self, key, default=None):
+        value = self.get(key, default)
+        return default if value is None else str(value)
+
+    def get_list(self, key, default=None):
+        value = self.get(key)
+        return list(value) if isinstance(value, (list, tuple)) else list(default or [])
+
+    def set(self, key, value):
+        """修改单项，类型需与默认值一致，写盘被推迟并合并"""
+        self.update({key: value})
+
+    def update(self, values):
+        """批量修改，只触发一次写盘"""
+        for key, value in values.items():
+            self._check_type(key, value)
+        with self.lock:
+            changed = False
+            for key, value in values.items():
+                if self.data.get(key) != value or key not in self.data:
+                    self.data[key] = value
+                    changed = True
+            if changed:
+                self._schedule()
+
+    @staticmethod
+    def _check_type(key, value):
+        default = CONFIG_DEFAULTS.get(key)
+        if default is None or value is None:
+            return
+        expected = (int, float) if type(default) is float else type(default)
+        if isinstance(value, bool) != isinstance(default, bool) or not isinstance(value, expected):
+            raise TypeError(f"Config '{key}' expects {type(default).__name__}, got {type(value).__name__}")
+
+    def _schedule(self):
+        """防抖：已有待写入时不重复安排（需持有锁）"""
+        if self.timer is None:
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """立即原子写盘；定时器与显式调用并发时，较旧的快照不会覆盖已写入的较新快照"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            snapshot = dict(self.data)
+            self.writes += 1
+            generation = self.writes
+        with self.write_lock:
+            if generation < self.written:
+                return True
+            try:
+                atomic_write_json(self.path, snapshot, indent=2)
+                self.written = generation
+                return True
+            except Exception as e:
+                logger.error(f"Failed to save config: {e}")
+                return False
+
+    def close(self):
+        """退出前写入尚未落盘的修改"""
+        with self.lock:
+            pending = self.timer is not None
+        if pending:
+            self.flush()
+
+
+def lazy_property(func):
+    """首次访问时才创建的属性，创建过程加锁保证只初始化一次"""
+    name = func.__name__
+    lock = threading.RLock()
+
+    @functools.wraps(func)
+    def getter(self):
+        value = self.__dict__.get(name)
+        if value is None:
+            with lock:
+                value = self.__dict__.get(name)
+                if value is None:
+                    value = self.__dict__[name] = func(self)
+        return value
+
+    return property(getter)
+
+# ================= 调用指标 =================
+
+class CallMetrics:
+    """按方法统计调用次数、错误数与延迟直方图（固定桶，内存占用恒定）"""
+
+    # 延迟桶上界（毫秒）
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000,
+               float('inf'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def record(self, name, elapsed_ms, error):
+        with self.lock:
+            stats = self.methods.get(name)
+            if stats is None:
+                stats = self.methods[name] = {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                              'buckets': [0] * len(self.BUCKETS)}
+            stats['count'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['buckets'][bisect.bisect_left(self.BUCKETS, elapsed_ms)] += 1
+
+    def _percentile(self, stats, pct):
+        """返回包含第 pct 百分位的桶上界，最后一个桶用实际最大值"""
+        target = stats['count'] * pct / 100
+        seen = 0
+        for bound, count in zip(self.BUCKETS, stats['buckets']):
+            seen += count
+            if seen >= target and count:
+                return min(bound, stats['max_ms'])
+        return stats['max_ms']
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'mean_ms': stats['total_ms'] / stats['count'],
+                    'max_ms': stats['max_ms'],
+                    'p50_ms': self._percentile(stats, 50),
+                    'p95_ms': self._percentile(stats, 95),
+                    'p99_ms': self._percentile(stats, 99),
+                }
+                for name, stats in self.methods.items()
+            }
+
+    def dump(self, path=METRICS_FILE):
+        """把当前指标写入 JSON 文件"""
+        try:
+            atomic_write_json(path, {'version': VERSION, 'time': time.time(), 'methods': self.snapshot()}, indent=2)
         except Exception as e:
-            logger.error(f"Failed to load config: {e}")
-    
-    # 默认配置
-    return {
-        "version": VERSION,
-        "shortcut_created": False,
-        "shortcut_path": None,
-        "skip_install": False
-    }
-
-def save_config(config):
-    """保存配置文件"""
-    try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
-        return True
-    except Exception as e:
-        logger.error(f"Failed to save config: {e}")
-        return False
+            logger.error(f"Failed to dump metrics: {e}")
+
+
+call_metrics = CallMetrics()
+
+
+def instrumented(func):
+    """记录暴露给页面的 Api 方法的调用次数、错误与耗时；抛出异常或返回 status=error 都计为错误"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = True
+        try:
+            result = func(*args, **kwargs)
+            error = isinstance(result, dict) and result.get('status') == 'error'
+            return result
+        finally:
+            call_metrics.record(name, (time.perf_counter() - started) * 1000, error)
+
+    return wrapper
 
 # ================= HTML 模板 =================
 
@@ -269,333 +644,4471 @@ MAIN_HTML_TEMPLATE = r"""
 </html>
 """
 
-# ================= Python 后端逻辑 =================
+# 预先替换版本号的页面，启动时直接使用
+INSTALLER_PAGE = INSTALLER_HTML.replace("{VERSION}", VERSION)
+MAIN_PAGE = MAIN_HTML_TEMPLATE.replace("{VERSION}", VERSION)
 
-class Api:
-    def __init__(self, window):
-        self.window = window
-        self.config = load_config()
-        logger.info("API initialized")
+# ================= HTTP 客户端 =================
 
-    def close_app(self):
-        """完全退出程序"""
-        logger.info("Closing application")
-        if self.window:
-            self.window.destroy()
-        return {'status': 'closed'}
+class HttpClient:
+    """进程内共享的 HTTP 客户端：keep-alive 连接池、连接/读取超时、带抖动的指数退避重试"""
 
-    def minimize_window(self):
-        """最小化窗口"""
-        logger.info("Minimizing window")
-        if self.window:
-            self.window.minimize()
-        return {'status': 'minimized'}
+    RETRY_STATUS = {429, 500, 502, 503, 504}
 
-    def maximize_window(self):
-        """最大化窗口"""
-        logger.info("Maximizing window")
-        if self.window:
-            self.window.maximize()
-        return {'status': 'maximized'}
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES,
+                 timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                 backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX):
+        import requests
+        import requests.adapters
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0}
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = f"CoreMusic/{VERSION}"
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
-    def restore_window(self):
-        """还原窗口"""
-        logger.info("Restoring window")
-        if self.window:
-            self.window.restore()
-        return {'status': 'restored'}
+    def backoff(self, attempt, retry_after=None):
+        """第 attempt 次失败后的等待秒数：优先 Retry-After，否则为全抖动指数退避"""
+        import random
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
 
-    def start_drag(self):
-        """开始拖动窗口 (Windows)"""
-        logger.debug("Start drag")
+    @classmethod
+    def is_permanent(cls, error):
+        """除 429 外的 4xx 是请求本身的问题（资源不存在、链接过期等），重试也不会成功"""
+        import requests
+        response = getattr(error, 'response', None)
+        return isinstance(error, requests.HTTPError) and response is not None and \
+            400 <= response.status_code < 500 and response.status_code not in cls.RETRY_STATUS
+
+    @staticmethod
+    def parse_retry_after(value):
+        """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+        import email.utils
+        if not value:
+            return None
         try:
-            import ctypes
-            ctypes.windll.user32.ReleaseCapture()
-            ctypes.windll.user32.SendMessageW(self.window._window.hwnd, 0x0112, 0xF012, 0)
-            return {'status': 'dragging'}
-        except Exception as e:
-            logger.warning(f"Drag failed: {e}")
-            return {'status': 'error', 'error': str(e)}
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
 
-    def on_install_complete(self):
-        """安装完成回调"""
-        logger.info("Installation complete, loading main UI")
-        time.sleep(0.5)
-        self.window.load_html(MAIN_HTML_TEMPLATE.replace("{VERSION}", VERSION))
-        return {'status': 'loaded', 'version': VERSION}
+    def request(self, method, url, **kwargs):
+        """发送请求，对连接错误、超时和可重试状态码按退避策略重试，其余错误直接抛出"""
+        import requests
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries):
+            retry_after = None
+            with self.lock:
+                self.stats['requests'] += 1
+                self.stats['retries'] += 1 if attempt else 0
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries - 1:
+                    raise
+                logger.warning(f"{method} {url} failed ({e}), retrying")
+            else:
+                if resp.status_code not in self.RETRY_STATUS or attempt == self.retries - 1:
+                    resp.raise_for_status()
+                    return resp
+                retry_after = self.parse_retry_after(resp.headers.get('Retry-After'))
+                resp.close()
+                logger.warning(f"{method} {url} returned HTTP {resp.status_code}, retrying")
+            time.sleep(self.backoff(attempt, retry_after))
 
-    def create_shortcut_option(self, option):
-        """根据用户选择创建快捷方式"""
-        try:
-            if option == 'none':
-                # 用户选择不创建快捷方式
-                self.config['skip_install'] = True
-                self.config['shortcut_created'] = False
-                save_config(self.config)
-                return {'status': 'success', 'message': '已跳过快捷方式创建'}
-            
-            elif option == 'desktop':
-                # 创建桌面快捷方式
-                result = self.create_desktop_shortcut()
-                if result['status'] == 'success':
-                    self.config['shortcut_created'] = True
-                    self.config['shortcut_path'] = result.get('shortcut_path')
-                    self.config['skip_install'] = False
-                    save_config(self.config)
-                    return {'status': 'success', 'message': '桌面快捷方式创建成功'}
-                else:
-                    return result
-                    
-            elif option == 'startmenu':
-                # 创建开始菜单快捷方式
-                result = self.create_start_menu_shortcut()
-                if result['status'] == 'success':
-                    self.config['shortcut_created'] = True
-                    self.config['shortcut_path'] = result.get('shortcut_path')
-                    self.config['skip_install'] = False
-                    save_config(self.config)
-                    return {'status': 'success', 'message': '开始菜单快捷方式创建成功'}
-                else:
-                    return result
-            
-            return {'status': 'error', 'error': '无效的选项'}
-            
-        except Exception as e:
-            logger.error(f"Failed to create shortcut: {e}")
-            return {'status': 'error', 'error': str(e)}
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
 
-    def skip_installation(self):
-        """跳过安装"""
-        self.config['skip_install'] = True
-        save_config(self.config)
-        return {'status': 'success', 'message': '已跳过安装'}
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('HEAD', url, **kwargs)
 
-    def create_desktop_shortcut(self):
-        """创建桌面快捷方式"""
-        try:
-            # 获取当前可执行文件路径
-            if getattr(sys, 'frozen', False):
-                exe_path = sys.executable
-            else:
-                exe_path = sys.argv[0]
-                if not os.path.isabs(exe_path):
-                    exe_path = os.path.join(os.getcwd(), exe_path)
-            
-            exe_path = os.path.abspath(exe_path)
-            
-            # 获取桌面路径
-            desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-            shortcut_path = os.path.join(desktop, SHORTCUT_NAME)
-            
-            logger.info(f"Creating desktop shortcut: {shortcut_path}")
-            
-            # 如果快捷方式已存在，先删除
-            if os.path.exists(shortcut_path):
-                try:
-                    os.remove(shortcut_path)
-                    logger.info(f"Removed existing shortcut: {shortcut_path}")
-                except Exception as e:
-                    logger.warning(f"Failed to remove existing shortcut: {e}")
-            
-            # 创建VBS脚本来创建快捷方式
-            import tempfile
-            vbs_content = f"""
-            Set oWS = WScript.CreateObject("WScript.Shell")
-            sLinkFile = "{shortcut_path}"
-            Set oLink = oWS.CreateShortcut(sLinkFile)
-            oLink.TargetPath = "{exe_path}"
-            oLink.WorkingDirectory = "{os.path.dirname(exe_path)}"
-            oLink.Description = "CORE Music Player"
-            oLink.Save
-            """
-            
-            vbs_path = os.path.join(tempfile.gettempdir(), "create_desktop_shortcut.vbs")
-            
-            try:
-                with open(vbs_path, "w", encoding="utf-8-sig") as f:
-                    f.write(vbs_content)
-                
-                import subprocess
-                cscript_path = os.path.join(os.environ.get("SystemRoot", "C:\\Windows"), "System32", "cscript.exe")
-                result = subprocess.run([cscript_path, "//nologo", vbs_path], 
-                                      capture_output=True, text=True, shell=False)
-                
-                if os.path.exists(vbs_path):
-                    os.remove(vbs_path)
-                
-                if os.path.exists(shortcut_path):
-                    logger.info(f"Desktop shortcut created successfully: {shortcut_path}")
-                    return {'status': 'success', 'shortcut_path': shortcut_path}
-                else:
-                    logger.error("Desktop shortcut file not found after creation")
-                    return {'status': 'error', 'error': '快捷方式创建失败'}
-                    
-            except Exception as e:
-                logger.error(f"Failed to create desktop shortcut via VBS: {e}")
-                return {'status': 'error', 'error': str(e)}
-                
-        except Exception as e:
-            logger.error(f"Desktop shortcut creation failed: {e}")
-            return {'status': 'error', 'error': str(e)}
 
-    def create_start_menu_shortcut(self):
-        """创建开始菜单快捷方式"""
-        try:
-            # 获取当前可执行文件路径
-            if getattr(sys, 'frozen', False):
-                exe_path = sys.executable
-            else:
-                exe_path = sys.argv[0]
-                if not os.path.isabs(exe_path):
-                    exe_path = os.path.join(os.getcwd(), exe_path)
-            
-            exe_path = os.path.abspath(exe_path)
-            
-            # 获取开始菜单路径（当前用户）
-            start_menu = os.path.join(os.environ.get("APPDATA"), "Microsoft", "Windows", "Start Menu", "Programs")
-            os.makedirs(start_menu, exist_ok=True)
-            
-            # 创建程序文件夹
-            program_folder = os.path.join(start_menu, APP_NAME)
-            os.makedirs(program_folder, exist_ok=True)
-            
-            shortcut_path = os.path.join(program_folder, SHORTCUT_NAME)
-            
-            logger.info(f"Creating start menu shortcut: {shortcut_path}")
-            
-            # 如果快捷方式已存在，先删除
-            if os.path.exists(shortcut_path):
-                try:
-                    os.remove(shortcut_path)
-                    logger.info(f"Removed existing shortcut: {shortcut_path}")
-                except Exception as e:
-                    logger.warning(f"Failed to remove existing shortcut: {e}")
-            
-            # 创建VBS脚本来创建快捷方式
-            import tempfile
-            vbs_content = f"""
-            Set oWS = WScript.CreateObject("WScript.Shell")
-            sLinkFile = "{shortcut_path}"
-            Set oLink = oWS.CreateShortcut(sLinkFile)
-            oLink.TargetPath = "{exe_path}"
-            oLink.WorkingDirectory = "{os.path.dirname(exe_path)}"
-            oLink.Description = "CORE Music Player"
-            oLink.Save
-            """
-            
-            vbs_path = os.path.join(tempfile.gettempdir(), "create_startmenu_shortcut.vbs")
-            
-            try:
-                with open(vbs_path, "w", encoding="utf-8-sig") as f:
-                    f.write(vbs_content)
-                
-                import subprocess
-                cscript_path = os.path.join(os.environ.get("SystemRoot", "C:\\Windows"), "System32", "cscript.exe")
-                result = subprocess.run([cscript_path, "//nologo", vbs_path], 
-                                      capture_output=True, text=True, shell=False)
-                
-                if os.path.exists(vbs_path):
-                    os.remove(vbs_path)
-                
-                if os.path.exists(shortcut_path):
-                    logger.info(f"Start menu shortcut created successfully: {shortcut_path}")
-                    return {'status': 'success', 'shortcut_path': shortcut_path}
-                else:
-                    logger.error("Start menu shortcut file not found after creation")
-                    return {'status': 'error', 'error': '快捷方式创建失败'}
-                    
-            except Exception as e:
-                logger.error(f"Failed to create start menu shortcut via VBS: {e}")
-                return {'status': 'error', 'error': str(e)}
-                
-        except Exception as e:
-            logger.error(f"Start menu shortcut creation failed: {e}")
-            return {'status': 'error', 'error': str(e)}
+_http_client = None
+_http_client_lock = threading.Lock()
 
-    def download_file(self, url, filename):
-        """下载文件到桌面"""
-        try:
-            desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-            file_path = os.path.join(desktop, filename)
 
-            if os.path.exists(file_path):
-                base, ext = os.path.splitext(filename)
-                timestamp = int(time.time())
-                file_path = os.path.join(desktop, f"{base}_{timestamp}{ext}")
-                filename = f"{base}_{timestamp}{ext}"
+def get_http_client():
+    """返回进程内唯一的 HttpClient 实例"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+        return _http_client
 
-            logger.info(f"Downloading {url} to {file_path}")
+# ================= 传输调度 =================
 
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    urlretrieve(url, file_path)
-                    logger.info(f"Download success: {filename}")
-                    return {'status': 'success', 'path': file_path, 'filename': filename}
-                except Exception as e:
-                    logger.warning(f"Download attempt {attempt + 1} failed: {e}")
-                    if attempt < max_retries - 1:
-                        time.sleep(1)
-                    else:
-                        raise e
+class BandwidthEstimator:
+    """滑动窗口内的单连接吞吐与首字节时间估计
 
-        except Exception as e:
-            logger.error(f"Download failed: {e}")
-            return {'status': 'error', 'error': str(e)}
+    吞吐样本来自调度器中的真实传输（下载、预取、播放流）；首字节时间只取音频下载与播放流的响应，
+    API、封面等小请求的延迟不代表起播要等多久。估计值变化时通知订阅者。
+    单连接吞吐决定一首曲目的流能跑多快，分段下载的多条连接各算各的样本。
+    """
 
-def check_installation():
-    """检查是否需要安装 - 检查配置文件和快捷方式"""
-    config = load_config()
-    
-    # 如果用户之前选择跳过安装，直接进入主界面
-    if config.get('skip_install', False):
-        logger.info("User previously skipped installation")
-        return False
-    
-    # 如果快捷方式已创建且存在，直接进入主界面
-    if config.get('shortcut_created', False):
-        shortcut_path = config.get('shortcut_path')
-        if shortcut_path and os.path.exists(shortcut_path):
-            logger.info(f"Shortcut exists at: {shortcut_path}")
-            return False
-    
-    # 检查是否有桌面快捷方式
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-    shortcut_path = os.path.join(desktop, SHORTCUT_NAME)
-    
-    if os.path.exists(shortcut_path):
-        logger.info(f"Desktop shortcut found at: {shortcut_path}")
-        # 更新配置
-        config['shortcut_created'] = True
-        config['shortcut_path'] = shortcut_path
-        save_config(config)
-        return False
-    
-    # 需要安装
-    logger.info("Installation needed")
-    return True
+    def __init__(self, window=BANDWIDTH_WINDOW, max_samples=BANDWIDTH_SAMPLES):
+        self.window = window
+        self.lock = threading.Lock()
+        self.throughput = collections.deque(maxlen=max_samples)   # (时间, 字节数, 秒数)
+        self.ttfb = collections.deque(maxlen=max_samples)         # (时间, 秒数)
+        self.discarded = 0
+        self.listeners = []
 
-def main():
-    logger.info("=" * 50)
-    logger.info(f"CORE Music v{VERSION} starting")
-    logger.info(f"Python: {sys.version}")
-    logger.info(f"Platform: {sys.platform}")
-    logger.info(f"Current directory: {os.getcwd()}")
-    logger.info(f"Executable: {sys.executable}")
+    def subscribe(self, callback):
+        """callback() 在每个新样本之后调用，应当很快返回"""
+        with self.lock:
+            self.listeners.append(callback)
 
-    # 检查是否需要安装
-    needs_install = check_installation()
-    logger.info(f"Installation needed: {needs_install}")
+    def record_transfer(self, nbytes, elapsed, stalled=0.0):
+        """一段传输读取了 nbytes 字节，耗时 elapsed 秒，其中 stalled 秒在等令牌或等读取端"""
+        seconds = elapsed - stalled
+        with self.lock:
+            if seconds <= 0 or stalled > elapsed * BANDWIDTH_MAX_STALL:
+                self.discarded += 1
+                return
+            self.throughput.append((time.monotonic(), nbytes, seconds))
+            listeners = list(self.listeners)
+        self._notify(listeners)
 
-    # 根据是否需要安装选择HTML
-    if needs_install:
-        logger.info("Showing installation screen")
-        initial_html = INSTALLER_HTML.replace("{VERSION}", VERSION)
-        window_title = f"{APP_NAME} v{VERSION} - 初始设置"
-    else:
-        logger.info("Showing main player screen")
-        initial_html = MAIN_HTML_TEMPLATE.replace("{VERSION}", VERSION)
-        window_title = f"{APP_NAME} v{VERSION}"
+    def record_ttfb(self, seconds):
+        """记录一次音频请求的首字节时间；requests 的 resp.elapsed 即发出请求到解析完响应头的时间"""
+        with self.lock:
+            self.ttfb.append((time.monotonic(), seconds))
+            listeners = list(self.listeners)
+        self._notify(listeners)
+
+    @staticmethod
+    def _notify(listeners):
+        for callback in listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Bandwidth listener failed: {e}")
+
+    def estimate(self):
+        """窗口内的吞吐（字节/秒，总字节 / 总耗时）与首字节时间中位数（秒），没有样本时为 None"""
+        cutoff = time.monotonic() - self.window
+        with self.lock:
+            throughput = [(nbytes, seconds) for at, nbytes, seconds in self.throughput if at >= cutoff]
+            ttfb = sorted(seconds for at, seconds in self.ttfb if at >= cutoff)
+            discarded = self.discarded
+        return {
+            'throughput': sum(n for n, _ in throughput) / sum(s for _, s in throughput) if throughput else None,
+            'ttfb': ttfb[len(ttfb) // 2] if ttfb else None,
+            'samples': len(throughput),
+            'ttfb_samples': len(ttfb),
+            'discarded': discarded,
+        }
+
+
+bandwidth = BandwidthEstimator()
+
+
+class TokenBucket:
+    """令牌桶，rate 为字节/秒，0 表示不限；允许透支，透支部分由之后的申请等待补足"""
+
+    def __init__(self, rate=0, burst=BUCKET_BURST):
+        self.burst = burst
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.rate = max(0, int(rate))
+        self.capacity = max(CHUNK_SIZE, self.rate * self.burst)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def delay(self, now):
+        """补充令牌，返回还需等待的秒数"""
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, nbytes):
+        if self.rate:
+            self.tokens -= nbytes
+
+
+class Transfer:
+    """调度器中的一条传输：with 块内计为活跃，每读到一块数据调用 consume 申请带宽"""
+
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.mark = None                  # 当前吞吐样本的起点
+        self.sampled = 0                  # 样本内读到的字节数
+        self.stalled = 0.0                # 样本内等令牌或等读取端的秒数
+
+    def __enter__(self):
+        self.scheduler._register(self.priority, 1)
+        return self
+
+    def __exit__(self, *exc):
+        self._sample(final=True)
+        self.scheduler._register(self.priority, -1)
+
+    def consume(self, nbytes):
+        waited = self.scheduler.consume(nbytes, self.priority)
+        if self.mark is None:
+            # 第一块之前的时间属于首字节时间，吞吐从第一块之后算起
+            self.mark = time.monotonic()
+            return
+        self.sampled += nbytes
+        self.stalled += waited
+        if self.sampled >= BANDWIDTH_SAMPLE_BYTES:
+            self._sample()
+
+    def idle(self, seconds):
+        """调用方处理数据花费的时间（例如等待播放器读取），不计入吞吐"""
+        self.stalled += seconds
+
+    def _sample(self, final=False):
+        if self.mark is None:
+            return
+        now = time.monotonic()
+        # 结束时不足四分之一个样本的尾巴误差太大，丢弃
+        if self.sampled >= (BANDWIDTH_SAMPLE_BYTES // 4 if final else BANDWIDTH_SAMPLE_BYTES):
+            self.scheduler.estimator.record_transfer(self.sampled, now - self.mark, self.stalled)
+        self.mark, self.sampled, self.stalled = now, 0, 0.0
+
+    def demote(self, priority):
+        """调整优先级，例如播放器断开后仅为写缓存而继续读取的流"""
+        if priority != self.priority:
+            self.scheduler._register(self.priority, -1)
+            self.priority = priority
+            self.scheduler._register(priority, 1)
+
+
+class TransferScheduler:
+    """按优先级分配带宽
+
+    所有传输共用一个全局令牌桶；有播放流活跃时，预取与下载还要再过一个较小的后台令牌桶，
+    把带宽让给播放。等待令牌时高优先级先行。读取端放慢后 TCP 窗口会把速率回压到上游。
+    """
+
+    def __init__(self, rate=0, background_rate=BACKGROUND_LIMIT_KBPS * 1024, estimator=None):
+        self.estimator = estimator if estimator is not None else bandwidth
+        self.cond = threading.Condition()
+        self.bucket = TokenBucket(rate)
+        self.background = TokenBucket(background_rate)
+        self.active = [0] * len(PRIORITY_NAMES)
+        self.waiting = [0] * len(PRIORITY_NAMES)
+        self.bytes = [0] * len(PRIORITY_NAMES)
+        self.throttled = [0.0] * len(PRIORITY_NAMES)
+
+    def configure(self, rate=None, background_rate=None):
+        """修改全局或后台带宽上限（字节/秒），对进行中的传输立即生效"""
+        with self.cond:
+            if rate is not None:
+                self.bucket.set_rate(rate)
+            if background_rate is not None:
+                self.background.set_rate(background_rate)
+            self.cond.notify_all()
+
+    def transfer(self, priority):
+        return Transfer(self, priority)
+
+    def _register(self, priority, delta):
+        with self.cond:
+            self.active[priority] += delta
+            self.cond.notify_all()
+
+    def consume(self, nbytes, priority):
+        """申请 nbytes 字节的带宽，超出上限时阻塞，返回等待的秒数"""
+        begin = time.monotonic()
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    if any(self.waiting[:priority]):
+                        # 更高优先级在等令牌，先让它拿
+                        self.cond.wait(1.0)
+                        continue
+                    buckets = [self.bucket]
+                    if priority > PRIORITY_INTERACTIVE and self.active[PRIORITY_INTERACTIVE]:
+                        buckets.append(self.background)
+                    now = time.monotonic()
+                    delay = max(bucket.delay(now) for bucket in buckets)
+                    if delay <= 0:
+                        for bucket in buckets:
+                            bucket.take(nbytes)
+                        break
+                    self.cond.wait(delay)
+            finally:
+                waited = time.monotonic() - begin
+                self.waiting[priority] -= 1
+                self.bytes[priority] += nbytes
+                self.throttled[priority] += waited
+                self.cond.notify_all()
+        return waited
+
+    def stats(self):
+        with self.cond:
+            return {
+                'rate': self.bucket.rate,
+                'background_rate': self.background.rate,
+                'classes': {
+                    name: {
+                        'active': self.active[i],
+                        'bytes': self.bytes[i],
+                        'throttled_seconds': round(self.throttled[i], 3),
+                    }
+                    for i, name in enumerate(PRIORITY_NAMES)
+                },
+            }
+
+# ================= 下载引擎 =================
+
+class RangeNotSupported(Exception):
+    """服务器未按要求返回分段内容"""
+
+
+class DownloadCancelled(Exception):
+    """下载被用户取消"""
+
+
+def preallocate(f, size):
+    """为文件预留 size 字节：支持时用 posix_fallocate 分配磁盘块，否则扩展文件长度"""
+    if size <= 0:
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        f.truncate(size)
+
+
+class InlineDigest:
+    """边写边按文件顺序计算 SHA-256
+
+    写入恰好接在已哈希位置之后时直接哈希内存中的数据；分段下载中先写完的后续区间，
+    等前面的区间追上后从文件补读（刚写入，仍在页缓存中），完成时无需再读一遍整个文件。
+    """
+
+    def __init__(self, path, size=None, segments=None):
+        self.path = path
+        self.size = size
+        self.segments = segments          # 分段下载的 [[start, end, done], ...]，None 表示顺序写入
+        self.sha = hashlib.sha256()
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def update(self, offset, data):
+        """在 offset 处写入 data 之后调用"""
+        with self.lock:
+            if offset == self.position:
+                self.sha.update(data)
+                self.position += len(data)
+            if self.segments is not None:
+                self._catch_up()
+
+    def _catch_up(self):
+        """哈希位置之后已经写入文件的部分从文件补读"""
+        for start, end, done in self.segments:
+            if start <= self.position <= end and self.position < start + done:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.position)
+                    remaining = start + done - self.position
+                    while remaining > 0:
+                        data = f.read(min(WRITE_BUFFER_SIZE, remaining))
+                        if not data:
+                            raise IOError(f"Unexpected end of {self.path} at {self.position}")
+                        self.sha.update(data)
+                        self.position += len(data)
+                        remaining -= len(data)
+
+    def hexdigest(self):
+        """返回整个文件的摘要，字节数与预期不符时抛出 IOError"""
+        with self.lock:
+            if self.segments is not None:
+                self._catch_up()
+            if self.size is not None and self.position != self.size:
+                raise IOError(f"Incomplete download: {self.position}/{self.size} bytes")
+            return self.sha.hexdigest()
+
+
+class HashingWriter:
+    """顺序写入文件并同时计算 SHA-256"""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        self.file.write(data)
+        self.sha.update(data)
+        self.size += len(data)
+
+    def close(self):
+        self.file.close()
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
+
+
+class DownloadJournal:
+    """记录未完成下载的日志，支持断点续传与重启后恢复"""
+
+    def __init__(self, path=JOURNAL_FILE, interval=JOURNAL_SAVE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_save = 0.0
+        self.entries = self._load()
+
+    def _load(self):
+        """读取日志文件，损坏时丢弃"""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load download journal: {e}")
+        return {}
+
+    def get(self, file_path):
+        with self.lock:
+            return self.entries.get(file_path)
+
+    def put(self, file_path, entry):
+        with self.lock:
+            self.entries[file_path] = entry
+        self.flush()
+
+    def remove(self, file_path):
+        with self.lock:
+            self.entries.pop(file_path, None)
+        self.flush()
+
+    def pending(self):
+        """列出所有未完成的下载"""
+        with self.lock:
+            return [dict(entry, file_path=path) for path, entry in self.entries.items()]
+
+    def touch(self):
+        """进度变化时调用，按间隔节流写盘"""
+        if time.monotonic() - self.last_save >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """原子写入日志：先写临时文件再替换"""
+        with self.lock:
+            self.last_save = time.monotonic()
+            try:
+                atomic_write_json(self.path, self.entries)
+            except Exception as e:
+                logger.error(f"Failed to save download journal: {e}")
+
+
+class SegmentedDownloader:
+    """多连接分段下载器，写入 .part 文件并支持断点续传，服务器不支持 Range 时退回单连接"""
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, min_segment=SEGMENT_MIN_SIZE, chunk_size=CHUNK_SIZE,
+                 journal=None, http=None, scheduler=None, buffer_size=WRITE_BUFFER_SIZE,
+                 threshold=SEGMENT_THRESHOLD):
+        self.workers = max(1, workers)
+        self.min_segment = max(1, min_segment)
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.buffer_size = max(chunk_size, buffer_size)
+        self.journal = journal if journal is not None else DownloadJournal()
+        self.http = http or get_http_client()
+        self.scheduler = scheduler or TransferScheduler()
+        self.lock = threading.Lock()
+        self.stats = {'downloads': 0, 'resumed': 0, 'fallbacks': 0, 'retries': 0}
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="segment")
+
+    def probe(self, url):
+        """探测文件大小、Range 支持与校验头"""
+        info = {'size': 0, 'accept_ranges': False, 'etag': None, 'last_modified': None}
+        try:
+            with self.http.head(url) as resp:
+                info['size'] = int(resp.headers.get('Content-Length') or 0)
+                info['accept_ranges'] = resp.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                info['etag'] = resp.headers.get('ETag')
+                info['last_modified'] = resp.headers.get('Last-Modified')
+        except Exception as e:
+            logger.debug(f"Probe failed for {url}: {e}")
+        return info
+
+    def _get(self, url, headers=None):
+        """以流式 GET 打开音频，并把首字节时间计入带宽估计"""
+        resp = self.http.get(url, headers=headers, stream=True)
+        self.scheduler.estimator.record_ttfb(resp.elapsed.total_seconds())
+        return resp
+
+    def open(self, url):
+        """用从头开始的 Range GET 代替 HEAD 探测，返回 (响应, 探测结果)，由调用方读取并关闭响应
+
+        支持 Range 的服务器回 206，总大小取自 Content-Range，响应体直接作为第一段继续读取；
+        不支持时回 200，响应体就是整个文件。这样每个下载都省掉一次往返。
+        """
+        import requests
+        try:
+            resp = self._get(url, {'Range': 'bytes=0-'})
+        except requests.HTTPError as e:
+            # 空文件没有可满足的区间
+            if e.response is None or e.response.status_code != 416:
+                raise
+            resp = self._get(url)
+        info = {'size': 0, 'accept_ranges': False, 'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified')}
+        if resp.status_code == 206:
+            if not re.match(r'bytes 0-\d+/\d+', resp.headers.get('Content-Range', '')):
+                resp.close()
+                raise IOError(f"Unexpected Content-Range for {url}: {resp.headers.get('Content-Range')}")
+            info['size'] = content_total(resp)
+            info['accept_ranges'] = True
+        elif resp.headers.get('Content-Encoding', 'identity').lower() == 'identity':
+            info['size'] = content_total(resp) or 0
+        return resp, info
+
+    def split(self, size):
+        """把文件按字节切成若干区间 [[start, end, done], ...]，end 为闭区间；不超过阈值的文件只有一段"""
+        count = 1 if size <= self.threshold else min(self.workers, max(1, size // self.min_segment))
+        step = size // count
+        segments = []
+        for i in range(count):
+            start = i * step
+            end = size - 1 if i == count - 1 else start + step - 1
+            segments.append([start, end, 0])
+        return segments
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def download_with_retry(self, url, file_path, progress=None, cancel=None, retries=HTTP_RETRIES,
+                            priority=PRIORITY_BULK, info=None):
+        """带重试的下载，失败后从 .part 断点继续；info 为调用方已有的探测结果，只用于第一次尝试
+
+        永久性错误（如 HTTP 404）不重试，并丢弃 .part 与日志记录，下次启动不会再续传它。
+        """
+        for attempt in range(retries):
+            try:
+                return self.download(url, file_path, progress, cancel, priority, info if attempt == 0 else None)
+            except DownloadCancelled:
+                raise
+            except Exception as e:
+                if HttpClient.is_permanent(e):
+                    logger.warning(f"Download of {url} failed permanently ({e}), discarding it")
+                    self.discard(file_path)
+                    raise
+                logger.warning(f"Download attempt {attempt + 1} failed: {e}")
+                if attempt < retries - 1:
+                    self._count('retries')
+                    time.sleep(self.http.backoff(attempt))
+                else:
+                    raise e
+
+    def download(self, url, file_path, progress=None, cancel=None, priority=PRIORITY_BULK, info=None):
+        """下载 url 到 file_path，已有同源 .part 时续传，返回 (文件字节数, SHA-256, 探测结果)
+
+        摘要在写入时顺带计算，并与 Content-Length 核对，不完整的文件不会落地。
+        progress(delta, total) 在每写入一块后回调；cancel 为 threading.Event，置位后抛出 DownloadCancelled；
+        priority 为传输调度的优先级；info 为 probe() 的结果，省略时用 open() 探测，探测请求的响应体不会浪费。
+        返回的探测结果带有这次下载所对应版本的 ETag 与 Last-Modified，供去重索引判断上游是否更新
+        """
+        progress = progress or (lambda delta, total: None)
+        self._count('downloads')
+        part_path = file_path + PART_SUFFIX
+        first = None
+        if info is None:
+            first, info = self.open(url)
+        try:
+            written, digest = self._download(url, file_path, part_path, info, first, progress, cancel, priority)
+            return written, digest, info
+        finally:
+            if first is not None:
+                first.close()
+
+    def _download(self, url, file_path, part_path, info, first, progress, cancel, priority):
+        """first 为 open() 返回的、从第 0 字节开始的响应，交给需要从头读的那一段或单连接下载"""
+        if info['accept_ranges'] and info['size'] > 0:
+            entry = self._resume_entry(url, part_path, info, self.journal.get(file_path))
+            if entry is None:
+                entry = {
+                    'url': url,
+                    'size': info['size'],
+                    'etag': info['etag'],
+                    'last_modified': info['last_modified'],
+                    'segments': self.split(info['size']),
+                }
+                with open(part_path, 'wb') as f:
+                    preallocate(f, info['size'])
+            else:
+                done = sum(seg[2] for seg in entry['segments'])
+                logger.info(f"Resuming {file_path} from {done}/{entry['size']} bytes")
+                self._count('resumed')
+                progress(done, entry['size'])
+            self.journal.put(file_path, entry)
+            # 分段下载接管 first，之后不论成败都不能再用它
+            first, response = None, first
+            try:
+                result = self._download_segmented(url, part_path, entry, progress, cancel, priority, response)
+            except RangeNotSupported as e:
+                logger.warning(f"Segmented download unavailable, falling back to single stream: {e}")
+                self._count('fallbacks')
+            else:
+                os.replace(part_path, file_path)
+                self.journal.remove(file_path)
+                return result
+
+        self.journal.put(file_path, {'url': url, 'size': info['size'], 'etag': info['etag'],
+                                     'last_modified': info['last_modified'], 'segments': None})
+        result = self._download_single(url, part_path, info['size'], progress, cancel, priority, first)
+        os.replace(part_path, file_path)
+        self.journal.remove(file_path)
+        return result
+
+    def _resume_entry(self, url, part_path, info, entry):
+        """校验日志记录是否仍可续传：同一 URL、同一版本、.part 完整"""
+        if not entry or not entry.get('segments') or entry.get('url') != url:
+            return None
+        if entry.get('size') != info['size'] or not os.path.exists(part_path):
+            return None
+        if os.path.getsize(part_path) != info['size']:
+            return None
+        if (entry.get('etag') or info['etag']) and entry.get('etag') != info['etag']:
+            return None
+        if (entry.get('last_modified') or info['last_modified']) and entry.get('last_modified') != info['last_modified']:
+            return None
+        return entry
+
+    def discard(self, file_path):
+        """丢弃未完成的下载：删除 .part 文件与日志记录"""
+        part_path = file_path + PART_SUFFIX
+        if os.path.exists(part_path):
+            try:
+                os.remove(part_path)
+            except Exception as e:
+                logger.warning(f"Failed to remove {part_path}: {e}")
+        self.journal.remove(file_path)
+
+    def _download_single(self, url, part_path, size, progress, cancel, priority, resp=None):
+        """单连接顺序下载，resp 为已打开的整个文件的响应"""
+        if resp is None:
+            resp = self._get(url)
+        with resp, open(part_path, 'wb', buffering=0) as f:
+            # 压缩传输时解码后的长度与 Content-Length 不同，无法核对
+            length = resp.headers.get('Content-Length')
+            if length and resp.headers.get('Content-Encoding', 'identity').lower() == 'identity':
+                size = int(length)
+                preallocate(f, size)
+            else:
+                size = None
+            digest = InlineDigest(part_path, size)
+
+            def flushed(offset, data):
+                digest.update(offset, data)
+                progress(len(data), size or 0)
+
+            written = self._copy(resp, f, 0, cancel, priority, flushed)
+            if size is not None and written < size:
+                raise IOError(f"Incomplete download: {written}/{size} bytes")
+            f.truncate(written)
+        return written, digest.hexdigest()
+
+    def _download_segmented(self, url, part_path, entry, progress, cancel, priority, first=None):
+        """并发下载各个区间中尚未完成的部分；first 为从第 0 字节开始的响应，交给还没开始的第一段"""
+        size = entry['size']
+        segments = entry['segments']
+        logger.info(f"Segmented download: {len(segments)} segments, {size} bytes")
+
+        head = segments[0] if first is not None and segments[0][0] + segments[0][2] == 0 else None
+        if first is not None and head is None:
+            first.close()
+        digest = InlineDigest(part_path, size, segments)
+        futures = [self.executor.submit(self._fetch_range, url, part_path, seg, size, digest, progress, cancel,
+                                        priority, first if seg is head else None)
+                   for seg in segments]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            # 等仍在写入的区间结束，避免与回退路径同时写同一个文件
+            wait(futures)
+            if head is not None:
+                first.close()
+            self.journal.flush()
+            raise
+
+        written = sum(seg[2] for seg in segments)
+        if written != size:
+            raise IOError(f"Incomplete download: {written}/{size} bytes")
+        return written, digest.hexdigest()
+
+    def _fetch_range(self, url, part_path, seg, size, digest, progress, cancel, priority, resp=None):
+        """下载区间中未完成的部分，直接写入文件对应偏移并记录进度；resp 为已打开的、从区间起点开始的响应"""
+        start, end = seg[0] + seg[2], seg[1]
+        if start > end:
+            return
+        if resp is None:
+            resp = self._get(url, {'Range': f'bytes={start}-{end}'})
+        with resp:
+            if resp.status_code != 206:
+                raise RangeNotSupported(f"HTTP {resp.status_code} for range {start}-{end}")
+
+            def flushed(offset, data):
+                # 只有已写入文件的字节才计入进度，续传不会跳过仍在缓冲区里的数据
+                seg[2] += len(data)
+                self.journal.touch()
+                digest.update(offset, data)
+                progress(len(data), size)
+
+            with open(part_path, 'r+b', buffering=0) as f:
+                f.seek(start)
+                # 探测请求的响应一直延续到文件末尾，只取到本段结尾
+                self._copy(resp, f, start, cancel, priority, flushed, limit=end - start + 1)
+        if seg[0] + seg[2] != end + 1:
+            raise IOError(f"Short range {seg[0]}-{end}: got {seg[2]} bytes")
+
+    def _copy(self, resp, f, offset, cancel, priority, flushed, limit=None):
+        """把响应体攒进复用的缓冲区，满一块写一次文件；每次写入后调用 flushed(offset, data)，返回写入的字节数
+
+        limit 为最多读取的字节数，读满后不再读取剩余的响应体。
+        """
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        filled = 0
+        written = 0
+
+        def flush():
+            data = view[:filled]
+            while data:
+                data = data[f.write(data):]
+            flushed(offset + written, view[:filled])
+            return filled
+
+        with self.scheduler.transfer(priority) as transfer:
+            try:
+                for chunk in resp.iter_content(self.chunk_size):
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(resp.url)
+                    if limit is not None:
+                        chunk = chunk[:limit]
+                        limit -= len(chunk)
+                    transfer.consume(len(chunk))
+                    chunk = memoryview(chunk)
+                    while chunk:
+                        take = min(len(chunk), len(buffer) - filled)
+                        buffer[filled:filled + take] = chunk[:take]
+                        filled += take
+                        chunk = chunk[take:]
+                        if filled == len(buffer):
+                            written += flush()
+                            filled = 0
+                    if limit == 0:
+                        break
+            except Exception:
+                # 连接中断前收到的数据是完整的，写盘后续传可以从这里接着下
+                if filled:
+                    written += flush()
+                raise
+            if filled:
+                written += flush()
+        return written
+
+# ================= 音频缓存 =================
+
+def normalize_url(url):
+    """规范化 URL 作为缓存键：小写协议与主机、去掉默认端口与片段、查询参数排序"""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port
+    if port and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+        host = f"{host}:{port}"
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def file_sha256(path):
+    """计算文件的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink(src, dst):
+    """尝试写时复制克隆（Linux FICLONE），不支持时抛出 OSError"""
+    import fcntl
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), 0x40049409, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def clone_or_copy(src, dst):
+    """按 reflink → 复制的顺序把 src 落到 dst，返回所用方式
+
+    不用硬链接：两边总有一个是用户可见的文件，共用 inode 时编辑或写标签会悄悄改掉另一边，包括缓存对象。
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            reflink(src, dst)
+            return 'reflink'
+        except (OSError, ImportError):
+            pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+class AudioCache:
+    """按内容哈希存储的音频缓存：URL → 哈希 → 对象文件，字节预算内按 LRU 淘汰，索引持久化"""
+
+    INDEX_VERSION = 1
+
+    def __init__(self, root=AUDIO_CACHE_DIR, budget=CACHE_BUDGET, save_interval=JOURNAL_SAVE_INTERVAL):
+        self.root = root
+        self.budget = budget
+        self.save_interval = save_interval
+        self.index_path = os.path.join(root, "index.json")
+        self.lock = threading.Lock()
+        self.last_save = 0.0
+        self.dirty = False
+        self.urls = {}                             # 规范化 URL -> 哈希
+        self.objects = collections.OrderedDict()   # 哈希 -> {'size', 'urls'}，按最近访问排序
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """读取索引，不扫描目录"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != self.INDEX_VERSION:
+                logger.warning("Cache index version mismatch, starting empty")
+                return
+            for digest, meta in data.get('objects', []):
+                self.objects[digest] = meta
+                self.total += meta['size']
+                for url in meta['urls']:
+                    self.urls[url] = digest
+        except Exception as e:
+            logger.error(f"Failed to load cache index: {e}")
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def temp_path(self):
+        """缓存目录内的临时文件路径，与对象目录同盘以便原子移动"""
+        return os.path.join(self.root, "tmp", f"{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}")
+
+    def contains(self, url):
+        """是否已缓存，不计入命中统计也不刷新 LRU"""
+        with self.lock:
+            digest = self.urls.get(normalize_url(url))
+            return digest is not None and os.path.exists(self.object_path(digest))
+
+    def get(self, url):
+        """查找 URL 对应的缓存文件，命中返回路径并刷新 LRU，否则返回 None"""
+        key = normalize_url(url)
+        with self.lock:
+            digest = self.urls.get(key)
+            if digest is not None and not os.path.exists(self.object_path(digest)):
+                # 对象文件被外部删除，修正索引
+                self._drop(digest)
+                digest = None
+            if digest is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.objects.move_to_end(digest)
+            self.dirty = True
+        self._maybe_save()
+        path = self.object_path(digest)
+        try:
+            shared = os.stat(path).st_nlink > 1
+        except OSError:
+            shared = False
+        return self._detach(digest) if shared else path
+
+    def _detach(self, digest):
+        """旧版本把对象硬链接到桌面，与用户文件共用 inode：摘要仍然相符时换成独立副本，否则丢弃对象"""
+        path = self.object_path(digest)
+        tmp_path = self.temp_path()
+        try:
+            shutil.copyfile(path, tmp_path)
+            if file_sha256(tmp_path) == digest:
+                os.replace(tmp_path, path)
+                logger.info(f"Detached cache object {digest} from a linked file")
+                return path
+            logger.warning(f"Cache object {digest} was modified through a linked file, dropping it")
+        except OSError as e:
+            logger.warning(f"Failed to detach cache object {digest}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        with self.lock:
+            self._drop(digest)
+            self.hits -= 1
+            self.misses += 1
+        return None
+
+    def put_file(self, url, src_path, move=False, digest=None):
+        """把文件加入缓存：move 为 True 时移动 src_path，否则克隆或复制；返回对象路径
+
+        复制大文件要几百毫秒，先在锁外复制到同盘的临时文件，锁内只做改名与索引更新，
+        不会挡住播放代理的 get()。
+        """
+        digest = digest or file_sha256(src_path)
+        size = os.path.getsize(src_path)
+        path = self.object_path(digest)
+        key = normalize_url(url)
+        with self.lock:
+            present = digest in self.objects and os.path.exists(path)
+        staged = None
+        if not present and not move:
+            staged = self.temp_path()
+            clone_or_copy(src_path, staged)
+        try:
+            with self.lock:
+                if digest not in self.objects or not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    if move or staged is not None:
+                        os.replace(src_path if move else staged, path)
+                        staged = None
+                    else:
+                        # 先前判断已存在的对象刚被淘汰，少见，直接在锁内复制
+                        clone_or_copy(src_path, path)
+                    if digest not in self.objects:
+                        self.objects[digest] = {'size': size, 'urls': []}
+                        self.total += size
+                elif move:
+                    os.remove(src_path)
+                old = self.urls.get(key)
+                if old is not None and old != digest and old in self.objects:
+                    # 同一 URL 内容已变化，解除旧对象的关联
+                    self.objects[old]['urls'].remove(key)
+                self.urls[key] = digest
+                if key not in self.objects[digest]['urls']:
+                    self.objects[digest]['urls'].append(key)
+                self.objects.move_to_end(digest)
+                self._evict()
+                self.dirty = True
+        finally:
+            if staged is not None:
+                # 复制期间其他线程已存入同一内容，或改名失败
+                try:
+                    os.remove(staged)
+                except OSError:
+                    pass
+        self.flush()
+        return path
+
+    def forget(self, url):
+        """上游内容已变化：解除 URL 与缓存对象的关联，对象本身按 LRU 淘汰"""
+        key = normalize_url(url)
+        with self.lock:
+            digest = self.urls.pop(key, None)
+            if digest is not None and digest in self.objects and key in self.objects[digest]['urls']:
+                self.objects[digest]['urls'].remove(key)
+                self.dirty = True
+
+    def materialize(self, url, dest):
+        """把缓存内容落到 dest，未命中返回 None，命中返回所用方式"""
+        path = self.get(url)
+        if path is None:
+            return None
+        return clone_or_copy(path, dest)
+
+    def _evict(self):
+        """超出预算时淘汰最久未访问的对象（需持有锁）"""
+        while self.total > self.budget and self.objects:
+            digest = next(iter(self.objects))
+            self._drop(digest)
+            self.evictions += 1
+            logger.info(f"Evicted cache object {digest}")
+
+    def _drop(self, digest):
+        """删除对象及其 URL 映射（需持有锁）"""
+        meta = self.objects.pop(digest, None)
+        if meta is None:
+            return
+        self.total -= meta['size']
+        for url in meta['urls']:
+            if self.urls.get(url) == digest:
+                del self.urls[url]
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove cache object {digest}: {e}")
+        self.dirty = True
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._evict()
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.objects),
+                'bytes': self.total,
+                'budget': self.budget,
+            }
+
+    def _maybe_save(self):
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.flush()
+
+    def flush(self):
+        """有改动时原子写入索引"""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.last_save = time.monotonic()
+            data = {'version': self.INDEX_VERSION, 'objects': list(self.objects.items())}
+            try:
+                atomic_write_json(self.index_path, data)
+            except Exception as e:
+                logger.error(f"Failed to save cache index: {e}")
+
+# ================= 下载去重 =================
+
+# 旧版重名时生成的副本：<名称>_<10 位时间戳>[_<序号>].<扩展名>
+TIMESTAMP_DUPLICATE = re.compile(r'^(?P<base>.+)_\d{10}(?:_\d+)?(?P<ext>\.[^.]+)$')
+
+
+class DownloadIndex:
+    """下载去重索引：来源 URL -> 内容摘要与上游版本，摘要 -> 本地持有该内容的文件
+
+    文件以 (大小, mtime_ns) 识别，被改动或删除的文件在查询时自动剔除。
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, path=DOWNLOAD_INDEX_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.urls = {}                    # 规范化 URL -> {'digest', 'size', 'etag', 'last_modified', 'checked'}
+        self.files = {}                   # 摘要 -> {路径: [大小, mtime_ns]}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.INDEX_VERSION:
+                self.urls = data['urls']
+                self.files = data['files']
+        except Exception as e:
+            logger.error(f"Failed to load download index: {e}")
+
+    def _save(self):
+        """写入索引（需持有锁）"""
+        try:
+            atomic_write_json(self.path, {'version': self.INDEX_VERSION, 'urls': self.urls, 'files': self.files})
+        except Exception as e:
+            logger.error(f"Failed to save download index: {e}")
+
+    @staticmethod
+    def _identity(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def _valid_paths(self, digest):
+        """摘要对应且未被改动的文件，顺带剔除失效记录（需持有锁）"""
+        files = self.files.get(digest, {})
+        valid = []
+        stale = False
+        for path, identity in list(files.items()):
+            try:
+                current = self._identity(path)
+            except OSError:
+                current = None
+            if current == identity:
+                valid.append(path)
+            else:
+                del files[path]
+                stale = True
+        if stale:
+            self._save()
+        return valid
+
+    def lookup(self, url):
+        """返回 (URL 记录, 持有该内容的文件列表)，没有记录时返回 (None, [])"""
+        with self.lock:
+            entry = self.urls.get(normalize_url(url))
+            if entry is None:
+                return None, []
+            return dict(entry), self._valid_paths(entry['digest'])
+
+    def paths(self, digest):
+        with self.lock:
+            return self._valid_paths(digest)
+
+    def record(self, url, digest, size, info=None):
+        """记录 URL 当前版本的内容摘要与上游校验头
+
+        info 没有校验头（例如从缓存落地，没有请求上游）而内容与已有记录相同时，沿用记录中的校验头。
+        """
+        info = info or {}
+        key = normalize_url(url)
+        with self.lock:
+            previous = self.urls.get(key)
+            if previous is None or previous['digest'] != digest or info.get('etag') or info.get('last_modified'):
+                previous = {}
+            self.urls[key] = {
+                'digest': digest,
+                'size': size,
+                'etag': info.get('etag') or previous.get('etag'),
+                'last_modified': info.get('last_modified') or previous.get('last_modified'),
+                'checked': time.time(),
+            }
+            self._save()
+
+    def confirm(self, url):
+        """上游探测确认仍是同一版本"""
+        with self.lock:
+            entry = self.urls.get(normalize_url(url))
+            if entry is not None:
+                entry['checked'] = time.time()
+                self._save()
+
+    def add_file(self, digest, path):
+        with self.lock:
+            self.files.setdefault(digest, {})[path] = self._identity(path)
+            self._save()
+
+    def forget_file(self, path):
+        with self.lock:
+            for files in self.files.values():
+                files.pop(path, None)
+            self._save()
+
+    @staticmethod
+    def is_current(entry, info):
+        """上游探测结果与记录是否为同一版本；两边都有的校验项才参与比较，无从比较时视为未变"""
+        if entry.get('etag') and info.get('etag'):
+            return entry['etag'] == info['etag']
+        if entry.get('size') and info.get('size') and entry['size'] != info['size']:
+            return False
+        if entry.get('last_modified') and info.get('last_modified'):
+            return entry['last_modified'] == info['last_modified']
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {'urls': len(self.urls), 'files': sum(len(files) for files in self.files.values())}
+
+# ================= 预取 =================
+
+def content_total(resp):
+    """从响应头取文件总大小：206 取 Content-Range，200 取 Content-Length，未知返回 None"""
+    if resp.status_code == 206:
+        match = re.match(r'bytes \d+-\d+/(\d+)', resp.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+    length = resp.headers.get('Content-Length')
+    return int(length) if length else None
+
+
+class Prefetcher:
+    """按播放队列在后台预热接下来的曲目：短曲目整首写入音频缓存，长曲目只保存开头一段供代理先行播放"""
+
+    def __init__(self, cache, http=None, scheduler=None, root=PREFETCH_DIR, count=PREFETCH_COUNT,
+                 budget=PREFETCH_BUDGET, head_size=PREFETCH_HEAD_SIZE, full_size=PREFETCH_FULL_SIZE):
+        self.cache = cache
+        self.http = http or get_http_client()
+        self.scheduler = scheduler or TransferScheduler()
+        self.root = root
+        self.count = max(0, count)
+        self.budget = budget
+        self.head_size = head_size
+        self.full_size = full_size
+        self.lock = threading.Lock()
+        self.heads = collections.OrderedDict()   # 规范化 URL -> {'path', 'size', 'total', 'etag', 'content_type'}
+        self.head_bytes = 0
+        self.cancel = threading.Event()
+        self.counts = {'queued': 0, 'full': 0, 'heads': 0, 'skipped': 0, 'cancelled': 0, 'errors': 0, 'bytes': 0}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        # 开头片段无法跨进程校验版本，启动时丢弃上次遗留的
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root, exist_ok=True)
+
+    def set_queue(self, urls):
+        """播放队列变化：取消进行中的预取，按顺序预热新的接下来 count 首，返回实际排队的 URL"""
+        upcoming = [url for url in dict.fromkeys(urls) if url][:self.count]
+        with self.lock:
+            self.cancel.set()
+            self.cancel = cancel = threading.Event()
+            self.counts['queued'] += len(upcoming)
+        if upcoming:
+            self.executor.submit(self._run, upcoming, cancel)
+        return upcoming
+
+    def head(self, url):
+        """已预取的开头片段信息，没有返回 None"""
+        with self.lock:
+            entry = self.heads.get(normalize_url(url))
+            if entry is None:
+                return None
+            self.heads.move_to_end(normalize_url(url))
+            return dict(entry)
+
+    def drop(self, url):
+        with self.lock:
+            entry = self.heads.pop(normalize_url(url), None)
+            if entry is not None:
+                self.head_bytes -= entry['size']
+        if entry is not None:
+            self._remove(entry['path'])
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove prefetched file {path}: {e}")
+
+    def _run(self, urls, cancel):
+        fetched = 0
+        for url in urls:
+            if cancel.is_set():
+                self._count('cancelled')
+                return
+            if fetched >= self.budget:
+                logger.info(f"Prefetch budget reached after {fetched} bytes")
+                return
+            if self.cache.contains(url) or self.head(url) is not None:
+                self._count('skipped')
+                continue
+            try:
+                fetched += self._prefetch(url, cancel)
+            except DownloadCancelled:
+                self._count('cancelled')
+                return
+            except Exception as e:
+                self._count('errors')
+                logger.warning(f"Prefetch failed for {url}: {e}")
+
+    def _prefetch(self, url, cancel):
+        """预取一首，返回读取的字节数"""
+        tmp_path = self.cache.temp_path()
+        try:
+            with self.http.get(url, headers={'Range': f'bytes=0-{self.head_size - 1}'}, stream=True) as resp, \
+                    HashingWriter(tmp_path) as f:
+                total = content_total(resp)
+                etag = resp.headers.get('ETag')
+                content_type = resp.headers.get('Content-Type')
+                whole = total is not None and total <= self.full_size
+                # 服务器忽略 Range 时返回整个文件：短曲目读完，长曲目只读开头
+                written = self._copy(resp, f, total if whole and resp.status_code == 200 else self.head_size, cancel)
+                if whole and resp.status_code == 206 and written < total:
+                    with self.http.get(url, headers={'Range': f'bytes={written}-'}, stream=True) as rest:
+                        if rest.status_code != 206 or rest.headers.get('ETag') != etag:
+                            raise IOError(f"Unexpected continuation response HTTP {rest.status_code}")
+                        written += self._copy(rest, f, total - written, cancel)
+            self._count('bytes', written)
+            if total is not None and written == total:
+                self.cache.put_file(url, tmp_path, move=True, digest=f.hexdigest())
+                self._count('full')
+                logger.info(f"Prefetched {url} ({written} bytes, full)")
+            elif resp.status_code == 206 and total is not None and written > 0:
+                # 只有支持 Range 的上游才能在片段之后续取
+                self._store_head(url, tmp_path, written, total, etag, content_type)
+                logger.info(f"Prefetched {url} ({written}/{total} bytes)")
+            return written
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _copy(self, resp, f, limit, cancel):
+        written = 0
+        with self.scheduler.transfer(PRIORITY_PREFETCH) as transfer:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                if cancel.is_set():
+                    raise DownloadCancelled(resp.url)
+                chunk = chunk[:limit - written]
+                transfer.consume(len(chunk))
+                f.write(chunk)
+                written += len(chunk)
+                if written >= limit:
+                    break
+        return written
+
+    def _store_head(self, url, tmp_path, size, total, etag, content_type):
+        key = normalize_url(url)
+        path = os.path.join(self.root, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        os.replace(tmp_path, path)
+        evicted = []
+        with self.lock:
+            old = self.heads.pop(key, None)
+            if old is not None:
+                self.head_bytes -= old['size']
+            self.heads[key] = {'path': path, 'size': size, 'total': total, 'etag': etag,
+                               'content_type': content_type}
+            self.head_bytes += size
+            self.counts['heads'] += 1
+            while self.head_bytes > self.budget and len(self.heads) > 1:
+                _, entry = self.heads.popitem(last=False)
+                self.head_bytes -= entry['size']
+                evicted.append(entry['path'])
+        for evicted_path in evicted:
+            self._remove(evicted_path)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, cached_heads=len(self.heads), head_bytes=self.head_bytes, budget=self.budget)
+
+# ================= 封面缓存 =================
+
+class ArtworkCache:
+    """封面缓存：每张原图只下载一次、按内容哈希存储，后台线程池生成多种尺寸的缩略图
+
+    原图与缩略图共用一个字节预算，按 LRU 淘汰；缩略图需要 Pillow，没有时直接返回原图。
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, root=ARTWORK_DIR, budget=ARTWORK_BUDGET, sizes=ARTWORK_SIZES, http=None,
+                 workers=ARTWORK_WORKERS, save_interval=JOURNAL_SAVE_INTERVAL):
+        self.root = root
+        self.budget = budget
+        self.sizes = tuple(sorted(sizes))
+        self.http = http or get_http_client()
+        self.save_interval = save_interval
+        self.index_path = os.path.join(root, "index.json")
+        self.lock = threading.Lock()
+        self.last_save = 0.0
+        self.dirty = False
+        self.urls = {}                             # 规范化 URL -> 原图哈希
+        self.files = collections.OrderedDict()     # 文件名 -> {'size', 'type'}，按最近访问排序
+        self.total = 0
+        self.inflight = {}                         # 进行中的下载或缩略图 -> Future
+        self.counters = {'hits': 0, 'fetches': 0, 'coalesced': 0, 'thumbnails': 0, 'evictions': 0}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="artwork")
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != self.INDEX_VERSION:
+                return
+            self.urls = data['urls']
+            for name, meta in data['files']:
+                self.files[name] = meta
+                self.total += meta['size']
+        except Exception as e:
+            logger.error(f"Failed to load artwork index: {e}")
+
+    def path(self, name):
+        return os.path.join(self.root, "objects", name[:2], name)
+
+    def fit(self, size):
+        """选不小于 size 的最小缩略图尺寸，比所有尺寸都大时返回 None 表示用原图"""
+        if not size:
+            return None
+        for candidate in self.sizes:
+            if candidate >= int(size):
+                return candidate
+        return None
+
+    def get(self, url, size=None):
+        """返回 (文件路径, Content-Type, 文件名)；size 为期望的边长，缩略图不可用时退回原图"""
+        key = normalize_url(url)
+        size = self.fit(size)
+        with self.lock:
+            digest = self.urls.get(key)
+        if digest is not None and size is not None:
+            name = f"{digest}_{size}.jpg"
+            if self._touch(name):
+                return self.path(name), 'image/jpeg', name
+        digest = self._original(url, key)
+        if size is not None:
+            try:
+                name = self._thumbnail(digest, size).result()
+                if name is not None and self._touch(name):
+                    return self.path(name), 'image/jpeg', name
+            except Exception as e:
+                logger.warning(f"Thumbnail {size}px failed for {url}: {e}")
+        with self.lock:
+            meta = self.files.get(digest) or {}
+        return self.path(digest), meta.get('type') or 'image/jpeg', digest
+
+    def _touch(self, name):
+        """文件存在时刷新 LRU 并计一次命中"""
+        with self.lock:
+            if name not in self.files:
+                return False
+            if not os.path.exists(self.path(name)):
+                self.total -= self.files.pop(name)['size']
+                self.dirty = True
+                return False
+            self.files.move_to_end(name)
+            self.counters['hits'] += 1
+        self._maybe_save()
+        return True
+
+    def _original(self, url, key):
+        """确保原图在本地，返回其哈希；并发的相同 URL 只下载一次"""
+        with self.lock:
+            digest = self.urls.get(key)
+            if digest is not None and digest in self.files and os.path.exists(self.path(digest)):
+                self.files.move_to_end(digest)
+                return digest
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not owner:
+            return future.result()
+        try:
+            with self.http.get(url, stream=True) as resp:
+                length = int(resp.headers.get('Content-Length') or 0)
+                if length > ARTWORK_MAX_BYTES:
+                    raise IOError(f"Artwork too large: {length} bytes")
+                content = resp.raw.read(ARTWORK_MAX_BYTES + 1, decode_content=True)
+                if len(content) > ARTWORK_MAX_BYTES:
+                    raise IOError(f"Artwork too large: over {ARTWORK_MAX_BYTES} bytes")
+                content_type = resp.headers.get('Content-Type', 'image/jpeg').split(';')[0]
+            digest = hashlib.sha256(content).hexdigest()
+            self._store(digest, content, content_type)
+            with self.lock:
+                self.urls[key] = digest
+                self.counters['fetches'] += 1
+            for size in self.sizes:
+                self._thumbnail(digest, size)
+            future.set_result(digest)
+            return digest
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def _store(self, name, content, content_type):
+        path = self.path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        self._add(name, len(content), content_type)
+
+    def _add(self, name, size, content_type):
+        evicted = []
+        with self.lock:
+            if name in self.files:
+                self.total -= self.files[name]['size']
+            self.files[name] = {'size': size, 'type': content_type}
+            self.total += size
+            while self.total > self.budget and len(self.files) > 1:
+                old, meta = self.files.popitem(last=False)
+                self.total -= meta['size']
+                self.counters['evictions'] += 1
+                evicted.append(old)
+            self.dirty = True
+        for old in evicted:
+            try:
+                os.remove(self.path(old))
+            except OSError:
+                pass
+        self._maybe_save()
+
+    def _thumbnail(self, digest, size):
+        """在线程池中生成缩略图，返回 Future，结果为文件名或 None（无法生成）"""
+        name = f"{digest}_{size}.jpg"
+        with self.lock:
+            future = self.inflight.get(name)
+            if future is not None:
+                return future
+            if name in self.files:
+                future = Future()
+                future.set_result(name)
+                return future
+            future = self.inflight[name] = self.executor.submit(self._make_thumbnail, digest, size, name)
+        # 回调可能立即在当前线程执行，必须在锁外注册
+        future.add_done_callback(lambda _: self._forget_inflight(name))
+        return future
+
+    def _forget_inflight(self, name):
+        with self.lock:
+            self.inflight.pop(name, None)
+
+    def _make_thumbnail(self, digest, size, name):
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        path = self.path(name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with Image.open(self.path(digest)) as img:
+            # JPEG 可在解码时直接按 1/2、1/4、1/8 缩小，省去全尺寸解码
+            img.draft('RGB', (size, size))
+            thumb = img.convert('RGB')
+            thumb.thumbnail((size, size))
+            thumb.save(tmp_path, 'JPEG', quality=85)
+        os.replace(tmp_path, path)
+        self._add(name, os.path.getsize(path), 'image/jpeg')
+        with self.lock:
+            self.counters['thumbnails'] += 1
+        return name
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.files), bytes=self.total, budget=self.budget)
+
+    def _maybe_save(self):
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.flush()
+
+    def flush(self):
+        """有改动时原子写入索引"""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.last_save = time.monotonic()
+            data = {'version': self.INDEX_VERSION, 'urls': self.urls, 'files': list(self.files.items())}
+            try:
+                atomic_write_json(self.index_path, data)
+            except Exception as e:
+                logger.error(f"Failed to save artwork index: {e}")
+
+# ================= 流媒体代理 =================
+
+def parse_range(header, size):
+    """解析单个 Range 头，返回闭区间 (start, end)；无 Range 返回 None，非法时抛出 ValueError"""
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        raise ValueError(header)
+    first, _, last = spec.strip().partition('-')
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(0, size - int(last))
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+class StreamRequestHandler(BaseHTTPRequestHandler):
+    """播放代理的请求处理：/stream/<id> 与 /artwork/<id>?size=<px>"""
+
+    protocol_version = "HTTP/1.1"
+    headers_sent = False                  # 当前请求的响应头是否已发出，出错时据此决定还能否返回状态码
+
+    def log_message(self, format, *args):
+        logger.debug(f"Stream proxy: {format % args}")
+
+    def end_headers(self):
+        super().end_headers()
+        self.headers_sent = True
+
+    def do_GET(self):
+        self.headers_sent = False
+        self.server.proxy.handle(self, head_only=False)
+
+    def do_HEAD(self):
+        self.headers_sent = False
+        self.server.proxy.handle(self, head_only=True)
+
+
+class StreamProxy:
+    """本地播放代理：<audio> 指向本地地址，边下边播、响应拖动的 Range 请求，并把完整内容写入缓存"""
+
+    def __init__(self, cache, http=None, host='127.0.0.1', port=0, scheduler=None, prefetcher=None, artwork=None):
+        self.cache = cache
+        self.http = http or get_http_client()
+        self.scheduler = scheduler or TransferScheduler()
+        self.prefetcher = prefetcher
+        self.artwork = artwork
+        self.artwork_sources = {}         # id -> 封面 URL
+        self.host = host
+        self.port = port
+        self.server = None
+        self.lock = threading.Lock()
+        self.sources = {}                 # id -> 上游 URL
+        self.filling = set()              # 正在写入缓存的 id
+        # 曲目起播（无 Range 或从 0 开始）的来源：完整缓存、预取片段或上游
+        self.starts = {'cache': 0, 'prefetch': 0, 'network': 0}
+
+    def start(self):
+        """启动代理线程（重复调用无副作用），返回端口"""
+        with self.lock:
+            if self.server is None:
+                self.server = ThreadingHTTPServer((self.host, self.port), StreamRequestHandler)
+                self.server.daemon_threads = True
+                self.server.proxy = self
+                self.port = self.server.server_address[1]
+                threading.Thread(target=self.server.serve_forever, name="stream-proxy", daemon=True).start()
+                logger.info(f"Stream proxy listening on {self.host}:{self.port}")
+            return self.port
+
+    def stop(self):
+        with self.lock:
+            if self.server is not None:
+                self.server.shutdown()
+                self.server.server_close()
+                self.server = None
+
+    def url_for(self, url):
+        """登记上游 URL，返回供 <audio> 使用的本地地址"""
+        self.start()
+        stream_id = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        with self.lock:
+            self.sources[stream_id] = url
+        return f"http://{self.host}:{self.port}/stream/{stream_id}"
+
+    def artwork_url_for(self, url, size=None):
+        """登记封面 URL，返回供 <img> 使用的本地地址"""
+        self.start()
+        artwork_id = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        with self.lock:
+            self.artwork_sources[artwork_id] = url
+        query = f"?size={int(size)}" if size else ""
+        return f"http://{self.host}:{self.port}/artwork/{artwork_id}{query}"
+
+    def handle(self, handler, head_only):
+        if handler.path.startswith('/artwork/') and self.artwork is not None:
+            self._serve_artwork(handler, head_only)
+            return
+        stream_id = handler.path.split('?', 1)[0].rsplit('/', 1)[-1]
+        with self.lock:
+            url = self.sources.get(stream_id)
+        if not handler.path.startswith('/stream/') or url is None:
+            handler.send_error(404)
+            return
+        import mimetypes
+        content_type = mimetypes.guess_type(urllib.parse.urlparse(url).path)[0] or 'audio/mpeg'
+        first = re.fullmatch(r'\s*bytes\s*=\s*0-\d*\s*', handler.headers.get('Range') or 'bytes=0-') is not None
+        try:
+            cached = self.cache.get(url)
+            if cached is not None:
+                self._record_start(first and not head_only, 'cache')
+                self._serve_cached(handler, cached, content_type, head_only)
+                return
+            head = self.prefetcher.head(url) if self.prefetcher is not None and not head_only else None
+            span = self._head_span(handler, head) if head is not None else None
+            if span is not None:
+                self._record_start(first, 'prefetch')
+                self._serve_head(handler, stream_id, url, head, span, content_type)
+                return
+            self._serve_upstream(handler, stream_id, url, content_type, head_only, first)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            logger.warning(f"Stream proxy error for {url}: {e}")
+            if handler.headers_sent:
+                # 响应体已经开始，只能断开连接让播放器重新请求
+                handler.close_connection = True
+                return
+            # 上游的 4xx 原样转给播放器，其余错误（5xx 重试用尽、连接失败）返回 502
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            try:
+                handler.send_error(status if status is not None and 400 <= status < 500 else 502)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def _serve_artwork(self, handler, head_only):
+        """返回封面原图或缩略图；文件名即内容版本，用作 ETag"""
+        parts = urllib.parse.urlsplit(handler.path)
+        with self.lock:
+            url = self.artwork_sources.get(parts.path.rsplit('/', 1)[-1])
+        if url is None:
+            handler.send_error(404)
+            return
+        try:
+            size = urllib.parse.parse_qs(parts.query).get('size', [None])[0]
+            path, content_type, name = self.artwork.get(url, int(size) if size else None)
+        except Exception as e:
+            logger.warning(f"Artwork unavailable for {url}: {e}")
+            handler.send_error(502)
+            return
+        etag = f'"{name}"'
+        try:
+            if handler.headers.get('If-None-Match') == etag:
+                handler.send_response(304)
+                handler.send_header('ETag', etag)
+                handler.end_headers()
+                return
+            with open(path, 'rb') as f:
+                body = f.read()
+            handler.send_response(200)
+            handler.send_header('Content-Type', content_type)
+            handler.send_header('Content-Length', str(len(body)))
+            handler.send_header('Cache-Control', 'max-age=86400')
+            handler.send_header('ETag', etag)
+            handler.end_headers()
+            if not head_only:
+                handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _serve_cached(self, handler, path, content_type, head_only):
+        """从本地缓存响应，支持 Range"""
+        size = os.path.getsize(path)
+        try:
+            byte_range = parse_range(handler.headers.get('Range'), size)
+        except ValueError:
+            handler.send_response(416)
+            handler.send_header('Content-Range', f'bytes */{size}')
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        start, end = byte_range or (0, size - 1)
+        handler.send_response(206 if byte_range else 200)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.send_header('Content-Length', str(end - start + 1))
+        if byte_range:
+            handler.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        handler.end_headers()
+        if head_only:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                handler.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def _serve_upstream(self, handler, stream_id, url, content_type, head_only, first=False):
+        """转发上游响应，从 0 开始的完整响应同时写入缓存；first 为曲目起播，播放器收到第一块数据后才计入"""
+        headers = {}
+        if handler.headers.get('Range'):
+            headers['Range'] = handler.headers['Range']
+        method = 'HEAD' if head_only else 'GET'
+        with self.http.request(method, url, headers=headers, stream=True) as resp:
+            if not head_only:
+                self.scheduler.estimator.record_ttfb(resp.elapsed.total_seconds())
+            handler.send_response(resp.status_code)
+            handler.send_header('Content-Type', resp.headers.get('Content-Type', content_type))
+            for name in ('Content-Length', 'Content-Range', 'Accept-Ranges'):
+                if name in resp.headers:
+                    handler.send_header(name, resp.headers[name])
+            handler.end_headers()
+            if head_only:
+                return
+
+            total = self._full_body_size(resp)
+            tee = None
+            if total is not None and self._claim_fill(stream_id):
+                tee_path = self.cache.temp_path()
+                tee = HashingWriter(tee_path)
+            chunks = resp.iter_content(CHUNK_SIZE)
+            if first:
+                chunks = self._record_after_first(chunks, 'network')
+            written = 0
+            try:
+                written, _ = self._relay(handler, chunks, tee)
+            finally:
+                if tee is not None:
+                    tee.close()
+                    self._finish_fill(stream_id, url, tee_path, written == total, tee.hexdigest())
+
+    @staticmethod
+    def _head_span(handler, head):
+        """请求的起点落在预取片段内时返回 (byte_range, start, end)，否则返回 None"""
+        try:
+            byte_range = parse_range(handler.headers.get('Range'), head['total'])
+        except ValueError:
+            return None
+        start, end = byte_range or (0, head['total'] - 1)
+        return (byte_range, start, end) if start < head['size'] else None
+
+    def _serve_head(self, handler, stream_id, url, head, span, content_type):
+        """开头一段来自预取片段，其余向上游续取"""
+        total = head['total']
+        byte_range, start, end = span
+        handler.send_response(206 if byte_range else 200)
+        handler.send_header('Content-Type', head['content_type'] or content_type)
+        handler.send_header('Accept-Ranges', 'bytes')
+        handler.send_header('Content-Length', str(end - start + 1))
+        if byte_range:
+            handler.send_header('Content-Range', f'bytes {start}-{end}/{total}')
+        handler.end_headers()
+
+        tee = None
+        if start == 0 and end == total - 1 and self._claim_fill(stream_id):
+            tee_path = self.cache.temp_path()
+            tee = HashingWriter(tee_path)
+        written = 0
+        try:
+            with open(head['path'], 'rb') as f:
+                f.seek(start)
+                local = f.read(min(end + 1, head['size']) - start)
+            written, client_alive = self._relay(handler, [local], tee, meter=False)
+            position = start + len(local)
+            if position <= end and (client_alive or tee is not None):
+                with self.http.get(url, headers={'Range': f'bytes={position}-{end}'}, stream=True) as resp:
+                    if resp.status_code != 206 or content_total(resp) != total or \
+                            (head['etag'] and resp.headers.get('ETag') != head['etag']):
+                        # 上游文件已变化，片段作废；断开连接让播放器重新请求
+                        self.prefetcher.drop(url)
+                        raise IOError(f"Prefetched head for {url} is stale (HTTP {resp.status_code})")
+                    more, _ = self._relay(handler, resp.iter_content(CHUNK_SIZE), tee, client_alive)
+                    written += more
+        finally:
+            if tee is not None:
+                tee.close()
+                self._finish_fill(stream_id, url, tee_path, written == total, tee.hexdigest())
+                if written == total:
+                    self.prefetcher.drop(url)
+
+    def _relay(self, handler, chunks, tee, client_alive=True, meter=True):
+        """把数据块写给播放器并同时写入缓存，返回 (写入缓存的字节数, 播放器是否仍连接)"""
+        written = 0
+        with self.scheduler.transfer(PRIORITY_INTERACTIVE) as transfer:
+            for chunk in chunks:
+                if meter:
+                    transfer.consume(len(chunk))
+                if tee is not None:
+                    tee.write(chunk)
+                    written += len(chunk)
+                if client_alive:
+                    try:
+                        begin = time.monotonic()
+                        handler.wfile.write(chunk)
+                        transfer.idle(time.monotonic() - begin)
+                    except (BrokenPipeError, ConnectionResetError):
+                        # 播放器拖动时会断开连接；正在写缓存时以预取优先级继续读完上游
+                        client_alive = False
+                        if tee is None:
+                            break
+                        transfer.demote(PRIORITY_PREFETCH)
+        return written, client_alive
+
+    def _record_start(self, first, source):
+        if first:
+            with self.lock:
+                self.starts[source] += 1
+
+    def _record_after_first(self, chunks, source):
+        """透传数据块，第一块交给播放器之后才计入起播来源，上游失败的起播不计"""
+        chunks = iter(chunks)
+        for chunk in chunks:
+            yield chunk
+            self._record_start(True, source)
+            break
+        yield from chunks
+
+    def stats(self):
+        """曲目起播来源计数与本地命中率"""
+        with self.lock:
+            starts = dict(self.starts)
+        count = sum(starts.values())
+        return dict(starts, local_hit_rate=(starts['cache'] + starts['prefetch']) / count if count else None)
+
+    @staticmethod
+    def _full_body_size(resp):
+        """响应覆盖整个文件时返回文件大小，否则返回 None"""
+        if resp.status_code == 200:
+            length = resp.headers.get('Content-Length')
+            return int(length) if length else None
+        content_range = resp.headers.get('Content-Range', '')
+        match = re.match(r'bytes 0-(\d+)/(\d+)', content_range)
+        if resp.status_code == 206 and match and int(match.group(1)) + 1 == int(match.group(2)):
+            return int(match.group(2))
+        return None
+
+    def _claim_fill(self, stream_id):
+        with self.lock:
+            if stream_id in self.filling:
+                return False
+            self.filling.add(stream_id)
+            return True
+
+    def _finish_fill(self, stream_id, url, tee_path, complete, digest=None):
+        try:
+            if complete:
+                self.cache.put_file(url, tee_path, move=True, digest=digest)
+                logger.info(f"Cached stream {stream_id}")
+            elif os.path.exists(tee_path):
+                os.remove(tee_path)
+        finally:
+            with self.lock:
+                self.filling.discard(stream_id)
+
+# ================= 下载队列 =================
+
+class DownloadQueue:
+    """批量下载队列：固定数量的工作线程，支持取消与限频进度事件"""
+
+    def __init__(self, run, notify=None, workers=QUEUE_WORKERS, progress_interval=PROGRESS_INTERVAL):
+        self.run = run                    # run(job, progress, cancel) 执行实际下载，返回文件路径
+        self.notify = notify or (lambda event, payload, key=None: None)
+        self.progress_interval = progress_interval
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="download")
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.next_id = 1
+
+    def enqueue(self, items):
+        """加入一批下载 [{'url': ..., 'filename': ...}, ...]，返回任务 ID 列表"""
+        ids = []
+        for item in items:
+            with self.lock:
+                job_id = str(self.next_id)
+                self.next_id += 1
+                job = {
+                    'id': job_id,
+                    'url': item['url'],
+                    'filename': item['filename'],
+                    'path': None,
+                    'status': 'queued',
+                    'bytes': 0,
+                    'total': 0,
+                    'speed': 0.0,
+                    'eta': None,
+                    'error': None,
+                    'cancel': threading.Event(),
+                    'future': None,
+                }
+                self.jobs[job_id] = job
+            job['future'] = self.executor.submit(self._worker, job)
+            ids.append(job_id)
+        return ids
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接移除，下载中的在下一块写入前停止"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] in ('done', 'error', 'cancelled'):
+                return False
+            job['cancel'].set()
+            if job['future'] is not None and job['future'].cancel():
+                job['status'] = 'cancelled'
+        if job['status'] == 'cancelled':
+            self._emit(job)
+        return True
+
+    def list(self):
+        """返回所有任务的快照"""
+        with self.lock:
+            return [self._snapshot(job) for job in self.jobs.values()]
+
+    def _snapshot(self, job):
+        return {key: value for key, value in job.items() if key not in ('cancel', 'future')}
+
+    def _emit(self, job):
+        with self.lock:
+            payload = self._snapshot(job)
+        try:
+            # 快照包含任务完整状态，同一任务只需送达最新一条
+            self.notify('download', payload, key=payload['id'])
+        except Exception as e:
+            logger.debug(f"Progress notify failed: {e}")
+
+    def _worker(self, job):
+        with self.lock:
+            # cancel() 在任务开始运行后、这里检查前到达时 future 已取消不掉，由这里标记并通知
+            cancelled = job['cancel'].is_set()
+            job['status'] = 'cancelled' if cancelled else 'downloading'
+        if cancelled:
+            self._emit(job)
+            return
+        started = time.monotonic()
+        state = {'base': None, 'last_emit': 0.0}
+        self._emit(job)
+
+        def progress(delta, total):
+            with self.lock:
+                job['bytes'] += delta
+                job['total'] = total
+                if state['base'] is None:
+                    # 续传时第一次回调是已完成的字节数，不计入速度
+                    state['base'] = job['bytes']
+                    return
+                now = time.monotonic()
+                if now - state['last_emit'] < self.progress_interval:
+                    return
+                state['last_emit'] = now
+                elapsed = max(now - started, 1e-6)
+                job['speed'] = (job['bytes'] - state['base']) / elapsed
+                if job['speed'] > 0 and total:
+                    job['eta'] = max(total - job['bytes'], 0) / job['speed']
+            self._emit(job)
+
+        try:
+            job['path'] = self.run(job, progress, job['cancel'])
+            job['status'] = 'done'
+            job['eta'] = 0
+        except DownloadCancelled:
+            job['status'] = 'cancelled'
+        except Exception as e:
+            logger.error(f"Queued download {job['id']} failed: {e}")
+            job['status'] = 'error'
+            job['error'] = str(e)
+        self._emit(job)
+
+# ================= 镜像与对冲请求 =================
+
+class Mirror:
+    """单个镜像的延迟统计（EWMA 与最近样本的 p90）和熔断状态"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.ewma = None                  # 成功请求耗时的指数加权平均（秒）
+        self.samples = collections.deque(maxlen=MIRROR_SAMPLES)
+        self.failures = 0                 # 连续失败次数
+        self.open_until = 0.0             # 熔断到期时间（monotonic），到期后放行一个试探请求
+        self.probing = False              # 已有试探请求在途，结束前其余请求不再发往该镜像
+        self.trips = 0
+        self.counters = {'requests': 0, 'errors': 0, 'wins': 0, 'hedged': 0, 'cancelled': 0}
+
+    def p90(self):
+        if len(self.samples) < MIRROR_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+    def score(self):
+        """排序依据：EWMA，没有样本时按默认对冲延迟估计"""
+        return self.ewma if self.ewma is not None else HEDGE_DEFAULT_DELAY
+
+    def available(self, now):
+        return self.open_until <= now and not self.probing
+
+    def success(self, latency):
+        self.samples.append(latency)
+        self.ewma = latency if self.ewma is None else self.ewma + MIRROR_EWMA_ALPHA * (latency - self.ewma)
+        self.failures = 0
+        self.open_until = 0.0
+
+    def failure(self, now):
+        self.counters['errors'] += 1
+        self.failures += 1
+        # 连续失败达到阈值，或熔断后尚未恢复（试探请求失败）时，熔断一段时间
+        if self.failures >= BREAKER_FAILURES or self.open_until:
+            self.open_until = now + BREAKER_COOLDOWN
+            self.trips += 1
+            logger.warning(f"Mirror {self.base_url} ejected for {BREAKER_COOLDOWN}s after {self.failures} failure(s)")
+
+    def stats(self, now):
+        return dict(self.counters, base_url=self.base_url, ewma_ms=None if self.ewma is None else self.ewma * 1000,
+                    p90_ms=None if self.p90() is None else self.p90() * 1000,
+                    healthy=self.available(now), failures=self.failures, trips=self.trips)
+
+
+class MirrorPool:
+    """一组等价的 API 镜像：按 EWMA 选最快的健康镜像发请求，超过其 p90 仍未返回时向次优镜像发对冲请求，
+    取先返回的结果并关闭落后的连接；连续失败的镜像被熔断，冷却后放行一个试探请求
+    """
+
+    def __init__(self, base_urls, http=None, workers=MIRROR_WORKERS):
+        self.mirrors = [Mirror(url) for url in dict.fromkeys(url.rstrip('/') for url in base_urls if url)]
+        if not self.mirrors:
+            raise ValueError("至少需要一个镜像")
+        self.http = http or get_http_client()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mirror")
+
+    def ranked(self):
+        """可用镜像按得分排序（同分保持配置顺序）；全部熔断时按到期先后全部返回"""
+        now = time.monotonic()
+        with self.lock:
+            healthy = [mirror for mirror in self.mirrors if mirror.available(now)]
+            if healthy:
+                return sorted(healthy, key=Mirror.score)
+            return sorted(self.mirrors, key=lambda mirror: mirror.open_until)
+
+    def _attempt(self, mirror, path, params, state, probe=False):
+        """向单个镜像发请求，返回解析后的 JSON；对冲已分出胜负时直接放弃；probe 为熔断到期后的试探请求"""
+        import requests
+        started = time.monotonic()
+        with self.lock:
+            mirror.counters['requests'] += 1
+        with self.http.lock:
+            self.http.stats['requests'] += 1
+        resp = None
+        try:
+            resp = self.http.session.get(mirror.base_url + path, params=params, timeout=self.http.timeout, stream=True)
+            with self.lock:
+                if state['done']:
+                    mirror.counters['cancelled'] += 1
+                    raise CancelledError()
+                state['responses'].append(resp)
+            resp.raise_for_status()
+            value = resp.json()
+        except requests.HTTPError:
+            # 除 429/5xx 外的 4xx 是请求本身的问题，换镜像也一样，不计入镜像健康
+            if resp.status_code in HttpClient.RETRY_STATUS:
+                self._fail(mirror, state)
+            raise
+        except (requests.RequestException, ValueError):
+            self._fail(mirror, state)
+            raise
+        else:
+            with self.lock:
+                mirror.success(time.monotonic() - started)
+            return value
+        finally:
+            if resp is not None:
+                resp.close()
+            if probe:
+                with self.lock:
+                    # 试探已有结论（成功闭合、失败重新熔断）或被放弃，半开的镜像可以再放行一个
+                    mirror.probing = False
+
+    def _fail(self, mirror, state):
+        with self.lock:
+            if state['done']:
+                # 落后的请求被关闭连接导致的错误不计入
+                mirror.counters['cancelled'] += 1
+                return
+            mirror.failure(time.monotonic())
+
+    def get(self, path, params=None):
+        """对冲 GET：返回最先成功的镜像的 JSON 结果
+
+        一轮中所有镜像都以可重试的错误（429/5xx、连接错误、超时）失败时，按 HttpClient 的重试次数与
+        退避策略（优先 Retry-After）整轮重试，只配置一个镜像时与直接用 HttpClient.request 的行为一致。
+        """
+        import requests
+        for attempt in range(self.http.retries):
+            retry_after = None
+            try:
+                return self._race(path, params)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in HttpClient.RETRY_STATUS or \
+                        attempt == self.http.retries - 1:
+                    raise
+                retry_after = HttpClient.parse_retry_after(e.response.headers.get('Retry-After'))
+                logger.warning(f"GET {path} returned HTTP {e.response.status_code} from every mirror, retrying")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.http.retries - 1:
+                    raise
+                logger.warning(f"GET {path} failed on every mirror ({e}), retrying")
+            with self.http.lock:
+                self.http.stats['retries'] += 1
+            time.sleep(self.http.backoff(attempt, retry_after))
+
+    def _race(self, path, params):
+        """一轮对冲请求：返回最先成功的镜像的 JSON 结果，全部失败时抛出最后一个错误"""
+        import requests
+        candidates = self.ranked()
+        state = {'done': False, 'responses': []}
+        pending = {}
+        error = None
+
+        def launch(hedged=False):
+            with self.lock:
+                # 半开的镜像只放行一个试探请求：排序之后被其他请求抢先试探的跳过，除非已没有别的候选
+                while len(candidates) > 1 and candidates[0].probing:
+                    candidates.pop(0)
+                mirror = candidates.pop(0)
+                probe = mirror.open_until > 0
+                if probe:
+                    mirror.probing = True
+                if hedged:
+                    mirror.counters['hedged'] += 1
+            pending[self.executor.submit(self._attempt, mirror, path, params, state, probe)] = mirror
+            return mirror
+
+        current = launch()
+        try:
+            while pending:
+                delay = None
+                if candidates:
+                    with self.lock:
+                        delay = max(HEDGE_MIN_DELAY, current.p90() or HEDGE_DEFAULT_DELAY)
+                done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    # 当前镜像超过其 p90 仍未返回，向次优镜像发对冲请求
+                    current = launch(hedged=True)
+                    continue
+                for future in done:
+                    mirror = pending.pop(future)
+                    try:
+                        value = future.result()
+                    except requests.HTTPError as e:
+                        if e.response is not None and e.response.status_code not in HttpClient.RETRY_STATUS:
+                            raise
+                        error = e
+                    except CancelledError:
+                        continue
+                    except Exception as e:
+                        error = e
+                    else:
+                        with self.lock:
+                            mirror.counters['wins'] += 1
+                        return value
+                # 失败的镜像立即由下一个候选接替，不必等到 p90
+                if not pending and candidates:
+                    current = launch()
+            raise error or RuntimeError("没有可用的镜像")
+        finally:
+            with self.lock:
+                state['done'] = True
+                responses = list(state['responses'])
+            for resp in responses:
+                resp.close()
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return [mirror.stats(now) for mirror in self.mirrors]
+
+# ================= 音乐 API 客户端 =================
+
+class TTLCache:
+    """带过期时间的 LRU 内存缓存"""
+
+    MISSING = object()
+
+    def __init__(self, maxsize=API_CACHE_SIZE, ttl=API_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.items = collections.OrderedDict()   # key -> (expires_at, value)
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return self.MISSING
+            if item[0] < time.monotonic():
+                del self.items[key]
+                return self.MISSING
+            self.items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class MusicApiClient:
+    """免费音乐 API 客户端：内存 TTL+LRU 缓存、可选磁盘二级缓存、相同请求合并为一次，网络请求在镜像间对冲"""
+
+    VOLATILE_ENDPOINTS = {'url'}
+
+    def __init__(self, base_url=MUSIC_API_BASE, http=None, endpoints=None, disk_dir=API_CACHE_DIR,
+                 disk_ttl=API_DISK_CACHE_TTL, mirrors=()):
+        self.base_url = base_url.rstrip('/')
+        self.http = http or get_http_client()
+        self.mirrors = MirrorPool([self.base_url, *mirrors], http=self.http)
+        self.endpoints = dict(MUSIC_API_ENDPOINTS, **(endpoints or {}))
+        self.memory = TTLCache()
+        self.disk_dir = disk_dir
+        self.disk_ttl = disk_ttl
+        self.lock = threading.Lock()
+        self.inflight = {}                 # key -> Future，进行中的请求
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'fetches': 0, 'coalesced': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def search(self, keywords, limit=30, offset=0):
+        return self.get('search', {'keywords': keywords, 'limit': limit, 'offset': offset})
+
+    def get_track(self, track_id):
+        return self.get('track', {'ids': track_id})
+
+    def get_album(self, album_id):
+        return self.get('album', {'id': album_id})
+
+    def get_song_url(self, track_id, level):
+        return self.get('url', {'id': track_id, 'level': level})
+
+    def get(self, endpoint, params):
+        """按 内存 → 磁盘 → 网络 的顺序取数据，并发的相同请求共享同一次网络请求"""
+        url = self.base_url + self.endpoints[endpoint]
+        key = normalize_url(f"{url}?{urllib.parse.urlencode(params)}")
+        # 播放地址带时效签名，只在内存中短暂缓存
+        persistent = endpoint not in self.VOLATILE_ENDPOINTS
+
+        value = self.memory.get(key)
+        if value is not TTLCache.MISSING:
+            self._count('memory_hits')
+            return value
+        value = self._disk_get(key) if persistent else TTLCache.MISSING
+        if value is not TTLCache.MISSING:
+            self._count('disk_hits')
+            self.memory.set(key, value)
+            return value
+
+        with self.lock:
+            # 等锁期间上一次请求可能刚刚完成并写入了缓存
+            value = self.memory.get(key)
+            if value is not TTLCache.MISSING:
+                self.counters['memory_hits'] += 1
+                return value
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+            else:
+                self.counters['coalesced'] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            self._count('fetches')
+            value = self.mirrors.get(self.endpoints[endpoint], params)
+            self.memory.set(key, value)
+            if persistent:
+                self._disk_set(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(counters, mirrors=self.mirrors.stats())
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return TTLCache.MISSING
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.disk_ttl:
+                return TTLCache.MISSING
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return TTLCache.MISSING
+
+    def _disk_set(self, key, value):
+        if not self.disk_dir:
+            return
+        try:
+            atomic_write_json(self._disk_path(key), value)
+        except Exception as e:
+            logger.warning(f"Failed to write API disk cache: {e}")
+
+# ================= 音质自适应 =================
+
+QUALITY_NAMES = [name for name, _ in QUALITY_LEVELS]
+
+
+def choose_quality(throughput, ttfb, floor=QUALITY_FLOOR, ceiling=QUALITY_CEILING, current=None, cap=0):
+    """在 [floor, ceiling] 内选出能同时满足起播时间目标与持续播放的最高音质
+
+    throughput 为估计吞吐（字节/秒，None 表示还没有样本），ttfb 为首字节时间（秒），
+    cap 为全局带宽上限（字节/秒，0 表示不限）。比 current 高的档位要多留 QUALITY_UPSWITCH_MARGIN 的余量。
+    """
+    low, high = sorted((QUALITY_NAMES.index(floor), QUALITY_NAMES.index(ceiling)))
+    if throughput is None:
+        return QUALITY_NAMES[min(max(QUALITY_NAMES.index(QUALITY_DEFAULT), low), high)]
+    if cap:
+        throughput = min(throughput, cap)
+    current_index = QUALITY_NAMES.index(current) if current in QUALITY_NAMES else None
+    best = low
+    for index in range(low, high + 1):
+        rate = QUALITY_LEVELS[index][1] * 1000 / 8
+        if current_index is not None and index > current_index:
+            rate *= QUALITY_UPSWITCH_MARGIN
+        start = (ttfb or 0.0) + rate * QUALITY_START_BUFFER / throughput
+        if rate <= throughput * QUALITY_HEADROOM and start <= QUALITY_START_TARGET:
+            best = index
+    return QUALITY_NAMES[best]
+
+
+class AdaptiveQuality:
+    """跟随带宽估计为曲目选择音质；估计变化使选择改变时调用 on_change(level)"""
+
+    def __init__(self, estimator=None, floor=QUALITY_FLOOR, ceiling=QUALITY_CEILING, cap=None, on_change=None):
+        self.estimator = estimator if estimator is not None else bandwidth
+        self.cap = cap or (lambda: 0)
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.set_range(floor, ceiling)
+        self.level = self._choose(None)
+        self.switches = 0
+        self.estimator.subscribe(self.update)
+
+    def set_range(self, floor, ceiling):
+        if floor not in QUALITY_NAMES or ceiling not in QUALITY_NAMES:
+            raise ValueError(f"音质需为 {', '.join(QUALITY_NAMES)} 之一")
+        if QUALITY_NAMES.index(floor) > QUALITY_NAMES.index(ceiling):
+            raise ValueError("最低音质不能高于最高音质")
+        with self.lock:
+            self.floor, self.ceiling = floor, ceiling
+
+    def _choose(self, current):
+        estimate = self.estimator.estimate()
+        return choose_quality(estimate['throughput'], estimate['ttfb'], self.floor, self.ceiling, current, self.cap())
+
+    def update(self):
+        """重新评估，返回当前音质；改变时通知"""
+        with self.lock:
+            previous = self.level
+            self.level = self._choose(previous)
+            changed = self.level != previous
+            if changed:
+                self.switches += 1
+            level = self.level
+        if changed:
+            logger.info(f"Quality {previous} -> {level} ({self.estimator.estimate()})")
+            if self.on_change is not None:
+                self.on_change(level)
+        return level
+
+    def candidates(self, level):
+        """从 level 向下到 floor 依次尝试的档位；手动指定低于 floor 的档位时只试它本身"""
+        with self.lock:
+            floor = QUALITY_NAMES.index(self.floor)
+        index = QUALITY_NAMES.index(level)
+        return QUALITY_NAMES[min(floor, index):index + 1][::-1]
+
+    def stats(self):
+        with self.lock:
+            return {'level': self.level, 'floor': self.floor, 'ceiling': self.ceiling, 'switches': self.switches,
+                    'estimate': self.estimator.estimate()}
+
+# ================= 本地曲库索引 =================
+
+def read_track_tags(path):
+    """读取标题/歌手/专辑：有 mutagen 时读标签，否则按 “歌手 - 标题” 解析文件名"""
+    tags = {'title': None, 'artist': None, 'album': None}
+    try:
+        import mutagen
+        audio = mutagen.File(path, easy=True)
+        if audio is not None and audio.tags:
+            for key in tags:
+                values = audio.tags.get(key)
+                if values:
+                    tags[key] = values[0]
+    except Exception:
+        pass
+    if not tags['title']:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        artist, sep, title = stem.partition(' - ')
+        if sep:
+            tags['artist'] = tags['artist'] or artist.strip()
+            tags['title'] = title.strip()
+        else:
+            tags['title'] = stem
+    return tags
+
+
+class LibraryIndex:
+    """基于 SQLite FTS5 的本地曲库索引，按 mtime/size/inode 增量重扫"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tracks (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            filename TEXT NOT NULL,
+            title TEXT, artist TEXT, album TEXT,
+            size INTEGER, mtime_ns INTEGER, inode INTEGER,
+            added_at REAL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+            title, artist, album, filename,
+            content='tracks', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+            INSERT INTO tracks_fts(rowid, title, artist, album, filename)
+            VALUES (new.id, new.title, new.artist, new.album, new.filename);
+        END;
+        CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+            INSERT INTO tracks_fts(tracks_fts, rowid, title, artist, album, filename)
+            VALUES ('delete', old.id, old.title, old.artist, old.album, old.filename);
+        END;
+        CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE ON tracks BEGIN
+            INSERT INTO tracks_fts(tracks_fts, rowid, title, artist, album, filename)
+            VALUES ('delete', old.id, old.title, old.artist, old.album, old.filename);
+            INSERT INTO tracks_fts(rowid, title, artist, album, filename)
+            VALUES (new.id, new.title, new.artist, new.album, new.filename);
+        END;
+    """
+
+    def __init__(self, path=LIBRARY_DB):
+        import sqlite3
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def index_records(self, records):
+        """批量写入或更新记录（单个事务），records 为包含 path/size/mtime_ns/inode 与标签的字典"""
+        rows = [(r['path'], os.path.basename(r['path']), r.get('title'), r.get('artist'), r.get('album'),
+                 r.get('size'), r.get('mtime_ns'), r.get('inode'), r.get('added_at', time.time()))
+                for r in records]
+        with self.lock, self.db:
+            self.db.executemany("""
+                INSERT INTO tracks (path, filename, title, artist, album, size, mtime_ns, inode, added_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    filename=excluded.filename, title=excluded.title, artist=excluded.artist,
+                    album=excluded.album, size=excluded.size, mtime_ns=excluded.mtime_ns, inode=excluded.inode
+            """, rows)
+
+    def add_file(self, path):
+        """索引单个文件（下载完成后调用）"""
+        st = os.stat(path)
+        record = {'path': os.path.abspath(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino}
+        record.update(read_track_tags(path))
+        self.index_records([record])
+
+    def rescan(self, roots):
+        """增量重扫：只重新读取新增或 mtime/size/inode 变化的文件，并删除已不存在的记录"""
+        started = time.perf_counter()
+        for root in roots:
+            root = os.path.abspath(root)
+            if not os.path.isdir(root):
+                continue
+            with self.lock:
+                prefix = os.path.join(root, '')
+                known = {path: (size, mtime_ns, inode) for path, size, mtime_ns, inode in self.db.execute(
+                    "SELECT path, size, mtime_ns, inode FROM tracks WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix))}
+            changed = []
+            seen = set()
+            for path, st in self._walk(root):
+                seen.add(path)
+                if known.get(path) == (st.st_size, st.st_mtime_ns, st.st_ino):
+                    continue
+                record = {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino}
+                record.update(read_track_tags(path))
+                changed.append(record)
+            removed = [(path,) for path in known if path not in seen]
+            if changed:
+                self.index_records(changed)
+            if removed:
+                with self.lock, self.db:
+                    self.db.executemany("DELETE FROM tracks WHERE path = ?", removed)
+            logger.info(f"Library rescan of {root}: {len(seen)} files, {len(changed)} changed, {len(removed)} removed")
+        return time.perf_counter() - started
+
+    @staticmethod
+    def _walk(root):
+        """递归遍历目录中的音频文件，返回 (路径, stat)"""
+        stack = [root]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                            yield entry.path, entry.stat()
+            except OSError as e:
+                logger.debug(f"Skip unreadable directory: {e}")
+
+    @staticmethod
+    def build_query(text):
+        """把用户输入转换为 FTS5 前缀查询，避免特殊字符造成语法错误"""
+        tokens = re.findall(r'\w+', text)
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, text, limit=50, offset=0):
+        """全文搜索，返回 (总数, 当前页记录)"""
+        query = self.build_query(text or '')
+        columns = "t.id, t.path, t.filename, t.title, t.artist, t.album, t.size"
+        with self.lock:
+            if query:
+                total = self.db.execute("SELECT count(*) FROM tracks_fts WHERE tracks_fts MATCH ?",
+                                        (query,)).fetchone()[0]
+                rows = self.db.execute(
+                    f"SELECT {columns} FROM tracks_fts JOIN tracks t ON t.id = tracks_fts.rowid "
+                    f"WHERE tracks_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                    (query, limit, offset)).fetchall()
+            else:
+                total = self.db.execute("SELECT count(*) FROM tracks").fetchone()[0]
+                rows = self.db.execute(
+                    f"SELECT {columns} FROM tracks t ORDER BY t.added_at DESC LIMIT ? OFFSET ?",
+                    (limit, offset)).fetchall()
+        keys = ('id', 'path', 'filename', 'title', 'artist', 'album', 'size')
+        return total, [dict(zip(keys, row)) for row in rows]
+
+# ================= 播放记录与歌单 =================
+
+class PlayLog:
+    """播放历史、收藏与歌单：每次修改追加一行 JSON 到日志，后台定期压缩进快照
+
+    日志按代编号（playlog.<代>.jsonl），快照记录其已包含的代数：启动时读取快照再重放更新代的日志，
+    压缩时先切换到新一代日志再写快照、删除旧日志，任何时刻崩溃都不会丢失或重复记录。
+    快照中曲目信息去重存为列表，历史按列存放时间差（秒）与曲目下标，避免重复解析 URL 与浮点数。
+    """
+
+    LOG_PATTERN = re.compile(r'^playlog\.(\d+)\.jsonl$')
+
+    def __init__(self, directory=os.path.dirname(CONFIG_FILE), compact_records=PLAYLOG_COMPACT_RECORDS,
+                 history_limit=HISTORY_LIMIT):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, PLAYLOG_SNAPSHOT)
+        self.compact_records = compact_records
+        self.lock = threading.Lock()
+        self.tracks = {}                  # URL -> 曲目信息
+        self.history = collections.deque(maxlen=history_limit)   # (时间, URL)，旧到新
+        self.favorites = {}               # URL -> 收藏时间，按收藏顺序
+        self.playlists = {}               # id -> {'name', 'created', 'tracks': [URL, ...]}
+        self.generation = 0               # 当前追加的日志代数
+        self.tail = 0                     # 快照之后的日志记录数
+        self.file = None
+        self.compacting = False
+        self.counters = {'appends': 0, 'compactions': 0, 'skipped': 0, 'load_ms': 0.0}
+        self._load()
+
+    def _log_path(self, generation):
+        return os.path.join(self.directory, f"playlog.{generation}.jsonl")
+
+    def _load(self):
+        # 载入会新建十几万个元组与字典，暂停循环垃圾回收，避免其反复遍历整个堆
+        import gc
+        started = time.perf_counter()
+        paused = gc.isenabled()
+        gc.disable()
+        try:
+            self._replay()
+        finally:
+            if paused:
+                gc.enable()
+        self._open()
+        self.counters['load_ms'] = (time.perf_counter() - started) * 1000
+        logger.info(f"Play log loaded: {len(self.history)} plays, {len(self.playlists)} playlist(s), "
+                    f"{self.tail} tail record(s) in {self.counters['load_ms']:.1f} ms")
+        if self.tail >= self.compact_records:
+            self._schedule_compaction()
+
+    def _replay(self):
+        """读取快照并重放其后的日志"""
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot_generation = 0
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            snapshot_generation = snapshot['generation']
+            tracks = snapshot['tracks']
+            urls = [track['url'] for track in tracks]
+            self.tracks = dict(zip(urls, tracks))
+            times = itertools.accumulate(snapshot['history']['time'])
+            self.history.extend(zip(times, map(urls.__getitem__, snapshot['history']['track'])))
+            self.favorites = dict(snapshot['favorites'])
+            self.playlists = snapshot['playlists']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning(f"Play log snapshot unreadable, replaying logs only: {e}")
+            self.tracks, self.favorites, self.playlists = {}, {}, {}
+            self.history.clear()
+
+        generations = sorted(int(match.group(1)) for match in map(self.LOG_PATTERN.match, os.listdir(self.directory)) if match)
+        for generation in generations:
+            path = self._log_path(generation)
+            if generation < snapshot_generation:
+                # 已并入快照，上次压缩在删除前中断
+                self._remove(path)
+                continue
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines()
+            lines = [line for line in lines if line.strip()]
+            try:
+                # 整个文件拼成一个数组解析，比逐行调用 json.loads 快数倍
+                records = json.loads(b'[' + b','.join(lines) + b']')
+            except ValueError:
+                # 有崩溃时写了一半的行，逐行解析跳过
+                records = []
+                for line in lines:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        self.counters['skipped'] += 1
+            for record in records:
+                try:
+                    self._apply(record)
+                except (ValueError, KeyError, TypeError, IndexError, AttributeError):
+                    self.counters['skipped'] += 1
+                    continue
+                self.tail += 1
+
+        self.generation = max(generations[-1] if generations else 0, snapshot_generation)
+
+    def _open(self):
+        path = self._log_path(self.generation)
+        self.file = open(path, 'ab')
+        # 上次崩溃留下不完整的末行时先补换行，避免与下一条记录粘连
+        if self.file.tell():
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write(b'\n')
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # 各操作的重放逻辑；追加时先写日志再应用到内存
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'play':
+            track = record['track']
+            self.tracks[track['url']] = track
+            self.history.append((record['t'], track['url']))
+        elif op == 'clear_history':
+            self.history.clear()
+        elif op == 'favorite':
+            track = record['track']
+            self.tracks[track['url']] = track
+            self.favorites.pop(track['url'], None)
+            self.favorites[track['url']] = record['t']
+        elif op == 'unfavorite':
+            self.favorites.pop(record['url'], None)
+        elif op == 'playlist_create':
+            self.playlists[record['id']] = {'name': record['name'], 'created': record['t'], 'tracks': []}
+        elif op == 'playlist_rename':
+            self.playlists[record['id']]['name'] = record['name']
+        elif op == 'playlist_delete':
+            self.playlists.pop(record['id'], None)
+        elif op == 'playlist_add':
+            for track in record['tracks']:
+                self.tracks[track['url']] = track
+            self.playlists[record['id']]['tracks'].extend(track['url'] for track in record['tracks'])
+        elif op == 'playlist_remove':
+            del self.playlists[record['id']]['tracks'][record['index']]
+        else:
+            raise ValueError(f"unknown op {op}")
+
+    def append(self, record):
+        """追加一条记录并应用到内存
+
+        先写日志：写盘失败时内存保持原样。应用失败的记录（例如歌单刚被删除）在重放时面对同样的状态，
+        同样失败并被跳过，内存与磁盘仍然一致。
+        """
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self._apply(record)
+            self.tail += 1
+            self.counters['appends'] += 1
+            compact = self.tail >= self.compact_records and not self.compacting
+        if compact:
+            self._schedule_compaction()
+
+    # 便捷操作
+
+    @staticmethod
+    def _track(track):
+        if not isinstance(track, dict) or not isinstance(track.get('url'), str):
+            raise ValueError("track 需要包含 url")
+        return track
+
+    def record_play(self, track):
+        self.append({'op': 'play', 't': int(time.time()), 'track': self._track(track)})
+
+    def clear_history(self):
+        self.append({'op': 'clear_history'})
+
+    def set_favorite(self, track, favorite=True):
+        if favorite:
+            self.append({'op': 'favorite', 't': int(time.time()), 'track': self._track(track)})
+        else:
+            self.append({'op': 'unfavorite', 'url': self._track(track)['url']})
+
+    def create_playlist(self, name):
+        import secrets
+        playlist_id = secrets.token_hex(6)
+        self.append({'op': 'playlist_create', 'id': playlist_id, 'name': str(name), 't': int(time.time())})
+        return playlist_id
+
+    def rename_playlist(self, playlist_id, name):
+        if playlist_id not in self.playlists:
+            raise KeyError(playlist_id)
+        self.append({'op': 'playlist_rename', 'id': playlist_id, 'name': str(name)})
+
+    def delete_playlist(self, playlist_id):
+        if playlist_id not in self.playlists:
+            raise KeyError(playlist_id)
+        self.append({'op': 'playlist_delete', 'id': playlist_id})
+
+    def add_to_playlist(self, playlist_id, tracks):
+        if playlist_id not in self.playlists:
+            raise KeyError(playlist_id)
+        self.append({'op': 'playlist_add', 'id': playlist_id, 'tracks': [self._track(track) for track in tracks]})
+
+    def remove_from_playlist(self, playlist_id, index):
+        with self.lock:
+            count = len(self.playlists[playlist_id]['tracks'])
+        if not -count <= int(index) < count:
+            raise IndexError(index)
+        self.append({'op': 'playlist_remove', 'id': playlist_id, 'index': int(index)})
+
+    # 查询
+
+    def recent(self, limit=50, offset=0):
+        """最近播放，新到旧"""
+        with self.lock:
+            entries = list(itertools.islice(reversed(self.history), offset, offset + limit))
+            return [{'played_at': played_at, 'track': self.tracks.get(url, {'url': url})} for played_at, url in entries]
+
+    def list_favorites(self):
+        with self.lock:
+            return [{'favorited_at': favorited_at, 'track': self.tracks.get(url, {'url': url})}
+                    for url, favorited_at in reversed(self.favorites.items())]
+
+    def list_playlists(self):
+        with self.lock:
+            return [{'id': playlist_id, 'name': playlist['name'], 'created': playlist['created'], 'count': len(playlist['tracks'])}
+                    for playlist_id, playlist in self.playlists.items()]
+
+    def get_playlist(self, playlist_id):
+        with self.lock:
+            playlist = self.playlists[playlist_id]
+            return {'id': playlist_id, 'name': playlist['name'], 'created': playlist['created'],
+                    'tracks': [self.tracks.get(url, {'url': url}) for url in playlist['tracks']]}
+
+    # 压缩
+
+    def _schedule_compaction(self):
+        with self.lock:
+            if self.compacting:
+                return
+            self.compacting = True
+        threading.Thread(target=self.compact, name="playlog-compact", daemon=True).start()
+
+    def compact(self):
+        """把当前状态写成快照并删除已并入的日志
+
+        锁内只做浅复制并切换到新一代日志，追加只等这一下；快照的构建与写盘都在锁外进行。
+        """
+        with self.lock:
+            self.compacting = True
+            try:
+                tracks = dict(self.tracks)
+                history = list(self.history)
+                favorites = list(self.favorites.items())
+                playlists = {playlist_id: dict(playlist, tracks=list(playlist['tracks']))
+                             for playlist_id, playlist in self.playlists.items()}
+                old_generation = self.generation
+                self.file.close()
+                self.generation += 1
+                self.tail = 0
+                self._open()
+            except Exception:
+                self.compacting = False
+                raise
+        try:
+            referenced = {url for _, url in history}
+            referenced.update(url for url, _ in favorites)
+            for playlist in playlists.values():
+                referenced.update(playlist['tracks'])
+            unreferenced = {url: tracks.pop(url) for url in [url for url in tracks if url not in referenced]}
+            index = {url: i for i, url in enumerate(tracks)}
+            times = [played_at for played_at, _ in history]
+            snapshot = {
+                'version': 1,
+                'generation': old_generation + 1,
+                'tracks': list(tracks.values()),
+                'history': {'time': [current - previous for previous, current in zip([0] + times, times)],
+                            'track': [index[url] for _, url in history]},
+                'favorites': favorites,
+                'playlists': playlists,
+            }
+            with self.lock:
+                # 复制之后又被引用的曲目会被新记录里的对象替换，只删仍是原对象的
+                for url, track in unreferenced.items():
+                    if self.tracks.get(url) is track:
+                        del self.tracks[url]
+            atomic_write_json(self.snapshot_path, snapshot)
+            for generation in range(old_generation, -1, -1):
+                path = self._log_path(generation)
+                if not os.path.exists(path):
+                    break
+                self._remove(path)
+            with self.lock:
+                self.counters['compactions'] += 1
+            logger.info(f"Play log compacted into generation {old_generation + 1}: {len(snapshot['history']['time'])} plays")
+        except OSError as e:
+            logger.error(f"Play log compaction failed: {e}")
+        finally:
+            with self.lock:
+                self.compacting = False
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, history=len(self.history), favorites=len(self.favorites),
+                        playlists=len(self.playlists), tracks=len(self.tracks), tail=self.tail, generation=self.generation)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+# ================= 后台任务 =================
+
+class JobRunner:
+    """后台任务执行器：有界线程池，桥接线程只负责提交，不等待结果
+
+    每个进行中的任务占用一个线程，同时执行的任务数以 workers 为上限；任务本身仍是阻塞调用
+    （requests、sqlite3），这里不是事件循环，也不会让多个 I/O 共用一个线程。
+    """
+
+    def __init__(self, workers=BACKEND_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backend")
+
+    def submit(self, func, *args):
+        """从任意线程提交任务，返回 concurrent.futures.Future"""
+        return self.executor.submit(func, *args)
+
+    def call_later(self, delay, func, *args):
+        """delay 秒后在线程池中执行 func，不阻塞调用方"""
+        if delay <= 0:
+            self.executor.submit(func, *args)
+            return
+        timer = threading.Timer(delay, self.executor.submit, (func, *args))
+        timer.daemon = True
+        timer.start()
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
+
+# ================= 事件总线 =================
+
+class EventBus:
+    """后端到页面的事件总线：生产者 publish 后立即返回，单个派发线程按帧间隔把积攒的事件
+    合并成一次 evaluate_js 推送，页面仍收到逐个的 coremusic:<topic> 事件
+
+    带 key 的事件（进度、播放状态）同一 (topic, key) 只保留最新一条；不带 key 的按发布顺序全部送达。
+    """
+
+    def __init__(self, window, interval=EVENT_FLUSH_INTERVAL):
+        self.window = window
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.pending = collections.OrderedDict()   # 合并键 -> (topic, payload)，按最近发布排序
+        self.seq = itertools.count()
+        self.thread = None
+        self.stopped = False
+        self.last_flush = 0.0
+        self.counters = {'published': 0, 'coalesced': 0, 'flushes': 0, 'delivered': 0, 'max_batch': 0, 'errors': 0}
+
+    def publish(self, topic, payload, key=None):
+        if self.window is None:
+            return
+        slot = (topic, key) if key is not None else (None, next(self.seq))
+        with self.cond:
+            self.counters['published'] += 1
+            if self.pending.pop(slot, None) is not None:
+                self.counters['coalesced'] += 1
+            self.pending[slot] = (topic, payload)
+            if self.thread is None and not self.stopped:
+                self.thread = threading.Thread(target=self._run, name="event-bus", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                # 距上次推送不足一个间隔时继续积攒；期间的 publish 只会唤醒后再次等待
+                deadline = self.last_flush + self.interval
+                while not self.stopped and time.monotonic() < deadline:
+                    self.cond.wait(deadline - time.monotonic())
+                if self.stopped:
+                    return
+            self.flush()
+
+    def flush(self):
+        """立即推送积攒的事件，返回推送的条数"""
+        with self.cond:
+            batch = list(self.pending.values())
+            self.pending.clear()
+            self.last_flush = time.monotonic()
+        if not batch:
+            return 0
+        detail = json.dumps(batch, ensure_ascii=False)
+        script = ("(function(batch){for(var i=0;i<batch.length;i++){window.dispatchEvent("
+                  f"new CustomEvent('coremusic:'+batch[i][0],{{detail:batch[i][1]}}));}}}})({detail})")
+        try:
+            self.window.evaluate_js(script)
+        except Exception as e:
+            logger.debug(f"Event flush failed: {e}")
+            with self.cond:
+                self.counters['errors'] += 1
+        with self.cond:
+            self.counters['flushes'] += 1
+            self.counters['delivered'] += len(batch)
+            self.counters['max_batch'] = max(self.counters['max_batch'], len(batch))
+        return len(batch)
+
+    def stop(self):
+        """停止派发线程并推送剩余事件"""
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.flush()
+
+    def stats(self):
+        with self.cond:
+            return dict(self.counters, pending=len(self.pending))
+
+# ================= 单实例 =================
+
+def filename_from_url(url):
+    """从下载链接推断文件名"""
+    path = urllib.parse.unquote(urllib.parse.urlparse(url).path)
+    name = path.replace('\\', '/').rsplit('/', 1)[-1].strip()
+    return name if name.strip('.') else "download"
+
+
+class InstanceLock:
+    """单实例锁：首个进程持有锁文件上的系统锁，并在本机端口上接收后续启动转发来的命令行参数
+
+    端口与随机令牌写入 INSTANCE_FILE（仅当前用户可读），后续启动据此连接、转发参数后直接退出。
+    系统锁随进程退出自动释放，崩溃后不会残留失效的锁。
+    """
+
+    def __init__(self, lock_path=INSTANCE_LOCK_FILE, info_path=INSTANCE_FILE):
+        self.lock_path = lock_path
+        self.info_path = info_path
+        self.file = None
+        self.server = None
+        self.token = None
+        self.info = {}
+        self.lock = threading.Lock()
+        self.handler = None
+        self.pending = []                 # 处理函数就绪前收到的参数
+
+    def acquire(self):
+        """尝试成为唯一实例，已有实例运行时返回 False"""
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        f = open(self.lock_path, 'a+')
+        try:
+            if sys.platform == 'win32':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def listen(self):
+        """开始接收后续启动的转发，返回端口"""
+        import secrets
+        import socket
+        self.token = secrets.token_hex(16)
+        self.server = socket.create_server(("127.0.0.1", 0))
+        port = self.server.getsockname()[1]
+        self.publish(pid=os.getpid(), port=port, token=self.token)
+        threading.Thread(target=self._serve, name="instance-ipc", daemon=True).start()
+        logger.info(f"Single-instance IPC listening on 127.0.0.1:{port}")
+        return port
+
+    def publish(self, **fields):
+        """把字段写入 INSTANCE_FILE（仅当前用户可读），例如 --headless 时 JSON-RPC 的地址与令牌"""
+        self.info.update(fields)
+        atomic_write_json(self.info_path, self.info, mode=0o600)
+
+    def set_handler(self, handler):
+        """设置 handler(argv)，并交付此前已收到的转发"""
+        with self.lock:
+            self.handler = handler
+            pending, self.pending = self.pending, []
+        for argv in pending:
+            handler(argv)
+
+    def _serve(self):
+        import hmac
+        # release() 会把 self.server 置空，这里持有自己的引用，套接字关闭后 accept 抛 OSError 退出
+        server = self.server
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    conn.settimeout(INSTANCE_TIMEOUT)
+                    message = json.loads(conn.makefile('rb').readline().decode('utf-8'))
+                    if not hmac.compare_digest(str(message.get('token', '')), self.token):
+                        conn.sendall(b'{"status": "error", "error": "bad token"}\n')
+                        continue
+                    argv = [str(arg) for arg in message.get('argv', [])]
+                    conn.sendall(b'{"status": "ok"}\n')
+                except (OSError, ValueError, AttributeError) as e:
+                    logger.warning(f"Bad instance handoff: {e}")
+                    continue
+            logger.info(f"Received handoff from another launch: {argv}")
+            with self.lock:
+                handler = self.handler
+                if handler is None:
+                    self.pending.append(argv)
+            if handler is not None:
+                try:
+                    handler(argv)
+                except Exception as e:
+                    logger.error(f"Handoff handler failed: {e}", exc_info=True)
+
+    def forward(self, argv, timeout=INSTANCE_TIMEOUT):
+        """把命令行参数交给已运行的实例，成功返回 True；对方仍在启动时重试到超时"""
+        import socket
+        deadline = time.monotonic() + timeout
+        argv = list(argv)
+        while True:
+            try:
+                with open(self.info_path, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+                payload = json.dumps({'token': info['token'], 'argv': argv}).encode('utf-8') + b'\n'
+                with socket.create_connection(("127.0.0.1", info['port']), timeout=timeout) as conn:
+                    conn.sendall(payload)
+                    reply = json.loads(conn.makefile('rb').readline().decode('utf-8') or 'null')
+                if isinstance(reply, dict) and reply.get('status') == 'ok':
+                    return True
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def release(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.file is not None:
+            try:
+                os.remove(self.info_path)
+            except OSError:
+                pass
+            self.file.close()
+            self.file = None
+
+# ================= 快捷方式 =================
+
+def filetime(timestamp):
+    """Unix 时间戳转 Windows FILETIME（1601 年起的 100 纳秒数）"""
+    return int((timestamp + 11644473600) * 10_000_000) if timestamp else 0
+
+
+def build_shell_link(target, working_dir=None, description=None, arguments=None, icon=None, icon_index=0,
+                     ansi_encoding=None):
+    """按 MS-SHLLINK 生成指向本地文件的 .lnk 内容
+
+    目标通过 LinkInfo 的本地路径（ANSI 与 Unicode 两份）定位，由系统在打开时解析，
+    不生成 LinkTargetIDList；目标存在时写入其大小与时间戳。纯字节拼装，在任何平台上都可运行。
+    """
+    import struct
+    import uuid
+    if ansi_encoding is None:
+        ansi_encoding = 'mbcs' if sys.platform == 'win32' else 'ascii'
+    try:
+        st = os.stat(target)
+        attributes = 0x10 if os.path.isdir(target) else 0x20   # FILE_ATTRIBUTE_DIRECTORY / ARCHIVE
+        times = (filetime(getattr(st, 'st_birthtime', st.st_ctime)), filetime(st.st_atime), filetime(st.st_mtime))
+        size = st.st_size & 0xFFFFFFFF
+    except OSError:
+        attributes, times, size = 0x80, (0, 0, 0), 0           # FILE_ATTRIBUTE_NORMAL
+
+    strings = [(0x04, description), (0x10, working_dir), (0x20, arguments), (0x40, icon)]
+    flags = 0x02 | 0x80                                         # HasLinkInfo | IsUnicode
+    for flag, value in strings:
+        if value:
+            flags |= flag
+
+    header = struct.pack(
+        '<I16sIIQQQIiIHHII',
+        0x4C, uuid.UUID('00021401-0000-0000-C000-000000000046').bytes_le, flags, attributes,
+        *times, size, icon_index, 1, 0, 0, 0, 0)                # ShowCommand = SW_SHOWNORMAL
+
+    # LinkInfo：头部 0x24 字节（含 Unicode 偏移）+ VolumeID + 本地路径 + 公共后缀
+    volume_id = struct.pack('<IIII', 0x11, 3, 0, 0x10) + b'\0'  # DRIVE_FIXED，空卷标
+    base_ansi = target.encode(ansi_encoding, 'replace') + b'\0'
+    suffix_ansi = b'\0'
+    base_unicode = target.encode('utf-16-le') + b'\0\0'
+    suffix_unicode = b'\0\0'
+    volume_offset = 0x24
+    base_offset = volume_offset + len(volume_id)
+    suffix_offset = base_offset + len(base_ansi)
+    base_unicode_offset = suffix_offset + len(suffix_ansi)
+    suffix_unicode_offset = base_unicode_offset + len(base_unicode)
+    link_info_size = suffix_unicode_offset + len(suffix_unicode)
+    link_info = struct.pack(
+        '<IIIIIIIII', link_info_size, 0x24, 0x01, volume_offset, base_offset, 0, suffix_offset,
+        base_unicode_offset, suffix_unicode_offset,
+    ) + volume_id + base_ansi + suffix_ansi + base_unicode + suffix_unicode
+
+    # StringData：字符数（u16）+ 不带结尾的 UTF-16LE，顺序固定
+    string_data = b''
+    for _, value in strings:
+        if value:
+            encoded = value.encode('utf-16-le')
+            if len(encoded) // 2 > 0xFFFF:
+                raise ValueError("快捷方式字段过长")
+            string_data += struct.pack('<H', len(encoded) // 2) + encoded
+
+    return header + link_info + string_data + b'\0\0\0\0'       # 以 TerminalBlock 结尾
+
+
+def write_shell_link(path, target, **kwargs):
+    """生成 .lnk 并原子写入：先写同目录临时文件再替换，不启动任何子进程"""
+    data = build_shell_link(target, **kwargs)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+# ================= Python 后端逻辑 =================
+
+class Api:
+    # 可通过 submit_job 在后台线程池中执行的耗时方法；直接调用时仍在调用方线程上同步执行到结束
+    JOB_METHODS = (
+        'download_file', 'resume_downloads', 'library_rescan', 'library_search',
+        'search', 'get_track', 'get_album', 'cleanup_duplicates',
+    )
+    # 只在窗口中有意义的方法：窗口控制、安装向导，以及结果通过页面事件推送的 submit_job
+    WINDOW_METHODS = (
+        'close_app', 'minimize_window', 'maximize_window', 'restore_window', 'start_drag',
+        'on_install_complete', 'create_shortcut_option', 'skip_installation', 'submit_job',
+    )
+    # 与窗口无关的方法，同时暴露给页面和 --headless 的 JSON-RPC 服务
+    RPC_METHODS = (
+        'download_file', 'list_interrupted_downloads', 'resume_downloads', 'cleanup_duplicates',
+        'enqueue_downloads', 'cancel_download', 'list_downloads',
+        'get_stream_url', 'get_track_url', 'set_quality_range', 'set_play_queue', 'get_artwork_urls', 'get_cache_stats',
+        'search', 'cancel_search', 'get_track', 'get_album',
+        'library_search', 'library_rescan',
+        'record_play', 'get_history', 'clear_history', 'set_favorite', 'list_favorites',
+        'create_playlist', 'rename_playlist', 'delete_playlist', 'add_to_playlist', 'remove_from_playlist',
+        'list_playlists', 'get_playlist',
+        'get_metrics', 'get_transfer_stats', 'set_bandwidth_limit',
+    )
+
+    def __init__(self, window, config=None):
+        self.window = window
+        self.config = config if config is not None else ConfigStore()
+        self.job_ids = itertools.count(1)
+        self.search_generation = 0
+        self.search_lock = threading.Lock()
+        self.upcoming = []                # 播放队列中当前曲目之后的条目
+        self.upcoming_generation = 0
+        self.upcoming_lock = threading.Lock()
+        logger.info("API initialized")
+
+    # 以下组件在首次使用时创建，窗口显示前不做任何网络、数据库或线程初始化
+
+    @lazy_property
+    def backend(self):
+        return JobRunner()
+
+    @lazy_property
+    def events(self):
+        bus = EventBus(self.window)
+        atexit.register(bus.stop)
+        return bus
+
+    @lazy_property
+    def scheduler(self):
+        return TransferScheduler(
+            self.config.get_int('bandwidth_limit_kbps', BANDWIDTH_LIMIT_KBPS) * 1024,
+            self.config.get_int('background_limit_kbps', BACKGROUND_LIMIT_KBPS) * 1024
+        )
+
+    @lazy_property
+    def downloader(self):
+        return SegmentedDownloader(scheduler=self.scheduler)
+
+    @lazy_property
+    def download_index(self):
+        return DownloadIndex()
+
+    @lazy_property
+    def playlog(self):
+        playlog = PlayLog()
+        atexit.register(playlog.close)
+        return playlog
+
+    @lazy_property
+    def quality(self):
+        floor = self.config.get_str('quality_floor', QUALITY_FLOOR)
+        ceiling = self.config.get_str('quality_ceiling', QUALITY_CEILING)
+        try:
+            return AdaptiveQuality(floor=floor, ceiling=ceiling, cap=lambda: self.scheduler.bucket.rate,
+                                   on_change=self._on_quality_change)
+        except ValueError as e:
+            logger.warning(f"Invalid quality range {floor}..{ceiling} ({e}), using defaults")
+            return AdaptiveQuality(cap=lambda: self.scheduler.bucket.rate, on_change=self._on_quality_change)
+
+    @lazy_property
+    def cache(self):
+        cache = AudioCache(budget=self.config.get_int('cache_budget_mb', CACHE_BUDGET // (1024 * 1024)) * 1024 * 1024)
+        atexit.register(cache.flush)
+        return cache
+
+    @lazy_property
+    def proxy(self):
+        return StreamProxy(self.cache, scheduler=self.scheduler, prefetcher=self.prefetcher, artwork=self.artwork)
+
+    @lazy_property
+    def artwork(self):
+        cache = ArtworkCache(budget=self.config.get_int('artwork_budget_mb', ARTWORK_BUDGET // (1024 * 1024)) * 1024 * 1024)
+        atexit.register(cache.flush)
+        return cache
+
+    @lazy_property
+    def prefetcher(self):
+        return Prefetcher(
+            self.cache,
+            scheduler=self.scheduler,
+            count=self.config.get_int('prefetch_count', PREFETCH_COUNT),
+            budget=self.config.get_int('prefetch_budget_mb', PREFETCH_BUDGET // (1024 * 1024)) * 1024 * 1024
+        )
+
+    @lazy_property
+    def music(self):
+        return MusicApiClient(
+            self.config.get_str('music_api_base', MUSIC_API_BASE),
+            disk_dir=API_CACHE_DIR if self.config.get_bool('api_disk_cache', True) else None,
+            mirrors=self.config.get_list('music_api_mirrors', [])
+        )
+
+    @lazy_property
+    def library(self):
+        return LibraryIndex()
+
+    @lazy_property
+    def queue(self):
+        return DownloadQueue(
+            self._run_queued_download,
+            notify=self._emit,
+            workers=self.config.get_int('download_workers', QUEUE_WORKERS)
+        )
+
+    def on_started(self):
+        """webview 启动后在后台线程执行：续传未完成的下载、增量重扫曲库"""
+        interrupted = self.list_interrupted_downloads()['downloads']
+        if interrupted:
+            logger.info(f"Found {len(interrupted)} interrupted download(s), resuming in background")
+            self.submit_job('resume_downloads')
+        self.submit_job('library_rescan')
+
+    def handle_handoff(self, argv):
+        """处理后续启动转发来的命令行：激活窗口，链接参数加入下载队列"""
+        if self.window:
+            try:
+                self.window.restore()
+                self.window.show()
+            except Exception as e:
+                logger.warning(f"Failed to focus window: {e}")
+        self.open_urls(argv)
+
+    def open_urls(self, args):
+        """把命令行中的 http(s) 链接加入下载队列"""
+        urls = [arg for arg in args if re.match(r'https?://', arg, re.IGNORECASE)]
+        if urls:
+            self.enqueue_downloads([{'url': url, 'filename': filename_from_url(url)} for url in urls])
+
+    @instrumented
+    def close_app(self):
+        """完全退出程序"""
+        logger.info("Closing application")
+        if self.window:
+            self.window.destroy()
+        return {'status': 'closed'}
+
+    @instrumented
+    def minimize_window(self):
+        """最小化窗口"""
+        logger.info("Minimizing window")
+        if self.window:
+            self.window.minimize()
+        return {'status': 'minimized'}
+
+    @instrumented
+    def maximize_window(self):
+        """最大化窗口"""
+        logger.info("Maximizing window")
+        if self.window:
+            self.window.maximize()
+        return {'status': 'maximized'}
+
+    @instrumented
+    def restore_window(self):
+        """还原窗口"""
+        logger.info("Restoring window")
+        if self.window:
+            self.window.restore()
+        return {'status': 'restored'}
+
+    @instrumented
+    def start_drag(self):
+        """开始拖动窗口 (Windows)"""
+        logger.debug("Start drag")
+        try:
+            import ctypes
+            ctypes.windll.user32.ReleaseCapture()
+            ctypes.windll.user32.SendMessageW(self.window._window.hwnd, 0x0112, 0xF012, 0)
+            return {'status': 'dragging'}
+        except Exception as e:
+            logger.warning(f"Drag failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def on_install_complete(self):
+        """安装完成回调"""
+        logger.info("Installation complete, loading main UI")
+        # 留出 0.5 秒让安装页显示完成状态，不占用桥接线程
+        self.backend.call_later(0.5, self.window.load_html, MAIN_PAGE)
+        return {'status': 'loaded', 'version': VERSION}
+
+    @instrumented
+    def create_shortcut_option(self, option):
+        """根据用户选择创建快捷方式"""
+        try:
+            if option == 'none':
+                # 用户选择不创建快捷方式
+                self.config.update({'skip_install': True, 'shortcut_created': False})
+                return {'status': 'success', 'message': '已跳过快捷方式创建'}
+            
+            elif option == 'desktop':
+                # 创建桌面快捷方式
+                result = self.create_desktop_shortcut()
+                if result['status'] == 'success':
+                    self.config.update({
+                        'shortcut_created': True,
+                        'shortcut_path': result.get('shortcut_path'),
+                        'skip_install': False
+                    })
+                    return {'status': 'success', 'message': '桌面快捷方式创建成功'}
+                else:
+                    return result
+                    
+            elif option == 'startmenu':
+                # 创建开始菜单快捷方式
+                result = self.create_start_menu_shortcut()
+                if result['status'] == 'success':
+                    self.config.update({
+                        'shortcut_created': True,
+                        'shortcut_path': result.get('shortcut_path'),
+                        'skip_install': False
+                    })
+                    return {'status': 'success', 'message': '开始菜单快捷方式创建成功'}
+                else:
+                    return result
+            
+            return {'status': 'error', 'error': '无效的选项'}
+            
+        except Exception as e:
+            logger.error(f"Failed to create shortcut: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def skip_installation(self):
+        """跳过安装"""
+        self.config.set('skip_install', True)
+        return {'status': 'success', 'message': '已跳过安装'}
+
+    def create_desktop_shortcut(self):
+        """创建桌面快捷方式"""
+        return self._create_shortcut(os.path.join(os.path.expanduser("~"), "Desktop"), "Desktop")
+
+    def create_start_menu_shortcut(self):
+        """创建开始菜单快捷方式"""
+        try:
+            # 开始菜单路径（当前用户）下的程序文件夹
+            folder = os.path.join(os.environ["APPDATA"], "Microsoft", "Windows", "Start Menu", "Programs", APP_NAME)
+        except KeyError:
+            return {'status': 'error', 'error': '找不到开始菜单目录'}
+        return self._create_shortcut(folder, "Start menu")
+
+    def _create_shortcut(self, folder, label):
+        """在 folder 中写入指向当前程序的快捷方式"""
+        try:
+            # 获取当前可执行文件路径
+            if getattr(sys, 'frozen', False):
+                exe_path = sys.executable
+            else:
+                exe_path = sys.argv[0]
+            exe_path = os.path.abspath(exe_path)
+
+            os.makedirs(folder, exist_ok=True)
+            shortcut_path = os.path.join(folder, SHORTCUT_NAME)
+            logger.info(f"Creating {label.lower()} shortcut: {shortcut_path}")
+            write_shell_link(shortcut_path, exe_path, working_dir=os.path.dirname(exe_path),
+                             description="CORE Music Player")
+            logger.info(f"{label} shortcut created successfully: {shortcut_path}")
+            return {'status': 'success', 'shortcut_path': shortcut_path}
+        except Exception as e:
+            logger.error(f"{label} shortcut creation failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def download_file(self, url, filename):
+        """下载文件到桌面，已持有同一版本时直接返回本地文件"""
+        try:
+            local, info = self._resolve_local(url, filename)
+            if local is not None:
+                logger.info(f"Already downloaded {url}: {local}")
+                return {'status': 'success', 'path': local, 'filename': os.path.basename(local), 'deduplicated': True}
+
+            file_path = self._resolve_target(filename)
+            filename = os.path.basename(file_path)
+
+            logger.info(f"Downloading {url} to {file_path}")
+            self._fetch(url, file_path, info=info)
+            logger.info(f"Download success: {filename}")
+            self._index_download(file_path)
+            return {'status': 'success', 'path': file_path, 'filename': filename, 'deduplicated': False}
+
+        except Exception as e:
+            logger.error(f"Download failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @staticmethod
+    def _desktop_target(filename):
+        """把页面或 RPC 传来的文件名解析为桌面上的路径，所有下载入口都经过这里
+
+        只接受单独的文件名：空名、. 与 ..、含路径分隔符或盘符的名字，以及解析后落到桌面以外
+        （例如桌面上指向别处的符号链接）的都抛出 ValueError。
+        """
+        name = str(filename or '').strip()
+        if name in ('', '.', '..') or '/' in name or '\\' in name or '\0' in name or os.path.basename(name) != name:
+            raise ValueError(f"无效的文件名: {filename!r}")
+        desktop = os.path.join(os.path.expanduser("~"), "Desktop")
+        target = os.path.join(desktop, name)
+        if os.path.dirname(os.path.realpath(target)) != os.path.realpath(desktop):
+            raise ValueError(f"文件名指向桌面以外: {filename!r}")
+        return target
+
+    def _resolve_target(self, filename, reserved=()):
+        """确定桌面上的保存路径，被其他内容占用时追加时间戳"""
+        file_path = self._desktop_target(filename)
+        desktop, filename = os.path.split(file_path)
+        if os.path.exists(file_path) or file_path in reserved:
+            base, ext = os.path.splitext(filename)
+            timestamp = int(time.time())
+            file_path = os.path.join(desktop, f"{base}_{timestamp}{ext}")
+            counter = 1
+            while os.path.exists(file_path) or file_path in reserved:
+                file_path = os.path.join(desktop, f"{base}_{timestamp}_{counter}{ext}")
+                counter += 1
+        return file_path
+
+    def _resolve_local(self, url, filename, reserved=()):
+        """已持有该 URL 当前版本时在本地交付，返回 (路径, 探测结果)；需要下载时路径为 None
+
+        请求的文件名就是已有文件时直接返回；文件名空闲时克隆或复制过去；被其他内容占用时返回已有文件。
+        距上次确认超过 DOWNLOAD_REVALIDATE_AFTER 才向上游探测一次，其余情况不产生网络请求。
+        """
+        entry, paths = self.download_index.lookup(url)
+        if entry is None or not paths:
+            return None, None
+        info = None
+        if time.time() - entry['checked'] >= DOWNLOAD_REVALIDATE_AFTER:
+            info = self.downloader.probe(url)
+            if not DownloadIndex.is_current(entry, info):
+                logger.info(f"Upstream version of {url} changed, downloading again")
+                self.cache.forget(url)
+                return None, info
+            self.download_index.confirm(url)
+        target = self._desktop_target(filename)
+        if target in paths:
+            return target, info
+        if not os.path.exists(target) and target not in reserved:
+            try:
+                method = clone_or_copy(paths[0], target)
+                self.download_index.add_file(entry['digest'], target)
+                logger.info(f"Copied {paths[0]} -> {target} ({method})")
+                return target, info
+            except OSError as e:
+                logger.warning(f"Failed to link {paths[0]} -> {target}: {e}")
+        return paths[0], info
+
+    def _fetch(self, url, file_path, progress=None, cancel=None, priority=PRIORITY_BULK, info=None):
+        """优先从缓存落地文件，未命中时下载并写入缓存，完成后登记到去重索引"""
+        cached = self.cache.get(url)
+        if cached is not None:
+            method = clone_or_copy(cached, file_path)
+            logger.info(f"Cache hit for {url} ({method})")
+            digest = os.path.basename(cached)
+            size = os.path.getsize(file_path)
+            if progress:
+                progress(size, size)
+        else:
+            size, digest, info = self.downloader.download_with_retry(url, file_path, progress, cancel,
+                                                                     priority=priority, info=info)
+            try:
+                self.cache.put_file(url, file_path, digest=digest)
+            except Exception as e:
+                logger.warning(f"Failed to cache {file_path}: {e}")
+        try:
+            self.download_index.record(url, digest, size, info)
+            self.download_index.add_file(digest, file_path)
+        except Exception as e:
+            logger.warning(f"Failed to record {file_path} in download index: {e}")
+
+    def _emit(self, event, payload, key=None):
+        """向页面派发 coremusic:<event> 事件；带 key 的同类事件在一帧内只保留最新一条"""
+        self.events.publish(event, payload, key)
+
+    @instrumented
+    def submit_job(self, method, args=None):
+        """在后台线程池中执行耗时方法，立即返回任务 ID，结果通过 coremusic:job 事件推送
+
+        只有经这里提交的调用不占用调用方线程；任务在池中仍是阻塞 I/O，每个进行中的任务占一个线程，
+        并发数以 BACKEND_WORKERS 为上限，超出的排队等待。
+        """
+        if method not in self.JOB_METHODS:
+            return {'status': 'error', 'error': f'不支持的方法: {method}'}
+        job_id = str(next(self.job_ids))
+        self.backend.submit(self._run_job, job_id, method, list(args or []))
+        return {'status': 'accepted', 'job_id': job_id}
+
+    def _run_job(self, job_id, method, args):
+        try:
+            result = getattr(self, method)(*args)
+        except Exception as e:
+            logger.error(f"Job {job_id} ({method}) failed: {e}")
+            result = {'status': 'error', 'error': str(e)}
+        try:
+            self._emit('job', {'job_id': job_id, 'method': method, 'result': result})
+        except Exception as e:
+            logger.warning(f"Failed to deliver job {job_id} result: {e}")
+
+    def _run_queued_download(self, job, progress, cancel):
+        """队列工作线程中执行单个下载，已持有同一版本时直接在本地完成"""
+        with self.queue.lock:
+            reserved = {other['path'] for other in self.queue.jobs.values() if other['path']}
+        local, info = self._resolve_local(job['url'], job['filename'], reserved)
+        if local is not None:
+            logger.info(f"Queued download {job['id']} already present: {local}")
+            size = os.path.getsize(local)
+            progress(size, size)
+            return local
+        with self.queue.lock:
+            reserved = {other['path'] for other in self.queue.jobs.values() if other['path']}
+            job['path'] = self._resolve_target(job['filename'], reserved)
+        logger.info(f"Queued download {job['id']}: {job['url']} -> {job['path']}")
+        try:
+            self._fetch(job['url'], job['path'], progress, cancel, info=info)
+        except DownloadCancelled:
+            logger.info(f"Download {job['id']} cancelled")
+            self.downloader.discard(job['path'])
+            raise
+        self._index_download(job['path'])
+        return job['path']
+
+    @instrumented
+    def enqueue_downloads(self, items):
+        """批量加入下载队列，items 为 [{'url': ..., 'filename': ...}, ...]；有文件名不合法时整批拒绝"""
+        try:
+            for item in items:
+                self._desktop_target(item['filename'])
+            ids = self.queue.enqueue(items)
+            logger.info(f"Enqueued {len(ids)} download(s)")
+            return {'status': 'success', 'ids': ids}
+        except Exception as e:
+            logger.error(f"Enqueue failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def cancel_download(self, job_id):
+        """取消队列中的下载"""
+        if self.queue.cancel(str(job_id)):
+            return {'status': 'success', 'id': str(job_id)}
+        return {'status': 'error', 'error': '任务不存在或已结束'}
+
+    @instrumented
+    def list_downloads(self):
+        """列出队列中的所有下载及其进度"""
+        return {'status': 'success', 'downloads': self.queue.list()}
+
+    @instrumented
+    def get_stream_url(self, url):
+        """返回本地播放代理地址，供 <audio> 直接播放"""
+        try:
+            return {'status': 'success', 'url': self.proxy.url_for(url)}
+        except Exception as e:
+            logger.error(f"Failed to start stream proxy: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def get_artwork_urls(self, urls, size=None):
+        """批量返回封面的本地地址，size 为期望边长（像素），网格视图一次调用即可拿到整页地址"""
+        try:
+            return {'status': 'success', 'urls': [self.proxy.artwork_url_for(url, size) if url else None
+                                                  for url in urls]}
+        except Exception as e:
+            logger.error(f"Failed to register artwork: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def get_track_url(self, track_id, level=None):
+        """按音质取曲目的播放地址；level 为空时按当前带宽自动选择，不可用时逐级降档"""
+        try:
+            source, used = self._resolve_song_url(track_id, level)
+            return {'status': 'success', 'url': self.proxy.url_for(source), 'source': source,
+                    'level': used, 'auto': level is None}
+        except Exception as e:
+            logger.error(f"Failed to resolve track {track_id}: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    def _resolve_song_url(self, track_id, level=None):
+        """返回 (上游地址, 实际音质)"""
+        for candidate in self.quality.candidates(level or self.quality.level):
+            items = self.music.get_song_url(track_id, candidate).get('data') or []
+            if items and items[0].get('url'):
+                return items[0]['url'], items[0].get('level') or candidate
+        raise LookupError(f"曲目 {track_id} 没有可用的播放地址")
+
+    @instrumented
+    def set_quality_range(self, floor=None, ceiling=None):
+        """设置自动选择音质的上下限（相同即固定音质），保存到配置，返回重新评估后的音质"""
+        try:
+            floor = floor or self.quality.floor
+            ceiling = ceiling or self.quality.ceiling
+            self.quality.set_range(floor, ceiling)
+            self.config.update({'quality_floor': floor, 'quality_ceiling': ceiling})
+            self.quality.update()
+            return {'status': 'success', 'quality': self.quality.stats()}
+        except ValueError as e:
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def set_play_queue(self, tracks, current=0):
+        """页面推送当前播放队列与正在播放的位置，后台预热接下来的曲目
+
+        条目可以是 URL、{'url': ...}，或只有 {'id': ...}：后者按自动音质解析地址，
+        解析结果与之后带宽变化导致的换档通过 coremusic:upcoming 事件推送。
+        """
+        try:
+            entries = list(tracks)[int(current) + 1:]
+            with self.upcoming_lock:
+                self.upcoming = entries
+                self.upcoming_generation += 1
+            if any(self._adaptive(entry) for entry in entries):
+                self.backend.call_later(0, self._refresh_upcoming)
+                return {'status': 'success', 'prefetching': [], 'resolving': True}
+            urls = [entry.get('url') if isinstance(entry, dict) else entry for entry in entries]
+            upcoming = self.prefetcher.set_queue(urls)
+            return {'status': 'success', 'prefetching': upcoming}
+        except Exception as e:
+            logger.error(f"Failed to update play queue: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @staticmethod
+    def _adaptive(entry):
+        return isinstance(entry, dict) and not entry.get('url') and entry.get('id') is not None
+
+    def _refresh_upcoming(self):
+        """按当前音质解析接下来曲目的地址，重新预热并通知页面；期间队列又变化时放弃"""
+        with self.upcoming_lock:
+            entries = list(self.upcoming)
+            generation = self.upcoming_generation
+        level = self.quality.level
+        resolved = []
+        # 只解析会被预取的几首，其余的在播放前通过 get_track_url 按届时的音质解析
+        for entry in entries[:self.prefetcher.count]:
+            if not self._adaptive(entry):
+                url = entry.get('url') if isinstance(entry, dict) else entry
+                resolved.append({'url': url, 'source': url})
+                continue
+            try:
+                source, used = self._resolve_song_url(entry['id'], level)
+            except Exception as e:
+                logger.warning(f"Failed to resolve upcoming track {entry['id']}: {e}")
+                continue
+            resolved.append({'id': entry['id'], 'url': self.proxy.url_for(source), 'source': source, 'level': used})
+        with self.upcoming_lock:
+            if generation != self.upcoming_generation:
+                return
+        prefetching = self.prefetcher.set_queue([item['source'] for item in resolved])
+        self._emit('upcoming', {'level': level, 'tracks': resolved, 'prefetching': prefetching}, key='queue')
+
+    def _on_quality_change(self, level):
+        """带宽估计使自动音质改变：通知页面，并按新音质重新解析、预热接下来的曲目"""
+        self._emit('quality', {'level': level}, key='level')
+        with self.upcoming_lock:
+            adaptive = any(self._adaptive(entry) for entry in self.upcoming)
+        if adaptive:
+            self.backend.call_later(0, self._refresh_upcoming)
+
+    @instrumented
+    def search(self, keywords, limit=30, offset=0):
+        """搜索歌曲；请求期间有更新的搜索或调用了 cancel_search 时本次返回 cancelled
+
+        不在后端等待防抖：输入防抖由页面负责，后端只按代号丢弃过时的结果，单次搜索不额外占用线程。
+        """
+        with self.search_lock:
+            self.search_generation += 1
+            generation = self.search_generation
+        try:
+            data = self.music.search(keywords, limit, offset)
+        except Exception as e:
+            logger.error(f"Search failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+        if generation != self.search_generation:
+            return {'status': 'cancelled'}
+        return {'status': 'success', 'data': data}
+
+    @instrumented
+    def cancel_search(self):
+        """取消正在进行的搜索，其结果将返回 cancelled"""
+        with self.search_lock:
+            self.search_generation += 1
+        return {'status': 'success'}
+
+    @instrumented
+    def get_track(self, track_id):
+        """获取歌曲详情"""
+        try:
+            return {'status': 'success', 'data': self.music.get_track(track_id)}
+        except Exception as e:
+            logger.error(f"Get track failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def get_album(self, album_id):
+        """获取专辑详情"""
+        try:
+            return {'status': 'success', 'data': self.music.get_album(album_id)}
+        except Exception as e:
+            logger.error(f"Get album failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    def _index_download(self, file_path):
+        """把下载完成的文件加入曲库索引"""
+        try:
+            self.library.add_file(file_path)
+        except Exception as e:
+            logger.warning(f"Failed to index {file_path}: {e}")
+
+    def library_roots(self):
+        """曲库扫描目录：桌面（下载位置）加上配置中的 library_dirs"""
+        desktop = os.path.join(os.path.expanduser("~"), "Desktop")
+        return [desktop] + self.config.get_list('library_dirs')
+
+    @instrumented
+    def library_search(self, query, limit=50, offset=0):
+        """在本地曲库中搜索，分页返回"""
+        try:
+            total, items = self.library.search(query, int(limit), int(offset))
+            return {'status': 'success', 'total': total, 'items': items, 'limit': limit, 'offset': offset}
+        except Exception as e:
+            logger.error(f"Library search failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def library_rescan(self):
+        """增量重扫本地曲库"""
+        try:
+            elapsed = self.library.rescan(self.library_roots())
+            return {'status': 'success', 'elapsed': elapsed}
+        except Exception as e:
+            logger.error(f"Library rescan failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def get_metrics(self):
+        """返回各 Api 方法的调用次数、错误数与延迟分位数，以及事件总线的合并统计"""
+        return {'status': 'success', 'metrics': call_metrics.snapshot(), 'events': self.events.stats()}
+
+    @instrumented
+    def record_play(self, track):
+        """记录一次播放，track 为包含 url 的曲目信息"""
+        try:
+            self.playlog.record_play(track)
+            return {'status': 'success'}
+        except Exception as e:
+            logger.error(f"Record play failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def get_history(self, limit=50, offset=0):
+        """最近播放记录，新到旧分页返回"""
+        return {'status': 'success', 'history': self.playlog.recent(int(limit), int(offset)),
+                'total': len(self.playlog.history)}
+
+    @instrumented
+    def clear_history(self):
+        """清空播放历史"""
+        self.playlog.clear_history()
+        return {'status': 'success'}
+
+    @instrumented
+    def set_favorite(self, track, favorite=True):
+        """收藏或取消收藏曲目"""
+        try:
+            self.playlog.set_favorite(track, bool(favorite))
+            return {'status': 'success'}
+        except Exception as e:
+            logger.error(f"Set favorite failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def list_favorites(self):
+        """收藏列表，最近收藏的在前"""
+        return {'status': 'success', 'favorites': self.playlog.list_favorites()}
+
+    @instrumented
+    def create_playlist(self, name):
+        """新建歌单，返回歌单 ID"""
+        try:
+            return {'status': 'success', 'id': self.playlog.create_playlist(name)}
+        except Exception as e:
+            logger.error(f"Create playlist failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def rename_playlist(self, playlist_id, name):
+        """重命名歌单"""
+        try:
+            self.playlog.rename_playlist(playlist_id, name)
+            return {'status': 'success'}
+        except KeyError:
+            return {'status': 'error', 'error': '歌单不存在'}
+
+    @instrumented
+    def delete_playlist(self, playlist_id):
+        """删除歌单"""
+        try:
+            self.playlog.delete_playlist(playlist_id)
+            return {'status': 'success'}
+        except KeyError:
+            return {'status': 'error', 'error': '歌单不存在'}
+
+    @instrumented
+    def add_to_playlist(self, playlist_id, tracks):
+        """向歌单末尾添加曲目"""
+        try:
+            self.playlog.add_to_playlist(playlist_id, tracks)
+            return {'status': 'success'}
+        except KeyError:
+            return {'status': 'error', 'error': '歌单不存在'}
+        except Exception as e:
+            logger.error(f"Add to playlist failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def remove_from_playlist(self, playlist_id, index):
+        """按位置从歌单移除曲目"""
+        try:
+            self.playlog.remove_from_playlist(playlist_id, index)
+            return {'status': 'success'}
+        except KeyError:
+            return {'status': 'error', 'error': '歌单不存在'}
+        except (IndexError, ValueError):
+            return {'status': 'error', 'error': '位置无效'}
+
+    @instrumented
+    def list_playlists(self):
+        """歌单列表（不含曲目）"""
+        return {'status': 'success', 'playlists': self.playlog.list_playlists()}
+
+    @instrumented
+    def get_playlist(self, playlist_id):
+        """歌单详情与曲目"""
+        try:
+            return {'status': 'success', 'playlist': self.playlog.get_playlist(playlist_id)}
+        except KeyError:
+            return {'status': 'error', 'error': '歌单不存在'}
+
+    @instrumented
+    def get_cache_stats(self):
+        """返回音频缓存、API 缓存与预取的命中统计"""
+        return {
+            'status': 'success',
+            'stats': self.cache.stats(),
+            'api': self.music.stats(),
+            'prefetch': self.prefetcher.stats(),
+            'downloads': self.download_index.stats(),
+            'artwork': self.artwork.stats(),
+            'playback': self.proxy.stats(),
+        }
+
+    @instrumented
+    def get_transfer_stats(self):
+        """返回带宽上限、各优先级的活跃传输数、字节数和被限速的时长，以及带宽估计与自动音质"""
+        return {'status': 'success', 'stats': self.scheduler.stats(), 'quality': self.quality.stats()}
+
+    @instrumented
+    def set_bandwidth_limit(self, limit_kbps=None, background_kbps=None):
+        """设置全局带宽上限与播放期间的后台带宽上限（KB/s，0 表示不限），保存到配置"""
+        try:
+            values = {}
+            if limit_kbps is not None:
+                values['bandwidth_limit_kbps'] = max(0, int(limit_kbps))
+            if background_kbps is not None:
+                values['background_limit_kbps'] = max(0, int(background_kbps))
+            self.config.update(values)
+            self.scheduler.configure(
+                values['bandwidth_limit_kbps'] * 1024 if 'bandwidth_limit_kbps' in values else None,
+                values['background_limit_kbps'] * 1024 if 'background_limit_kbps' in values else None
+            )
+            logger.info(f"Bandwidth limits updated: {values}")
+            return {'status': 'success', 'stats': self.scheduler.stats()}
+        except Exception as e:
+            logger.error(f"Failed to set bandwidth limit: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def cleanup_duplicates(self, dry_run=False):
+        """合并桌面上旧版重名下载留下的 <名称>_<时间戳> 副本：内容相同的只保留一份（优先保留原名）"""
+        try:
+            desktop = os.path.join(os.path.expanduser("~"), "Desktop")
+            groups = collections.defaultdict(list)
+            with os.scandir(desktop) as entries:
+                for entry in entries:
+                    match = TIMESTAMP_DUPLICATE.match(entry.name)
+                    if match and entry.is_file():
+                        groups[match.group('base') + match.group('ext')].append(entry.path)
+
+            removed = []
+            freed = 0
+            for name, copies in groups.items():
+                original = os.path.join(desktop, name)
+                candidates = ([original] if os.path.isfile(original) else []) + sorted(copies)
+                # 先按大小分组，只有大小相同的才需要计算摘要
+                by_size = collections.defaultdict(list)
+                for path in candidates:
+                    by_size[os.path.getsize(path)].append(path)
+                for same_size in by_size.values():
+                    if len(same_size) < 2:
+                        continue
+                    kept = {}
+                    for path in same_size:
+                        digest = file_sha256(path)
+                        if digest not in kept:
+                            kept[digest] = path
+                            continue
+                        st = os.stat(path)
+                        if not dry_run:
+                            os.remove(path)
+                            self.download_index.forget_file(path)
+                        removed.append({'path': path, 'kept': kept[digest]})
+                        freed += st.st_size if st.st_nlink == 1 else 0
+
+            logger.info(f"Duplicate cleanup{' (dry run)' if dry_run else ''}: "
+                        f"{len(removed)} file(s), {freed} bytes")
+            if removed and not dry_run:
+                self.library.rescan(self.library_roots())
+            return {'status': 'success', 'removed': removed, 'freed_bytes': freed, 'dry_run': bool(dry_run)}
+        except Exception as e:
+            logger.error(f"Duplicate cleanup failed: {e}")
+            return {'status': 'error', 'error': str(e)}
+
+    @instrumented
+    def list_interrupted_downloads(self):
+        """列出上次未完成的下载"""
+        jobs = []
+        for entry in self.downloader.journal.pending():
+            segments = entry.get('segments') or []
+            jobs.append({
+                'url': entry['url'],
+                'path': entry['file_path'],
+                'size': entry.get('size', 0),
+                'completed': sum(seg[2] for seg in segments),
+            })
+        return {'status': 'success', 'downloads': jobs}
+
+    @instrumented
+    def resume_downloads(self):
+        """继续所有未完成的下载"""
+        results = []
+        for job in self.list_interrupted_downloads()['downloads']:
+            logger.info(f"Resuming interrupted download: {job['path']} ({job['completed']}/{job['size']} bytes)")
+            try:
+                self._fetch(job['url'], job['path'])
+                self._index_download(job['path'])
+                results.append({'status': 'success', 'path': job['path']})
+            except Exception as e:
+                logger.error(f"Resume failed for {job['path']}: {e}")
+                results.append({'status': 'error', 'path': job['path'], 'error': str(e)})
+        return {'status': 'success', 'results': results}
+
+# ================= 无界面 RPC 服务 =================
+
+class RpcRequestHandler(BaseHTTPRequestHandler):
+    """JSON-RPC 请求处理：POST / 调用方法，GET / 返回可用方法列表"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"RPC server: {format % args}")
+
+    def do_GET(self):
+        self.server.rpc.handle_get(self)
+
+    def do_POST(self):
+        self.server.rpc.handle_post(self)
+
+
+def is_loopback(host):
+    """host 是否只能从本机访问"""
+    import ipaddress
+    if host.lower() == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class RpcServer:
+    """以 JSON-RPC 2.0 over HTTP 暴露 Api 中与窗口无关的方法，每个请求在独立线程中执行
+
+    每个请求都要带 Authorization: Bearer <令牌>，令牌由启动方给出或每次启动随机生成；
+    Host 头必须是本机名或监听地址加端口，经 DNS 重绑定指向本机的网页既拿不到令牌，Host 也对不上。
+    """
+
+    PARSE_ERROR = -32700
+    INVALID_REQUEST = -32600
+    METHOD_NOT_FOUND = -32601
+    INVALID_PARAMS = -32602
+    INTERNAL_ERROR = -32603
+
+    def __init__(self, api, token, host=RPC_HOST, port=RPC_PORT):
+        if not token:
+            raise ValueError("RPC token is required")
+        self.api = api
+        self.token = token
+        self.host = host
+        self.port = port
+        self.server = None
+        self.lock = threading.Lock()
+        self.methods = {name: getattr(api, name) for name in api.RPC_METHODS}
+        self.counters = {'requests': 0, 'calls': 0, 'errors': 0, 'rejected': 0}
+
+    def start(self):
+        """启动服务线程（重复调用无副作用），返回端口"""
+        with self.lock:
+            if self.server is None:
+                self.server = ThreadingHTTPServer((self.host, self.port), RpcRequestHandler)
+                self.server.daemon_threads = True
+                self.server.rpc = self
+                self.port = self.server.server_address[1]
+                threading.Thread(target=self.server.serve_forever, name="rpc-server", daemon=True).start()
+                logger.info(f"RPC server listening on {self.host}:{self.port}")
+            return self.port
+
+    def stop(self):
+        with self.lock:
+            if self.server is not None:
+                self.server.shutdown()
+                self.server.server_close()
+                self.server = None
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def allowed_hosts(self):
+        """可接受的 Host 头；监听通配地址时客户端可能用任何地址访问，返回 None 表示只校验令牌"""
+        if self.host in ('', '0.0.0.0', '::'):
+            return None
+        names = {'127.0.0.1', 'localhost', '[::1]', f'[{self.host}]' if ':' in self.host else self.host.lower()}
+        return {f'{name}:{self.port}' for name in names}
+
+    def _authorize(self, handler):
+        """校验 Host 与令牌，不通过时直接响应并返回 False"""
+        import hmac
+        allowed = self.allowed_hosts()
+        if allowed is not None and (handler.headers.get('Host') or '').strip().lower() not in allowed:
+            self._count('rejected')
+            handler.send_error(403, "Host not allowed")
+            return False
+        scheme, _, credential = (handler.headers.get('Authorization') or '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(credential.strip().encode('utf-8'),
+                                                                   self.token.encode('utf-8')):
+            self._count('rejected')
+            handler.send_response(401)
+            handler.send_header('WWW-Authenticate', 'Bearer')
+            handler.send_header('Content-Length', '0')
+            # 请求体没有读取，和 send_error 一样关闭连接，免得剩余内容被当成下一个请求
+            handler.send_header('Connection', 'close')
+            handler.end_headers()
+            return False
+        return True
+
+    def _send(self, handler, status, payload=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b''
+        handler.send_response(status)
+        if payload is not None:
+            handler.send_header('Content-Type', 'application/json; charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def handle_get(self, handler):
+        if not self._authorize(handler):
+            return
+        if handler.path.split('?', 1)[0] != '/':
+            handler.send_error(404)
+            return
+        self._send(handler, 200, {'name': APP_NAME, 'version': VERSION, 'methods': sorted(self.methods), 'stats': self.stats()})
+
+    def handle_post(self, handler):
+        if not self._authorize(handler):
+            return
+        if handler.path.split('?', 1)[0] != '/':
+            handler.send_error(404)
+            return
+        if (handler.headers.get('Content-Type') or '').split(';', 1)[0].strip().lower() != 'application/json':
+            handler.send_error(415, "Content-Type must be application/json")
+            return
+        try:
+            length = int(handler.headers.get('Content-Length') or -1)
+        except ValueError:
+            length = -1
+        if length < 0:
+            handler.send_error(411)
+            return
+        if length > RPC_MAX_BODY:
+            handler.send_error(413)
+            return
+        self._count('requests')
+        try:
+            request = json.loads(handler.rfile.read(length).decode('utf-8'))
+        except (UnicodeDecodeError, ValueError) as e:
+            self._send(handler, 200, self._error(None, self.PARSE_ERROR, f"Parse error: {e}"))
+            return
+        if isinstance(request, list):
+            if not request:
+                response = self._error(None, self.INVALID_REQUEST, "Empty batch")
+            else:
+                response = [reply for reply in map(self.call, request) if reply is not None] or None
+        else:
+            response = self.call(request)
+        # 全部是通知（没有 id）时不返回内容
+        self._send(handler, 200 if response is not None else 204, response)
+
+    def _error(self, request_id, code, message):
+        self._count('errors')
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+    def call(self, request):
+        """执行单个 JSON-RPC 请求对象，返回响应对象；通知返回 None"""
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or not isinstance(request.get('method'), str):
+            return self._error(request.get('id') if isinstance(request, dict) else None, self.INVALID_REQUEST, "Invalid request")
+        request_id = request.get('id')
+        notification = 'id' not in request
+        method = self.methods.get(request['method'])
+        params = request.get('params', [])
+        self._count('calls')
+        if method is None:
+            reply = self._error(request_id, self.METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+        elif not isinstance(params, (list, dict)):
+            reply = self._error(request_id, self.INVALID_PARAMS, "params must be an array or object")
+        else:
+            import inspect
+            args, kwargs = (params, {}) if isinstance(params, list) else ([], params)
+            try:
+                inspect.signature(method).bind(*args, **kwargs)
+            except TypeError as e:
+                reply = self._error(request_id, self.INVALID_PARAMS, str(e))
+            else:
+                try:
+                    reply = {'jsonrpc': '2.0', 'id': request_id, 'result': method(*args, **kwargs)}
+                except Exception as e:
+                    logger.error(f"RPC {request['method']} failed: {e}", exc_info=True)
+                    reply = self._error(request_id, self.INTERNAL_ERROR, str(e))
+        return None if notification else reply
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+def check_installation(config):
+    """检查是否需要安装 - 检查配置文件和快捷方式"""
+    
+    # 如果用户之前选择跳过安装，直接进入主界面
+    if config.get('skip_install', False):
+        logger.info("User previously skipped installation")
+        return False
+    
+    # 如果快捷方式已创建且存在，直接进入主界面
+    if config.get('shortcut_created', False):
+        shortcut_path = config.get('shortcut_path')
+        if shortcut_path and os.path.exists(shortcut_path):
+            logger.info(f"Shortcut exists at: {shortcut_path}")
+            return False
+    
+    # 检查是否有桌面快捷方式
+    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
+    shortcut_path = os.path.join(desktop, SHORTCUT_NAME)
+    
+    if os.path.exists(shortcut_path):
+        logger.info(f"Desktop shortcut found at: {shortcut_path}")
+        # 更新配置
+        config.update({'shortcut_created': True, 'shortcut_path': shortcut_path})
+        return False
+    
+    # 需要安装
+    logger.info("Installation needed")
+    return True
+
+def run_headless(config, host, port, instance, urls=(), token=None):
+    """无界面运行：不创建窗口，与 GUI 共用同一套 Api 与下载、缓存组件，通过 JSON-RPC 服务调用
+
+    没有给出令牌时随机生成；地址与令牌写入仅当前用户可读的 INSTANCE_FILE（rpc_url、rpc_token）。
+    """
+    import secrets
+    token = token or secrets.token_urlsafe(24)
+    api = Api(None, config)
+    server = RpcServer(api, token, host, port)
+    server.start()
+    url = f"http://{f'[{host}]' if ':' in host else host}:{server.port}/"
+    instance.publish(rpc_url=url, rpc_token=token)
+    print(f"{APP_NAME} v{VERSION} headless: JSON-RPC on {url} (token: rpc_token in {instance.info_path})", flush=True)
+    api.on_started()
+    api.open_urls(urls)
+    instance.set_handler(api.handle_handoff)
+    # SIGTERM 按正常退出处理，atexit 中的缓存写盘与锁释放照常执行
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        logger.info("Headless server interrupted, shutting down")
+    finally:
+        server.stop()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=f"{APP_NAME} v{VERSION}")
+    parser.add_argument('--headless', action='store_true', help="不创建窗口，通过本机 JSON-RPC/HTTP 服务提供后端接口")
+    parser.add_argument('--host', default=RPC_HOST, help="--headless 时监听的地址")
+    parser.add_argument('--port', type=int, default=RPC_PORT, help="--headless 时监听的端口，0 表示随机")
+    parser.add_argument('--token', default=os.environ.get(RPC_TOKEN_ENV),
+                        help=f"--headless 时 JSON-RPC 的访问令牌，默认取环境变量 {RPC_TOKEN_ENV}，都没有时随机生成")
+    parser.add_argument('urls', nargs='*', help="要下载的链接；已有实例在运行时交给该实例")
+    args, _ = parser.parse_known_args()
+    if args.headless and not is_loopback(args.host) and not args.token:
+        parser.error(f"--host {args.host} 不是本机地址，必须用 --token 或 {RPC_TOKEN_ENV} 指定令牌")
+
+    # 已有实例在运行：转交命令行后退出，不读配置、不创建窗口
+    instance = InstanceLock()
+    if not instance.acquire():
+        if instance.forward(sys.argv[1:]):
+            logger.info("Another instance is running, handed off arguments")
+        else:
+            logger.warning("Another instance is running but did not respond")
+        return
+    atexit.register(instance.release)
+    instance.listen()
+
+    logger.info("=" * 50)
+    logger.info(f"CORE Music v{VERSION} starting")
+    logger.info(f"Python: {sys.version}")
+    logger.info(f"Platform: {sys.platform}")
+    logger.info(f"Current directory: {os.getcwd()}")
+    logger.info(f"Executable: {sys.executable}")
+
+    # 配置只读取一次，安装检查与 Api 共用同一个内存存储
+    config = ConfigStore()
+    atexit.register(config.close)
+    atexit.register(call_metrics.dump)
+
+    if args.headless:
+        logger.info(f"Running headless, RPC on {args.host}:{args.port}")
+        run_headless(config, args.host, args.port, instance, args.urls, args.token)
+        return
+
+    # 检查是否需要安装
+    needs_install = check_installation(config)
+    logger.info(f"Installation needed: {needs_install}")
+
+    # 根据是否需要安装选择HTML
+    if needs_install:
+        logger.info("Showing installation screen")
+        initial_html = INSTALLER_PAGE
+        window_title = f"{APP_NAME} v{VERSION} - 初始设置"
+    else:
+        logger.info("Showing main player screen")
+        initial_html = MAIN_PAGE
+        window_title = f"{APP_NAME} v{VERSION}"
+
+    import webview
 
     # 创建窗口
     window = webview.create_window(
@@ -611,21 +5124,17 @@ def main():
     )
 
     # 获取API实例并暴露方法
-    api = Api(window)
-    window.expose(
-        api.close_app,
-        api.download_file,
-        api.minimize_window,
-        api.maximize_window,
-        api.restore_window,
-        api.start_drag,
-        api.on_install_complete,
-        api.create_shortcut_option,
-        api.skip_installation
-    )
+    api = Api(window, config)
+    window.expose(*(getattr(api, name) for name in Api.WINDOW_METHODS + Api.RPC_METHODS))
 
     logger.info("Starting webview...")
-    webview.start(debug=False)
+    # 窗口出现后再续传下载、重扫曲库，并开始处理命令行与后续启动转发来的链接
+    def on_started():
+        api.on_started()
+        api.open_urls(args.urls)
+        instance.set_handler(api.handle_handoff)
+
+    webview.start(on_started, debug=False)
 
 if __name__ == '__main__':
     try: